@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+'''
+This file contains the tilt bias estimator, which learns the level control signal
+(ControlSignalCalibrated, the motor angles for zero tilt) while the maze runs, so the
+calibration phase (see control/calibrator.py) only has to be sat through once. Two kinds of
+sample are averaged into the estimate with an exponential moving average:
+ - While the ball rolls freely along an axis, the change in its filtered velocity (see
+   control/kalman_filter.py) between measurements gives the tilt it rolled on, by inverting
+   the ball model in ball_acceleration (objects.py). The average control signal acting on the
+   maze over that time (from the signals given to applied(), Delay after they were sent)
+   minus that tilt, converted to a motor angle, is where the maze would be level. A pair of
+   measurements is only used if the ball couldn't have reached a wall between them, as a
+   bounce changes the velocity without any tilt, and only on axes where the tilt is below
+   MaxTilt and has been steady for SettleTime, as the filtered velocity lags behind changes.
+ - While the ball is held still for HoldTime, staying within HoldDistance of where it stopped
+   and below HoldSpeed, the maze must be level, so the average control signal acting on it
+   over that time is a sample of the level. Passing through zero speed as the ball turns
+   around doesn't last long enough to count.
+The first samples are averaged equally with the calibration the estimate started from, which
+counts as PriorSamples samples. The estimate is saved to a JSON file. load() reads it back at
+the start of a later run, unless it is older than MaxAge, and the controller can be calibrated
+with it straight away. testing/bias_check.py checks it in simulation.
+'''
+
+# Import modules.
+import json
+import os
+import numpy as np
+from collections import deque
+from time import time
+
+# Import functions and settings.
+from objects import ball_acceleration
+from settings import BallRadius, ControlToTheta, SaturationLimit, BiasFile, BiasLearningRate, BiasMinSpeed, BiasHoldSpeed, BiasHoldTime, \
+    BiasHoldDistance, BiasMaxAge, ActuationDelay
+
+class BiasEstimator():
+
+    def __init__(self, Filename = BiasFile, Rate = BiasLearningRate, MinSpeed = BiasMinSpeed, HoldSpeed = BiasHoldSpeed, HoldTime = BiasHoldTime,
+                 HoldDistance = BiasHoldDistance, MaxAge = BiasMaxAge, Delay = ActuationDelay, MaxInterval = 0.2, SettleTime = 0.2, SteadyTilt = 0.01, MaxTilt = 0.05, PriorSamples = 20,
+                 DistanceField = None):
+        # DistanceField should be the maze's, see objects.py. It stops samples being taken while the ball is at or may have reached a wall.
+        self.Filename = Filename # JSON file the estimate is saved to.
+        self.Rate = Rate # Weight of each new sample in the moving average.
+        self.MinSpeed = MinSpeed # [mm/s] Speed along an axis above which the ball is rolling freely on it.
+        self.HoldSpeed = HoldSpeed # [mm/s] Speed below which the ball may be held still.
+        self.HoldTime = HoldTime # [s] Time the ball has to stay still for a sample.
+        self.HoldDistance = HoldDistance # [mm] Distance the ball may move while held still.
+        self.MaxAge = MaxAge # [s] Saved estimates older than this are ignored.
+        self.DistanceField = DistanceField
+        self.Delay = Delay # [s] Time from sending a control signal to the maze tilting.
+        self.MaxInterval = MaxInterval # [s] Longest time between measurements that are compared.
+        self.SettleTime = SettleTime # [s] Time the tilt has to be steady before measurements are compared.
+        self.SteadyTilt = SteadyTilt # [rad] Largest change in tilt that counts as steady.
+        self.MaxTilt = MaxTilt # [rad] Largest tilt compared, as the filtered velocity lags behind faster acceleration.
+        self.ControlHistory = deque() # (Time it starts acting, control signal), in order.
+        self.Previous = None # (Time, velocity, distance to the nearest wall) of the last measurement away from the walls.
+        self.Hold = None # (Time, position) where the ball was last seen to stop, None while it moves.
+        self.Bias = None # Level control signal, None until calibrated or loaded.
+        self.Samples = np.array([0, 0]) # Samples taken on each axis.
+        self.PriorSamples = PriorSamples # Number of samples a calibration is worth.
+
+    def __repr__(self):
+        # Makes the class printable.
+        return "BiasEstimator(Bias: %s, Samples: %s)" % (self.Bias, self.Samples)
+
+    def load(self):
+        # Reads the saved estimate. Returns True if there is one that isn't too old.
+        try:
+            with open(self.Filename) as BiasFile_:
+                Saved = json.load(BiasFile_)
+            if time() - Saved["Time"] > self.MaxAge:
+                return False
+            self.Bias = np.array(Saved["Bias"], dtype = float)
+        except (OSError, ValueError, KeyError):
+            return False
+        return True
+
+    def save(self):
+        # Writes the estimate, through a temporary file so an interruption never leaves a broken file.
+        if self.Bias is None:
+            return
+        with open(self.Filename + ".tmp", "w") as BiasFile_:
+            json.dump({"Bias" : self.Bias.tolist(), "Samples" : self.Samples.tolist(), "Time" : time()}, BiasFile_)
+        os.replace(self.Filename + ".tmp", self.Filename)
+
+    def start(self, ControlSignalCalibrated):
+        # Starts from a calibration, if there is no estimate yet.
+        if self.Bias is None:
+            self.Bias = np.array(ControlSignalCalibrated, dtype = float)
+
+    def sample(self, Sample, Axes):
+        # Moves the estimate towards Sample on the chosen axes.
+        Sample = np.clip(Sample, - SaturationLimit, SaturationLimit)
+        self.Samples = self.Samples + Axes
+        Rate = np.maximum(self.Rate, 1 / (self.Samples + self.PriorSamples)) # A plain mean of the first samples, then a moving average.
+        self.Bias = np.where(Axes, self.Bias + Rate * (Sample - self.Bias), self.Bias)
+
+    def applied(self, Time, ControlSignal):
+        # Records a control signal sent to the motors at Time.
+        self.ControlHistory.append((Time + self.Delay, np.array(ControlSignal, dtype = float)))
+
+    def mean_signal(self, StartTime, EndTime):
+        # Time average, lowest and highest value on each axis of the control signal acting on the maze between StartTime and EndTime,
+        # or None if it isn't known.
+        if len(self.ControlHistory) == 0 or self.ControlHistory[0][0] > StartTime:
+            return None
+        Total, Lowest, Highest = np.array([0.0, 0.0]), np.array([np.inf, np.inf]), np.array([- np.inf, - np.inf])
+        for Index, (ActingTime, ControlSignal) in enumerate(self.ControlHistory):
+            NextTime = self.ControlHistory[Index + 1][0] if Index + 1 < len(self.ControlHistory) else np.inf
+            if NextTime > StartTime:
+                Total += ControlSignal * max(min(NextTime, EndTime) - max(ActingTime, StartTime), 0)
+                Lowest, Highest = np.minimum(Lowest, ControlSignal), np.maximum(Highest, ControlSignal)
+            if NextTime >= EndTime:
+                break
+        return Total / (EndTime - StartTime), Lowest, Highest
+
+    def forget(self, Time):
+        # Drops the control signals replaced before Time, which are never needed again.
+        while len(self.ControlHistory) > 1 and self.ControlHistory[1][0] <= Time:
+            self.ControlHistory.popleft()
+
+    def update(self, Time, Position, Velocity, ControlSignalCalibrated):
+        '''
+        Adds the samples available from a new measurement. Time is when the ball was at Position
+        with Velocity (e.g. the Kalman filter's latest state) and ControlSignalCalibrated the
+        level the controller is using. Returns the estimate.
+        '''
+        if self.Bias is None:
+            self.start(ControlSignalCalibrated)
+        Position = np.array(Position, dtype = float)
+        Velocity = np.array(Velocity, dtype = float)
+        Previous = self.Previous
+        self.Previous = None
+        Clearance = self.DistanceField.wall_distance(Position) - BallRadius if self.DistanceField != None else np.inf
+        if Clearance < 1:
+            self.Hold = None
+            return self.Bias # Touching a wall, so neither the ball's motion nor a held ball tells anything about the tilt.
+        self.Previous = (Time, Velocity, Clearance)
+
+        # Rolling freely since the last measurement: invert dv/dt = g sin(theta) - drag(v) for the tilt.
+        if Previous != None and 0 < Time - Previous[0] <= self.MaxInterval:
+            TimeStep = Time - Previous[0]
+            MeanVelocity = (Velocity + Previous[1]) / 2
+            Rolling = np.abs(MeanVelocity) > self.MinSpeed
+            Signal = self.mean_signal(Previous[0], Time)
+            Settled = self.mean_signal(Previous[0] - self.SettleTime, Time)
+            if Signal != None and Settled != None:
+                # Only axes where the tilt has been steady long enough for the filtered velocity to follow it.
+                Steady = (Settled[2] - Settled[1]) * ControlToTheta <= self.SteadyTilt
+                Rolling = Rolling & Steady & (np.abs(Signal[0] - self.Bias) * ControlToTheta <= self.MaxTilt)
+                # Furthest the ball could have rolled from either measurement. If a wall is closer, it may have bounced in between.
+                TiltBound = np.max(np.maximum(np.abs(Signal[1] - self.Bias), np.abs(Signal[2] - self.Bias)) * ControlToTheta) + 0.05 # [rad] With a margin for the estimate's error.
+                Reach = max(np.hypot(*Velocity), np.hypot(*Previous[1])) * TimeStep + 9810 * np.sin(min(TiltBound, np.pi / 2)) * TimeStep ** 2 / 2
+                if np.any(Rolling) and min(Clearance, Previous[2]) > Reach + 1:
+                    DragAcceleration = ball_acceleration(np.array([0.0, 0.0]), MeanVelocity) # The model's acceleration on a level maze.
+                    Theta = np.arcsin(np.clip(((Velocity - Previous[1]) / TimeStep - DragAcceleration) / 9810, -1, 1))
+                    self.sample(Signal[0] - Theta / ControlToTheta, Rolling)
+
+        # Held still for HoldTime: the control signal acting on the maze over that time holds it level.
+        if self.Hold == None or np.hypot(*Velocity) >= self.HoldSpeed or np.hypot(*(Position - self.Hold[1])) > self.HoldDistance:
+            self.Hold = (Time, Position) if np.hypot(*Velocity) < self.HoldSpeed else None
+        elif Time - self.Hold[0] >= self.HoldTime:
+            Signal = self.mean_signal(self.Hold[0], Time)
+            if Signal != None:
+                self.sample(Signal[0], np.array([True, True]))
+            self.Hold = (Time, Position) # The next sample starts here.
+
+        self.forget(min(Time - self.SettleTime, self.Hold[0] if self.Hold != None else Time))
+        return self.Bias
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
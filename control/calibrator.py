@@ -3,11 +3,15 @@
 This file contains a class for the control calibration system. If all input positions
 are within the calibration tolerane of the last position in the buffer, self.CalibrationDone
 is outputted as True and the average of the input control signals over this time is outputted
-as
+as self.ControlSignalCalibrated. The buffer holds the last CalibrationTime seconds of inputs.
+Monotonic deques of the buffer's x and y positions give its minimum and maximum, and a running
+sum gives the average control signal, so each update takes the same time however many inputs
+the buffer holds.
 '''
 
 # Import modules.
 import numpy as np
+from collections import deque
 
 # Import settings.
 from settings import CalibrationTolerance, CalibrationTime
@@ -16,37 +20,54 @@ class Calibrator():
 
     def __init__(self):
         # Initialise buffers and ouputs.
-        self.PositionBuffer = []
-        self.ThetaBuffer = []
-        self.TimeBuffer = []
+        self.PositionBuffer = deque()
+        self.TimeBuffer = deque()
+        self.ThetaBuffer = deque()
+        self.ThetaSum = np.array([0.0, 0.0]) # Sum of the control signals in ThetaBuffer.
+        self.Minimum = (deque(), deque()) # (Input number, value) with increasing values, for x and y. The front is the buffer's minimum.
+        self.Maximum = (deque(), deque()) # (Input number, value) with decreasing values, for x and y. The front is the buffer's maximum.
+        self.Inputs = 0 # Number of inputs added so far.
         self.ControlSignalCalibrated = np.array([0, 0])
         self.CalibrationDone = False
 
     def __repr__(self):
         # Makes the class printable.
-        return "PID Controller(Kp: %s, Ki: %s, Kd: %s, Set Point: %s)" % (self.Kp, self.Ki, self.Kd, self.SetPoint)
+        return "Calibrator(Buffered: %s, Calibration Done: %s, Control Signal Calibrated: %s)" % (len(self.TimeBuffer), self.CalibrationDone, self.ControlSignalCalibrated)
 
     def update(self, Position, Theta, Time):
         # Add inputs to buffers.
+        Theta = np.array(Theta, dtype = float)
         self.PositionBuffer.append(Position)
         self.ThetaBuffer.append(Theta)
         self.TimeBuffer.append(Time)
+        self.ThetaSum += Theta
+        for Axis in range(2):
+            while len(self.Minimum[Axis]) > 0 and self.Minimum[Axis][-1][1] >= Position[Axis]:
+                self.Minimum[Axis].pop()
+            self.Minimum[Axis].append((self.Inputs, Position[Axis]))
+            while len(self.Maximum[Axis]) > 0 and self.Maximum[Axis][-1][1] <= Position[Axis]:
+                self.Maximum[Axis].pop()
+            self.Maximum[Axis].append((self.Inputs, Position[Axis]))
+        self.Inputs += 1
         # If buffer is filled over CalibrationTime, remove the last values and initialise CalibrationDone.
         if Time - self.TimeBuffer[0] > CalibrationTime:
-            self.PositionBuffer.pop(0)
-            self.ThetaBuffer.pop(0)
-            self.TimeBuffer.pop(0)
+            self.PositionBuffer.popleft()
+            self.ThetaSum -= self.ThetaBuffer.popleft()
+            self.TimeBuffer.popleft()
+            Removed = self.Inputs - len(self.TimeBuffer) - 1 # Input number of the removed values.
+            for Extremes in self.Minimum + self.Maximum:
+                if Extremes[0][0] == Removed:
+                    Extremes.popleft()
             self.CalibrationDone = True
         # CalibrationDone doesn't remain true unless CalibrationTolerance is met.
         self.ReferencePosition = self.PositionBuffer[0]
-        for Position in self.PositionBuffer:
-            if (Position[0] - self.ReferencePosition[0]) ** 2 > CalibrationTolerance ** 2:
+        for Axis in range(2):
+            Furthest = max(self.Maximum[Axis][0][1] - self.ReferencePosition[Axis], self.ReferencePosition[Axis] - self.Minimum[Axis][0][1])
+            if Furthest ** 2 > CalibrationTolerance ** 2:
                 self.CalibrationDone = False
-            elif (Position[1] - self.ReferencePosition[1]) ** 2 > CalibrationTolerance ** 2:
-                self.CalibrationDone = False
-        # Calculate ControlSignalCalibrated if CalibrationDone is true. 
+        # Calculate ControlSignalCalibrated if CalibrationDone is true.
         if self.CalibrationDone == True:
-            self.ControlSignalCalibrated = sum(self.ThetaBuffer) / len(self.ThetaBuffer)
+            self.ControlSignalCalibrated = self.ThetaSum / len(self.ThetaBuffer)
 
         return self.CalibrationDone, self.ControlSignalCalibrated
 
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+'''
+This file contains a class for a compiled checkpoint route. A list of Checkpoint objects is
+converted once into contiguous arrays of positions, radii, hold times and hard control signals,
+with the defaults from settings.py filled in for normal checkpoints, together with the
+cumulative arc length along the route for look-ahead skipping. Gains is the gain schedule: one
+row of GainNames per checkpoint, used by the PID controller while the ball heads for that
+checkpoint, with NaN where the controller's own gain applies. The set point handler,
+PID controller and graphics all refer to a checkpoint by its index in the route, so nothing
+has to be removed from a list as the ball moves along the route.
+'''
+
+# Import modules.
+import numpy as np
+
+# PID gains that can be scheduled per checkpoint, in the order of the columns of CheckpointRoute.Gains.
+GainNames = ("Kp", "Ki", "Kd", "PMax", "Ks", "Kst")
+
+class CheckpointRoute():
+
+    def __init__(self, Checkpoints, CheckpointRadius, SetPointTime):
+        # Checkpoints should be given in a list of Checkpoint objects, in order.
+        if len(Checkpoints) == 0:
+            raise ValueError("No checkpoints found.")
+
+        self.Length = len(Checkpoints) # Number of checkpoints in the route.
+        self.Positions = np.zeros((self.Length, 2)) # [mm]
+        self.Radii = np.full(self.Length, float(CheckpointRadius)) # [mm] How close the ball has to be to each checkpoint.
+        self.Times = np.full(self.Length, float(SetPointTime)) # [s] Time the ball has to stay within each checkpoint.
+        self.Special = np.zeros(self.Length, dtype = bool) # True if the checkpoint has custom settings.
+        self.HardControlSignals = np.full((self.Length, 2), np.nan) # Custom control signal output, NaN where there is none.
+        self.Gains = np.full((self.Length, len(GainNames)), np.nan) # Gains on the way to each checkpoint, NaN where there is none.
+
+        for Index, checkpoint in enumerate(Checkpoints):
+            self.Positions[Index] = checkpoint.S
+            if checkpoint.Special == True:
+                self.Special[Index] = True
+                if checkpoint.Radius != None:
+                    self.Radii[Index] = checkpoint.Radius
+                if checkpoint.Time != None:
+                    self.Times[Index] = checkpoint.Time
+                if checkpoint.HardControlSignal is not None:
+                    for Axis in range(2):
+                        if checkpoint.HardControlSignal[Axis] != None:
+                            self.HardControlSignals[Index, Axis] = checkpoint.HardControlSignal[Axis]
+            if checkpoint.Gains != None:
+                for Name, Value in checkpoint.Gains.items():
+                    if Name not in GainNames:
+                        raise ValueError("Unknown gain '%s', use one of %s." % (Name, ", ".join(GainNames)))
+                    self.Gains[Index, GainNames.index(Name)] = Value
+
+        # Route index for look-ahead set point skipping.
+        self.Segments = np.diff(self.Positions, axis = 0) # [mm] Vector from each checkpoint to the next.
+        self.SegmentLengthsSquared = np.sum(self.Segments ** 2, axis = 1) # [mm^2]
+        self.ArcLength = np.concatenate(([0.0], np.cumsum(np.sqrt(self.SegmentLengthsSquared)))) # [mm] Distance along the route to each checkpoint.
+        self.Skippable = (self.Special == False) & (self.Times == 0) # Checkpoints that don't need to be held or have a custom control signal.
+        self.NextFixed = np.full(self.Length, self.Length - 1) # Index of the next checkpoint (inclusive) that can't be skipped. The end point is never skipped.
+        for Index in range(self.Length - 2, -1, -1):
+            self.NextFixed[Index] = Index if self.Skippable[Index] == False else self.NextFixed[Index + 1]
+
+    def __repr__(self):
+        # Makes the class printable.
+        return "CheckpointRoute(Length: %s, Positions: %s)" % (self.Length, np.round(self.Positions, 1))
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
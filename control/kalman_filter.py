@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+'''
+This file contains a constant-acceleration Kalman filter for the ball's position, velocity and
+acceleration, fed with timestamped position measurements. Both axes have the same model and
+are measured at the same times, so they share one 3x3 covariance matrix and the state is a
+3x2 array (rows: position, velocity, acceleration; columns: x, y), which keeps each update to
+a few small matrix products. Call update(Time, Position) with every measurement, or with
+Position None when the ball wasn't found; the filter then bridges the gap by extrapolating
+its state, until no measurement has arrived for Timeout seconds. The filtered position and
+velocity can be given to PID_Controller.update in place of the raw position and the
+regression derivative.
+'''
+
+# Import modules.
+import numpy as np
+
+# Import settings.
+from settings import KalmanProcessNoise, KalmanMeasurementNoise
+
+class KalmanFilter():
+
+    def __init__(self, ProcessNoise = KalmanProcessNoise, MeasurementNoise = KalmanMeasurementNoise, Timeout = 1):
+        # Timeout should normally be the image processor's WaitTime, see image_detection/image_detection.py.
+        self.ProcessNoise = ProcessNoise # [mm^2/s^5] Spectral density of the random jerk.
+        self.MeasurementVariance = MeasurementNoise ** 2 # [mm^2]
+        self.Timeout = Timeout # [s] Longest time to extrapolate without a measurement.
+        self.reset()
+
+    def __repr__(self):
+        # Makes the class printable.
+        return "KalmanFilter(Position: %s, Velocity: %s, Time: %s)" % (np.round(self.State[0], 1), np.round(self.State[1], 1), self.Time)
+
+    def reset(self):
+        # Forgets the state. The next measurement starts the filter again.
+        self.State = np.zeros((3, 2)) # Position [mm], velocity [mm/s] and acceleration [mm/s^2] in x and y.
+        self.Covariance = np.zeros((3, 3)) # Shared by both axes.
+        self.Time = None # [s] Time of the last measurement, None before the first.
+        self.Active = False # True while the estimate is based on a recent measurement.
+        self.Position = None # [mm] Latest output.
+        self.Velocity = None # [mm/s] Latest output.
+
+    def transition(self, TimeStep):
+        # Constant-acceleration state transition and process noise over a time-step.
+        T = TimeStep
+        Transition = np.array([[1, T, T ** 2 / 2], [0, 1, T], [0, 0, 1]])
+        ProcessCovariance = self.ProcessNoise * np.array([[T ** 5 / 20, T ** 4 / 8, T ** 3 / 6], [T ** 4 / 8, T ** 3 / 3, T ** 2 / 2], [T ** 3 / 6, T ** 2 / 2, T]])
+        return Transition, ProcessCovariance
+
+    def estimate(self, Time):
+        # Extrapolates the state to Time without changing it. Returns (Active, Position, Velocity).
+        if self.Time == None:
+            return False, None, None
+        TimeStep = Time - self.Time
+        Position = self.State[0] + self.State[1] * TimeStep + self.State[2] * TimeStep ** 2 / 2
+        Velocity = self.State[1] + self.State[2] * TimeStep
+        return TimeStep <= self.Timeout, Position, Velocity
+
+    def update(self, Time, Position):
+        # Adds a measurement taken at Time, or bridges a missed one if Position is None. Returns (Active, Position, Velocity).
+        if Position is None or (self.Time != None and Time < self.Time): # Missed, or older than the last measurement.
+            self.Active, self.Position, self.Velocity = self.estimate(Time)
+            return self.Active, self.Position, self.Velocity
+
+        if self.Time == None or Time - self.Time > self.Timeout: # First measurement, or lost for too long: start again.
+            self.State = np.array([Position, [0.0, 0.0], [0.0, 0.0]], dtype = float)
+            self.Covariance = np.diag([self.MeasurementVariance, 1e4, 1e6]) # Velocity and acceleration unknown.
+        else:
+            # Predict.
+            Transition, ProcessCovariance = self.transition(Time - self.Time)
+            self.State = Transition @ self.State
+            self.Covariance = Transition @ self.Covariance @ Transition.T + ProcessCovariance
+
+            # Correct. Only position is measured, so the innovation covariance is a scalar.
+            Gain = self.Covariance[:, 0] / (self.Covariance[0, 0] + self.MeasurementVariance)
+            self.State += np.outer(Gain, Position - self.State[0])
+            self.Covariance -= np.outer(Gain, self.Covariance[0])
+
+        self.Time = Time
+        self.Active, self.Position, self.Velocity = True, self.State[0].copy(), self.State[1].copy()
+        return self.Active, self.Position, self.Velocity
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+'''
+This file contains the model-predictive controller, an alternative to the PID controller with
+the same interface (calibrate, new_setpoint, reset and update, which returns the control
+signal and zero P, I, D and static boost terms). Every tick it rolls out the ball model (see
+ball_acceleration in objects.py) for Candidates tilt sequences of Horizon steps at once, as
+one batch of NumPy arrays. Candidates are the best sequence from the last tick shifted by one
+step, a grid of constant tilts and random variations of the best sequence. Each rollout is
+scored by its squared distance to the set point and speed at each step, the tilt used, and
+the maze's distance field: the ball stops where it would enter a wall, gets a growing cost
+within HoleDangerDistance of a hole and HolePenalty if it falls in. The first tilt of the
+cheapest sequence is applied. Hard control signals in the route are ignored, as they were
+tuned by hand for the PID controller.
+
+The rollout needs the ball's velocity. Give update() an estimate (e.g. from
+control/kalman_filter.py), otherwise the controller filters the positions itself.
+'''
+
+# Import modules.
+import numpy as np
+
+# Import classes, functions and settings.
+from objects import ball_acceleration
+from control.kalman_filter import KalmanFilter
+from settings import BallRadius, HoleDangerDistance, ControlToTheta, MPCCandidates, MPCHorizon, MPCStepTime, MPCMaxTheta, MPCEffortWeight, \
+    MPCVelocityWeight, MPCHolePenalty
+
+class MPC_Controller():
+
+    def __init__(self, Route, SaturationLimit, DistanceField, Candidates = MPCCandidates, Horizon = MPCHorizon, StepTime = MPCStepTime, MaxTheta = MPCMaxTheta,
+                 EffortWeight = MPCEffortWeight, VelocityWeight = MPCVelocityWeight, HolePenalty = MPCHolePenalty, Substeps = 2, Seed = 0):
+        # Route should be a CheckpointRoute and DistanceField the maze's, see objects.py. SaturationLimit as for the PID controller.
+        self.Route = Route # Compiled checkpoint route.
+        self.SetPointIndex = 0 # Index of the current set point in the route.
+        self.SetPoint = Route.Positions[0] # Current set point.
+        self.SaturationLimit = SaturationLimit # Control signal maximum angle limit.
+        self.DistanceField = DistanceField
+        self.Candidates = Candidates # Tilt sequences evaluated per tick.
+        self.Horizon = Horizon # Steps in each sequence.
+        self.StepTime = StepTime # [s] Time each tilt in a sequence is held.
+        self.Substeps = Substeps # Integration steps per sequence step.
+        self.MaxTheta = np.minimum(MaxTheta, SaturationLimit * ControlToTheta) # [rad] Largest tilt considered on each axis.
+        self.EffortWeight = EffortWeight # Cost of tilt, per rad^2.
+        self.VelocityWeight = VelocityWeight # Cost of speed at each step, per (mm/s)^2.
+        self.HolePenalty = HolePenalty # Cost of falling in a hole.
+        self.Generator = np.random.default_rng(Seed) # Seeded, so runs can be repeated.
+
+        # Constant tilt sequences on a 5 x 5 grid, always among the candidates.
+        Grid = np.linspace(-1, 1, 5)
+        self.ConstantTilts = np.stack(np.meshgrid(Grid, Grid), axis = -1).reshape(-1, 1, 2) * self.MaxTheta
+        if Candidates <= len(self.ConstantTilts):
+            raise ValueError("Candidates should be more than %s." % (len(self.ConstantTilts)))
+
+        self.Estimator = KalmanFilter() # Used when update() isn't given a velocity.
+        self.Time = 0.0 # [s] Sum of the time-steps, for the estimator.
+        self.Calibrated = False # Initialise as not calibrated.
+        self.ControlSignalCalibrated = np.array([0, 0]) # Theta for zero tilt. Change after calibration.
+        self.reset()
+
+    def __repr__(self):
+        # Makes the class printable.
+        return "MPC Controller(Candidates: %s, Horizon: %s, Set Point: %s, Cost: %s)" % (self.Candidates, self.Horizon, self.SetPoint, round(float(self.Cost), 1))
+
+    def new_setpoint(self, SetPointIndex):
+        self.SetPointIndex = SetPointIndex
+        self.SetPoint = self.Route.Positions[SetPointIndex] # Set new set point.
+
+    def calibrate(self, ControlSignalCalibrated):
+        # Theta for zero tilt. Change after calibration.
+        self.ControlSignalCalibrated = ControlSignalCalibrated
+        self.Calibrated = True
+        self.reset()
+
+    def reset(self):
+        self.BestSequence = np.zeros((self.Horizon, 2)) # [rad] Cheapest tilt sequence found so far.
+        self.Cost = 0.0 # Cost of the cheapest sequence in the last update.
+        self.Saturation = np.array([False, False]) # Initialise saturation check.
+        self.Estimator.reset()
+
+    def candidates(self):
+        # Tilt sequences to evaluate, shape (Candidates, Horizon, 2).
+        WarmStart = np.concatenate((self.BestSequence[1:], self.BestSequence[-1:])) # Last best sequence, one step on.
+        Constant = np.repeat(self.ConstantTilts, self.Horizon, axis = 1)
+        RandomCount = self.Candidates - 1 - len(Constant)
+        Random = WarmStart + self.Generator.normal(0, 0.3, (RandomCount, self.Horizon, 2)) * self.MaxTheta
+        Sequences = np.concatenate((WarmStart[None], Constant, Random))
+        return np.clip(Sequences, - self.MaxTheta, self.MaxTheta)
+
+    def rollout(self, Position, Velocity, Sequences):
+        # Simulates every sequence from the same state. Returns the cost of each.
+        Count = len(Sequences)
+        S = np.broadcast_to(Position, (Count, 2)).copy()
+        v = np.broadcast_to(Velocity, (Count, 2)).copy()
+        Fallen = np.zeros(Count, dtype = bool)
+        Cost = self.EffortWeight * np.sum(Sequences ** 2, axis = (1, 2))
+        TimeStep = self.StepTime / self.Substeps
+        for Step in range(self.Horizon):
+            Theta = Sequences[:, Step]
+            for _ in range(self.Substeps):
+                NewV = v + ball_acceleration(Theta, v) * TimeStep
+                NewS = S + (v + NewV) * TimeStep / 2
+                WallDistance, HoleDistance = self.DistanceField.distances(NewS)
+                Blocked = (WallDistance < BallRadius)[:, None] | Fallen[:, None] # The ball stops at walls, and in holes.
+                S = np.where(Blocked, S, NewS)
+                v = np.where(Blocked, 0.0, NewV)
+                Fallen |= HoleDistance < 0
+            Cost += np.sum((S - self.SetPoint) ** 2, axis = 1) + self.VelocityWeight * np.sum(v ** 2, axis = 1)
+            Cost += self.HolePenalty * 1e-2 * np.maximum(1 - HoleDistance / HoleDangerDistance, 0) ** 2 # Close to a hole.
+        Cost += self.HolePenalty * Fallen
+        return Cost
+
+    def saturation_clamp(self, ControlSignal):
+        # Limits the ControlSignal to the SaturationLimit and records if saturation has occured.
+        self.Saturation = np.abs(ControlSignal) > self.SaturationLimit
+        return np.clip(ControlSignal, - self.SaturationLimit, self.SaturationLimit)
+
+    def update(self, ProcessVariable, TimeStep, Velocity = None):
+        self.Time += TimeStep
+        if Velocity is None:
+            _, _, Velocity = self.Estimator.update(self.Time, ProcessVariable)
+
+        Sequences = self.candidates()
+        Costs = self.rollout(ProcessVariable, Velocity, Sequences)
+        Best = np.argmin(Costs)
+        self.BestSequence, self.Cost = Sequences[Best], Costs[Best]
+
+        ControlSignal = self.BestSequence[0] / ControlToTheta + self.ControlSignalCalibrated # Convert tilt to motor angle.
+        ControlSignal = self.saturation_clamp(ControlSignal)
+
+        Zero = np.array([0.0, 0.0])
+        return ControlSignal, Zero, Zero.copy(), Zero.copy(), Zero.copy()
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
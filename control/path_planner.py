@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+'''
+This file contains the checkpoint route planner. The walls and holes of a maze are rasterised
+into an occupancy grid, with walls grown by the ball radius and holes grown by the distance at
+which the ball falls in, both plus a clearance. A* then finds the shortest 8-connected path
+from the ball's start to the goal, and the path is shortened to the fewest straight segments
+that stay clear of the grown walls and holes. plan_route(Maze) returns the route as a list of
+Checkpoint objects; grids and routes are cached per maze geometry.
+'''
+
+# Import modules.
+import heapq
+import numpy as np
+from math import sqrt
+
+# Import classes and settings.
+from objects import Checkpoint
+from settings import FrameSize, BallRadius, PlannerResolution, PlannerClearance
+
+# Caches of occupancy grids and planned routes, keyed by maze geometry and settings.
+Planners = {}
+PlannedRoutes = {}
+
+class PathPlanner():
+
+    def __init__(self, Geometry, Resolution = PlannerResolution, Clearance = PlannerClearance):
+        # Geometry should be a MazeGeometry, see objects.py. Resolution and clearance in mm.
+        self.Resolution = Resolution # [mm] Size of each grid cell.
+        self.Clearance = Clearance # [mm] Extra distance to keep from walls and holes.
+        self.Shape = (int(np.ceil(FrameSize[1] / Resolution)), int(np.ceil(FrameSize[0] / Resolution))) # (Rows, columns).
+        X = (np.arange(self.Shape[1]) + 0.5) * Resolution # [mm] Cell centres.
+        Y = (np.arange(self.Shape[0]) + 0.5) * Resolution
+
+        # Rasterise walls grown by the ball radius into the grid.
+        self.Blocked = np.zeros(self.Shape, dtype = bool)
+        WallMargin = (BallRadius + Clearance) ** 2
+        for Left, Top, Right, Bottom in Geometry.WallBounds:
+            Dx = np.maximum(np.maximum(Left - X, X - Right), 0) # Distance outside the wall in x.
+            Dy = np.maximum(np.maximum(Top - Y, Y - Bottom), 0)
+            self.Blocked |= Dy[:, None] ** 2 + Dx[None, :] ** 2 < WallMargin
+
+        # Rasterise holes grown by the distance at which the ball falls in (see Ball.hole_collision).
+        for Position, Radius in zip(Geometry.HolePositions, Geometry.HoleRadii):
+            HoleMargin = (Radius + 1 + Clearance) ** 2
+            self.Blocked |= (Y[:, None] - Position[1]) ** 2 + (X[None, :] - Position[0]) ** 2 < HoleMargin
+
+    def __repr__(self):
+        # Makes the class printable.
+        return "PathPlanner(Resolution: %s, Shape: %s, Blocked: %s)" % (self.Resolution, self.Shape, np.count_nonzero(self.Blocked))
+
+    def cell(self, Position):
+        # Grid cell (row, column) containing a position in mm.
+        Row = min(max(int(Position[1] // self.Resolution), 0), self.Shape[0] - 1)
+        Column = min(max(int(Position[0] // self.Resolution), 0), self.Shape[1] - 1)
+        return Row, Column
+
+    def position(self, Cell):
+        # Centre of a grid cell in mm.
+        return (np.array([Cell[1], Cell[0]]) + 0.5) * self.Resolution
+
+    def nearest_free_cell(self, Cell):
+        # Hand-placed start and end points can sit inside the grown walls, so move them to the closest free cell.
+        if self.Blocked[Cell] == False:
+            return Cell
+        FreeRows, FreeColumns = np.nonzero(self.Blocked == False)
+        if len(FreeRows) == 0:
+            raise ValueError("The maze has no free space for the ball.")
+        Nearest = np.argmin((FreeRows - Cell[0]) ** 2 + (FreeColumns - Cell[1]) ** 2)
+        return int(FreeRows[Nearest]), int(FreeColumns[Nearest])
+
+    def a_star(self, StartCell, GoalCell):
+        # A* over 8-connected cells. Diagonal moves may not cut blocked corners. Returns a list of cells or None.
+        Rows, Columns = self.Shape
+        Free = (self.Blocked == False).ravel().tolist()
+        Start = StartCell[0] * Columns + StartCell[1]
+        Goal = GoalCell[0] * Columns + GoalCell[1]
+        GoalRow, GoalColumn = GoalCell
+        Moves = ((-1, 0, 1.0), (1, 0, 1.0), (0, -1, 1.0), (0, 1, 1.0), (-1, -1, sqrt(2)), (-1, 1, sqrt(2)), (1, -1, sqrt(2)), (1, 1, sqrt(2)))
+
+        Cost = [float("inf")] * (Rows * Columns)
+        Cost[Start] = 0.0
+        Parent = {Start : None}
+        Open = [(0.0, Start)]
+        Closed = bytearray(Rows * Columns)
+        while len(Open) > 0:
+            _, Current = heapq.heappop(Open)
+            if Current == Goal:
+                Path = []
+                while Current != None:
+                    Path.append(divmod(Current, Columns))
+                    Current = Parent[Current]
+                return Path[::-1]
+            if Closed[Current] == 1:
+                continue
+            Closed[Current] = 1
+
+            Row, Column = divmod(Current, Columns)
+            for dRow, dColumn, StepCost in Moves:
+                NewRow, NewColumn = Row + dRow, Column + dColumn
+                if NewRow < 0 or NewRow >= Rows or NewColumn < 0 or NewColumn >= Columns:
+                    continue
+                Next = NewRow * Columns + NewColumn
+                if Free[Next] == False:
+                    continue
+                if dRow != 0 and dColumn != 0 and (Free[Row * Columns + NewColumn] == False or Free[NewRow * Columns + Column] == False):
+                    continue # No corner cutting.
+                NewCost = Cost[Current] + StepCost
+                if NewCost < Cost[Next]:
+                    Cost[Next] = NewCost
+                    Parent[Next] = Current
+                    dx, dy = abs(NewColumn - GoalColumn), abs(NewRow - GoalRow)
+                    Heuristic = max(dx, dy) + (sqrt(2) - 1) * min(dx, dy) # Octile distance.
+                    heapq.heappush(Open, (NewCost + Heuristic, Next))
+        return None
+
+    def line_of_sight(self, StartCell, EndCell):
+        # True if the straight line between two cell centres only crosses free cells.
+        Steps = int(max(abs(EndCell[0] - StartCell[0]), abs(EndCell[1] - StartCell[1])) * 2) + 1
+        Rows = np.rint(np.linspace(StartCell[0], EndCell[0], Steps + 1)).astype(int)
+        Columns = np.rint(np.linspace(StartCell[1], EndCell[1], Steps + 1)).astype(int)
+        return np.any(self.Blocked[Rows, Columns]) == False
+
+    def simplify(self, Path):
+        # Keep only the cells needed for straight, collision free segments.
+        Simplified = [Path[0]]
+        Current = 0
+        while Current < len(Path) - 1:
+            Next = Current + 1
+            while Next + 1 < len(Path) and self.line_of_sight(Path[Current], Path[Next + 1]) == True:
+                Next += 1
+            Simplified.append(Path[Next])
+            Current = Next
+        return Simplified
+
+    def plan(self, Start, Goal):
+        # Returns a list of waypoints in mm from Start to Goal.
+        StartCell = self.nearest_free_cell(self.cell(Start))
+        GoalCell = self.nearest_free_cell(self.cell(Goal))
+        Path = self.a_star(StartCell, GoalCell)
+        if Path == None:
+            raise ValueError("No route found from %s to %s." % (np.round(Start, 1), np.round(Goal, 1)))
+        return [self.position(Cell) for Cell in self.simplify(Path)]
+
+def plan_route(Maze, Goal = None, Resolution = PlannerResolution, Clearance = PlannerClearance):
+    # Plans a checkpoint route from the maze's ball to Goal (default: the maze's last checkpoint). Returns a list of Checkpoint objects.
+    if Goal is None:
+        if len(Maze.Checkpoints) == 0:
+            raise ValueError("No goal given and the maze has no checkpoints.")
+        Goal = Maze.Checkpoints[-1].S
+    Start = Maze.Ball.S
+
+    Key = (Maze.Geometry, Resolution, Clearance)
+    if Key not in Planners:
+        Planners[Key] = PathPlanner(Maze.Geometry, Resolution, Clearance)
+    RouteKey = Key + (tuple(np.round(Start, 3)), tuple(np.round(Goal, 3)))
+    if RouteKey not in PlannedRoutes:
+        PlannedRoutes[RouteKey] = Planners[Key].plan(Start, Goal)
+    return [Checkpoint(Position.copy()) for Position in PlannedRoutes[RouteKey]]
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -2,8 +2,12 @@
 '''
 This file contains a class for the PID controller system, including all memory elements
 and functions needed to calculate the control signal. Initialise the class with the chosen
-settings and the initial set point. Change the set point with new_setpoint(SetPoint); this
-also resets the memory elements. update(ProcessVariable, TimeStep) outputs the control signal.
+settings and the compiled checkpoint route (see control/checkpoint_route.py). Change the set
+point with new_setpoint(SetPointIndex), using the index from the set point handler; this also
+resets the memory elements and switches to the route's scheduled gains for that checkpoint,
+if it has any. update(ProcessVariable, TimeStep) outputs the control signal. If a
+velocity estimate is given (e.g. from control/kalman_filter.py), it is used for the derivative
+term instead of the regression over the error buffer.
 '''
 
 # Import modules.
@@ -12,8 +16,9 @@ from math import pi
 
 class PID_Controller():
 
-    def __init__(self, Kp, Ki, Kd, PMax, Ks, Kst, SetPoint, BufferSize, SaturationLimit, MinTheta):
-        # SetPoint and SaturationLimit should be provided in a numpy vector, Size 2.
+    def __init__(self, Kp, Ki, Kd, PMax, Ks, Kst, Route, BufferSize, SaturationLimit, MinTheta, DistanceField = None, Kr = 0, HoleDangerDistance = 0):
+        # Route should be a CheckpointRoute. SaturationLimit should be provided in a numpy vector, Size 2.
+        # DistanceField (see objects.py) is only needed for hole repulsion.
 
         self.Kp = Kp # Proportional coefficient.
         self.PMax = PMax # Maximum proportional term allowed.
@@ -21,8 +26,14 @@ class PID_Controller():
         self.Kd = Kd # Derivative coefficient.
         self.Ks = Ks # Static boost coefficient.
         self.Kst = Kst # Static boost length coefficient. Higher numbers produce a shorter static boost.
-        self.SetPoint = SetPoint.S # Current set point.
-        self.Special = False # Normal set point by default.
+        self.Route = Route # Compiled checkpoint route.
+        self.BaseGains = np.array([Kp, Ki, Kd, PMax, Ks, Kst], dtype = float) # Gains used where the route doesn't schedule any, in the order of GainNames.
+        self.GainSchedule = np.where(np.isnan(Route.Gains), self.BaseGains, Route.Gains) # Gains for each set point, looked up in new_setpoint().
+        self.Kp, self.Ki, self.Kd, self.PMax, self.Ks, self.Kst = self.GainSchedule[0] # Gains for the first set point.
+        self.SetPointIndex = 0 # Index of the current set point in the route.
+        self.SetPoint = Route.Positions[0] # Current set point.
+        self.Special = Route.Special[0] # PID control is overridden if there is a HardControlSignal.
+        self.HardControlSignal = Route.HardControlSignals[0] # NaN where there is no HardControlSignal.
         self.BufferSize = BufferSize # Number of error values to store in the buffer.
         self.ErrorBuffer = np.zeros((9, self.BufferSize)) # Initialise error buffer (with additional rows for linear regression).
         self.BufferIteration = 0 # Record buffer iteration number.
@@ -32,26 +43,25 @@ class PID_Controller():
         self.Saturation = np.array([False, False]) # Initialise saturation check.
         self.SaturationLimit = SaturationLimit # Control signal maximum angle limit.
         self.MinTheta = MinTheta # Minimum output theta.
-
-        if SetPoint.Special == True: # PID control is overridden if there is a HardControlSignal.
-            self.Special = True
-            self.HardControlSignal = SetPoint.HardControlSignal
+        self.DistanceField = DistanceField # Signed distance field of the maze's walls and holes.
+        self.Kr = Kr # Hole repulsion coefficient.
+        self.HoleDangerDistance = HoleDangerDistance # Distance from a hole at which repulsion starts.
+        self.HoleRepulsion = np.array([0.0, 0.0]) # Last hole repulsion term, for display.
 
     def __repr__(self):
         # Makes the class printable.
         return "PID Controller(Kp: %s, Ki: %s, Kd: %s, Set Point: %s)" % (self.Kp, self.Ki, self.Kd, self.SetPoint)
 
-    def new_setpoint(self, SetPoint):
-        self.SetPoint = SetPoint.S # Set new set point.
-        self.Special = False # Normal set point by default.
+    def new_setpoint(self, SetPointIndex):
+        self.SetPointIndex = SetPointIndex
+        self.SetPoint = self.Route.Positions[SetPointIndex] # Set new set point.
+        self.Special = self.Route.Special[SetPointIndex] # PID control is overridden if there is a HardControlSignal.
+        self.HardControlSignal = self.Route.HardControlSignals[SetPointIndex]
+        self.Kp, self.Ki, self.Kd, self.PMax, self.Ks, self.Kst = self.GainSchedule[SetPointIndex] # Scheduled gains for the new set point.
         self.ErrorIntegral = np.array([0.0, 0.0]) # Reset error integral.
         self.ErrorBuffer = np.zeros((9, self.BufferSize)) # Reset error buffer.
         self.BufferIteration = 0 # Reset buffer iteration number.
 
-        if SetPoint.Special == True: # PID control is overridden if there is a HardControlSignal.
-            self.Special = True
-            self.HardControlSignal = SetPoint.HardControlSignal
-
     def calibrate(self, ControlSignalCalibrated):
         # Theta for zero tilt. Change after calibration.
         self.ControlSignalCalibrated = ControlSignalCalibrated
@@ -127,6 +137,16 @@ class PID_Controller():
             StaticBoost = np.array([0, 0])
         return ThetaSignal, StaticBoost
 
+    def hole_repulsion(self, ThetaSignal, ProcessVariable):
+        # Tilt away from the nearest hole when the ball gets within HoleDangerDistance of falling in.
+        if self.DistanceField != None and self.Kr != 0:
+            HoleDistance, AwayFromHole = self.DistanceField.hole_distance(ProcessVariable)
+            if HoleDistance < self.HoleDangerDistance:
+                self.HoleRepulsion = self.Kr * (self.HoleDangerDistance - HoleDistance) * AwayFromHole
+                return ThetaSignal + self.HoleRepulsion
+        self.HoleRepulsion = np.array([0.0, 0.0])
+        return ThetaSignal
+
     def min_theta(self, ThetaSignal):
         # Apply minimum theta if necessary.
         if self.Calibrated == True: # Only apply minimum theta when the controller is calibrated.
@@ -165,12 +185,15 @@ class PID_Controller():
             self.Saturation[1] = False
         return ControlSignal
 
-    def update(self, ProcessVariable, TimeStep):
+    def update(self, ProcessVariable, TimeStep, Velocity = None):
         ErrorValue = self.SetPoint - ProcessVariable # Calculate error value.
         self.error_buffer(ErrorValue, TimeStep) # Update buffer.
 
         ErrorIntegral = self.conditional_integrator(ErrorValue, TimeStep) # Calculate integral value.
-        ErrorDerivative = self.linear_regression() # Calculate derivative value.
+        if Velocity is None:
+            ErrorDerivative = self.linear_regression() # Calculate derivative value.
+        else:
+            ErrorDerivative = - Velocity # The set point is fixed, so the error changes opposite to the ball's velocity.
 
         # Calculate PID terms and control signal.
         ProportionalTerm = self.Kp * ErrorValue
@@ -180,14 +203,15 @@ class PID_Controller():
         ThetaSignal = ProportionalTerm + IntegralTerm + DerivativeTerm # Calculate control signal.
         ThetaSignal, StaticBoost = self.static_boost(ThetaSignal, ErrorDerivative) # Extra angle to help ball overcome static friction.
         ThetaSignal = self.min_theta(ThetaSignal) # Apply minimum theta if necessary.
+        ThetaSignal = self.hole_repulsion(ThetaSignal, ProcessVariable) # Steer away from nearby holes if enabled.
         ControlSignal = self.gearing(ThetaSignal) # Convert theta to motor angle.
         ControlSignal += self.ControlSignalCalibrated # Apply calibrated level angles.
         ControlSignal = self.saturation_clamp(ControlSignal) # Apply saturation clamp if necessary.
 
         if self.Special == True:
-            if self.HardControlSignal[0] != None:
+            if np.isnan(self.HardControlSignal[0]) == False:
                 ControlSignal[0] = self.HardControlSignal[0]
-            if self.HardControlSignal[1] != None:
+            if np.isnan(self.HardControlSignal[1]) == False:
                 ControlSignal[1] = self.HardControlSignal[1]
 
         return ControlSignal, ProportionalTerm, IntegralTerm, DerivativeTerm, StaticBoost
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+'''
+This file contains the latency-compensating position predictor. A measured ball position is
+already stale when it reaches the controller (the camera frame was captured tens of ms
+earlier), and the tilt the controller chooses only takes effect once the motors have moved.
+predict() projects the measured position and velocity forward from the capture time to the
+expected actuation time, integrating the same tilt and drag model the simulation uses (see
+ball_acceleration in objects.py) with the tilt currently applied. Given the maze's distance
+field, the projection stops at walls instead of passing through them.
+'''
+
+# Import modules.
+import numpy as np
+from math import ceil
+
+# Import functions and settings.
+from objects import ball_acceleration
+from settings import BallRadius, PredictionTimeStep, MaxPredictionTime
+
+class PositionPredictor():
+
+    def __init__(self, DistanceField = None, TimeStep = PredictionTimeStep, MaxTime = MaxPredictionTime):
+        # DistanceField should be the maze's, see objects.py. Without it walls are ignored.
+        self.DistanceField = DistanceField
+        self.TimeStep = TimeStep # [s] Longest integration step.
+        self.MaxTime = MaxTime # [s] Longest time to predict ahead, in case a measurement is very old.
+        self.PredictionTime = 0.0 # [s] Time predicted ahead in the last call, for display and logging.
+
+    def __repr__(self):
+        # Makes the class printable.
+        return "PositionPredictor(TimeStep: %s, MaxTime: %s, Last Prediction Time: %s)" % (self.TimeStep, self.MaxTime, round(self.PredictionTime, 3))
+
+    def predict(self, Position, Velocity, CaptureTime, ActuationTime, Theta):
+        # Position and velocity measured at CaptureTime, projected to ActuationTime with the maze tilted at Theta. Returns (Position, Velocity).
+        self.PredictionTime = min(max(ActuationTime - CaptureTime, 0.0), self.MaxTime)
+        if self.PredictionTime == 0:
+            return Position.copy(), Velocity.copy()
+        Steps = ceil(self.PredictionTime / self.TimeStep)
+        TimeStep = self.PredictionTime / Steps
+
+        S, v = np.array(Position, dtype = float), np.array(Velocity, dtype = float)
+        for _ in range(Steps):
+            NewV = v + ball_acceleration(Theta, v) * TimeStep
+            NewS = S + (v + NewV) * TimeStep / 2
+            if self.DistanceField != None and self.DistanceField.wall_distance(NewS) < BallRadius:
+                return S, np.array([0.0, 0.0]) # The ball would hit a wall: assume it stops there.
+            S, v = NewS, NewV
+        return S, v
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -1,6 +1,11 @@
 #!/usr/bin/env python3
 '''
-This file contains the set point handler.
+This file contains the set point handler. It moves a cursor (SetPointIndex) along a compiled
+CheckpointRoute (see control/checkpoint_route.py) as each set point is reached. The cursor is
+shared with the PID controller and the graphics, so the route itself is never changed.
+If LookAhead is above 0, checkpoints within LookAhead mm along the route that the ball has
+effectively passed (it is within their radius of the route after them) are skipped. Special
+checkpoints, checkpoints with a hold time and the end point are never skipped.
 '''
 
 # Import modules.
@@ -8,20 +13,17 @@ import numpy as np
 
 class SetPointHandler():
 
-    def __init__(self, BallPosition, CurrentTime, Checkpoints, CheckpointRadius, SetPointTime):
+    def __init__(self, BallPosition, CurrentTime, Route, LookAhead = 0):
 
-        # Save checkpoints and settings.
-        self.Checkpoints = Checkpoints
-        self.DefaultSetPointTime = SetPointTime
-        self.DefaultCheckpointRadius = CheckpointRadius
+        # Save route and settings.
+        self.Route = Route
+        self.LookAhead = LookAhead # [mm] Distance along the route to search for passed checkpoints. 0 to disable.
 
-        self.SetPoint = self.Checkpoints[0].S
-        if self.Checkpoints[0].Special == True:
-            self.SetPointTime = self.Checkpoints[0].Time
-            self.CheckpointRadius = self.Checkpoints[0].Radius
-        else:
-            self.SetPointTime = self.DefaultSetPointTime
-            self.CheckpointRadius = self.DefaultCheckpointRadius
+        # Start at the first checkpoint.
+        self.SetPointIndex = 0
+        self.SetPoint = self.Route.Positions[0]
+        self.SetPointTime = self.Route.Times[0]
+        self.CheckpointRadius = self.Route.Radii[0]
 
         # Initialise values.
         self.LastTime = CurrentTime
@@ -31,22 +33,47 @@ class SetPointHandler():
 
     def __repr__(self):
         # Makes the class printable.
-        return "SetPointHandler(SetPoint: %s)" % (self.SetPoint)
+        return "SetPointHandler(SetPoint: %s, Index: %s)" % (self.SetPoint, self.SetPointIndex)
 
     def new_setpoint(self):
-        if len(self.Checkpoints) > 1:
-            self.Checkpoints.pop(0) # Delete current checkpoint.
-            self.SetPoint = self.Checkpoints[0].S
-            if self.Checkpoints[0].Special == True:
-                self.SetPointTime = self.Checkpoints[0].Time
-                self.CheckpointRadius = self.Checkpoints[0].Radius
-            else:
-                self.SetPointTime = self.DefaultSetPointTime
-                self.CheckpointRadius = self.DefaultCheckpointRadius
+        if self.SetPointIndex < self.Route.Length - 1:
+            self.SetPointIndex += 1 # Move on to the next checkpoint.
+            self.SetPoint = self.Route.Positions[self.SetPointIndex]
+            self.SetPointTime = self.Route.Times[self.SetPointIndex]
+            self.CheckpointRadius = self.Route.Radii[self.SetPointIndex]
         else:
             self.MazeCompleted = 1 # If the last checkpoint has been reached, the program has been completed.
 
+    def look_ahead(self, BallPosition):
+        # Find the last checkpoint that can be skipped within the look-ahead window.
+        Start = self.SetPointIndex
+        End = np.searchsorted(self.Route.ArcLength, self.Route.ArcLength[Start] + self.LookAhead, side = "right")
+        End = min(End, self.Route.NextFixed[Start])
+        if End <= Start:
+            return False
+
+        # Distance from the ball to the route segment after each checkpoint in the window.
+        Offsets = BallPosition - self.Route.Positions[Start:End]
+        Segments = self.Route.Segments[Start:End]
+        Projection = np.clip(np.sum(Offsets * Segments, axis = 1) / np.maximum(self.Route.SegmentLengthsSquared[Start:End], 1e-9), 0, 1)
+        Distances = np.hypot(*(Offsets - Projection[:, None] * Segments).T)
+        Passed = np.nonzero(Distances < self.Route.Radii[Start:End])[0]
+        if len(Passed) == 0:
+            return False
+
+        # Skip to the checkpoint after the last one passed.
+        self.SetPointIndex = Start + Passed[-1] + 1
+        self.SetPoint = self.Route.Positions[self.SetPointIndex]
+        self.SetPointTime = self.Route.Times[self.SetPointIndex]
+        self.CheckpointRadius = self.Route.Radii[self.SetPointIndex]
+        self.SetPointReached = False
+        return True
+
     def update(self, BallPosition, CurrentTime):
+        Skipped = False
+        if self.LookAhead > 0 and self.MazeCompleted == 0:
+            Skipped = self.look_ahead(BallPosition)
+
         if ((BallPosition[0] - self.SetPoint[0]) ** 2 + (BallPosition[1] - self.SetPoint[1]) ** 2) ** 0.5 < self.CheckpointRadius:
             if self.SetPointReached == False:
                 self.LastTime = CurrentTime
@@ -61,7 +88,10 @@ class SetPointHandler():
             self.NewSetPoint = True
             self.SetPointReached = False
 
-        return self.MazeCompleted, self.NewSetPoint, self.Checkpoints
+        if Skipped == True:
+            self.NewSetPoint = True
+
+        return self.MazeCompleted, self.NewSetPoint, self.SetPointIndex
 
 if __name__ == "__main__":
     import doctest
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+'''
+This file contains the trace recorder and replayer for control runs. Every control tick,
+record() writes one row (time, time-step, measured ball position, set point index, controller
+events, calibrated level, P, I and D terms, static boost, saturation, control signal and the
+velocity estimate given to the controller, if any) into
+a preallocated float64 buffer, as a single row assignment so it stays cheap on the Pi. Each
+field is a fixed group of columns (see TraceFields), so column(Name) gives a field for the
+whole run without copying. The buffer either grows and is saved to an .npz file at the end
+(one array per field), or, given a .bin Filename, is appended to that file whenever it fills,
+with the controller settings in a .json file next to it. Events that happen between ticks
+(calibration, a new set point, a controller reset) are marked with mark() and stored with the
+next row.
+
+load_trace() reads either format back into a Trace. replay_trace() feeds a trace's positions,
+time-steps and events back through a PID_Controller (by default one built from the settings
+saved in the trace) and returns the replayed trace, with the time each update took.
+compare_traces() gives the largest difference in each output field, for regression checks.
+'''
+
+# Import modules.
+import json
+import numpy as np
+from time import perf_counter
+
+# Import classes and settings.
+from objects import Checkpoint
+from control.checkpoint_route import CheckpointRoute, GainNames
+from control.pid_controller import PID_Controller
+from settings import TraceCapacity
+
+# Fields of each row and their number of columns.
+TraceFields = (("Time", 1), ("TimeStep", 1), ("Position", 2), ("SetPointIndex", 1), ("Events", 1), ("Calibrated", 2),
+               ("Proportional", 2), ("Integral", 2), ("Derivative", 2), ("StaticBoost", 2), ("Saturation", 2), ("ControlSignal", 2), ("Velocity", 2))
+TraceColumns = {}
+TraceWidth = 0
+for Name, Width in TraceFields:
+    TraceColumns[Name] = TraceWidth if Width == 1 else slice(TraceWidth, TraceWidth + Width)
+    TraceWidth += Width
+
+# Output fields compared between a trace and its replay.
+TraceOutputs = ("Proportional", "Integral", "Derivative", "StaticBoost", "Saturation", "ControlSignal")
+
+# Event flags, combined in the Events field.
+EventCalibrated = 1 # PID_Controller.calibrate was called.
+EventNewSetPoint = 2 # PID_Controller.new_setpoint was called.
+EventReset = 4 # PID_Controller.reset was called.
+
+class Trace():
+
+    def __init__(self, Data, Metadata):
+        # Data should be an (n, TraceWidth) array of rows. Metadata is a dictionary of controller settings.
+        self.Data = Data
+        self.Metadata = Metadata
+        self.Length = len(Data)
+        self.UpdateTimes = None # [s] Time of each controller update, set by replay_trace.
+
+    def __repr__(self):
+        # Makes the class printable.
+        return "Trace(Length: %s, Duration: %s)" % (self.Length, round(float(np.sum(self.column("TimeStep"))), 2))
+
+    def column(self, Name):
+        # Returns one field for every row.
+        return self.Data[:, TraceColumns[Name]]
+
+class TraceRecorder():
+
+    def __init__(self, Capacity = TraceCapacity, Filename = None):
+        # If Filename (ending in .bin) is given, rows are appended to it whenever the buffer fills. Otherwise the buffer grows.
+        self.Capacity = Capacity
+        self.Data = np.zeros((Capacity, TraceWidth)) # Preallocated row buffer.
+        self.Count = 0 # Rows in the buffer.
+        self.Flushed = 0 # Rows already written to Filename.
+        self.Filename = Filename
+        self.Metadata = {}
+        self.PendingEvents = 0 # Events since the last row.
+        self.RecordTime = 0.0 # [s] Total time spent in record(), to check the cost per tick.
+        if self.Filename != None:
+            open(self.Filename, "wb").close() # Start a new file.
+
+    def __repr__(self):
+        # Makes the class printable.
+        return "TraceRecorder(Rows: %s, Capacity: %s, Filename: %s)" % (self.Flushed + self.Count, self.Capacity, self.Filename)
+
+    def set_controller(self, Controller):
+        # Saves the controller's settings and route with the trace, so it can be replayed.
+        Route = Controller.Route
+        self.Metadata = {
+            **dict(zip(GainNames, Controller.BaseGains.tolist())), # Gains used where the route doesn't schedule any.
+            "BufferSize" : Controller.BufferSize, "SaturationLimit" : np.asarray(Controller.SaturationLimit).tolist(),
+            "MinTheta" : np.asarray(Controller.MinTheta).tolist(), "Kr" : Controller.Kr, "HoleDangerDistance" : Controller.HoleDangerDistance,
+            "RoutePositions" : Route.Positions.tolist(), "RouteSpecial" : Route.Special.tolist(), "RouteHardControlSignals" : Route.HardControlSignals.tolist(),
+            "RouteGains" : Route.Gains.tolist()
+        }
+        if self.Filename != None:
+            with open(self.Filename + ".json", "w") as MetadataFile:
+                json.dump(self.Metadata, MetadataFile)
+
+    def mark(self, Event):
+        # Marks an event (EventCalibrated, EventNewSetPoint or EventReset) to be stored with the next row.
+        self.PendingEvents |= Event
+
+    def record(self, Time, TimeStep, Position, Controller, ControlSignal, ProportionalTerm, IntegralTerm, DerivativeTerm, StaticBoost, Velocity = None):
+        # Adds one control tick. Call after PID_Controller.update with its outputs, and the Velocity given to it if any.
+        StartTime = perf_counter()
+        if self.Count == self.Capacity:
+            self.make_space()
+        Calibrated, Saturation = Controller.ControlSignalCalibrated, Controller.Saturation
+        if Velocity is None:
+            Velocity = (np.nan, np.nan)
+        self.Data[self.Count] = (Time, TimeStep, Position[0], Position[1], Controller.SetPointIndex, self.PendingEvents, Calibrated[0], Calibrated[1],
+                                 ProportionalTerm[0], ProportionalTerm[1], IntegralTerm[0], IntegralTerm[1], DerivativeTerm[0], DerivativeTerm[1],
+                                 StaticBoost[0], StaticBoost[1], Saturation[0], Saturation[1], ControlSignal[0], ControlSignal[1], Velocity[0], Velocity[1])
+        self.Count += 1
+        self.PendingEvents = 0
+        self.RecordTime += perf_counter() - StartTime
+
+    def make_space(self):
+        # Appends the buffer to the file, or doubles it if there is no file.
+        if self.Filename != None:
+            self.flush()
+        else:
+            self.Data = np.concatenate((self.Data, np.zeros((self.Capacity, TraceWidth))))
+            self.Capacity *= 2
+
+    def flush(self):
+        # Appends the buffered rows to Filename.
+        with open(self.Filename, "ab") as TraceFile:
+            self.Data[:self.Count].tofile(TraceFile)
+        self.Flushed += self.Count
+        self.Count = 0
+
+    def trace(self):
+        # Returns the rows recorded so far as a Trace. Rows already flushed to a file are read back.
+        if self.Flushed > 0:
+            self.flush()
+            return load_trace(self.Filename)
+        return Trace(self.Data[:self.Count], self.Metadata)
+
+    def save(self, Filename = None):
+        # Writes the trace to an .npz file, one array per field, or finishes the .bin file.
+        if Filename == None:
+            self.flush()
+            return
+        Trace_ = self.trace()
+        Fields = {Name : Trace_.column(Name) for Name, _ in TraceFields}
+        np.savez(Filename, Metadata = json.dumps(Trace_.Metadata), **Fields)
+
+def load_trace(Filename):
+    # Reads a trace saved by TraceRecorder, from an .npz file or a .bin file and its .json file.
+    if Filename.endswith(".npz"):
+        with np.load(Filename) as TraceFile:
+            Length = len(TraceFile["Time"])
+            Data = np.zeros((Length, TraceWidth))
+            for Name, _ in TraceFields:
+                Data[:, TraceColumns[Name]] = TraceFile[Name] if Name in TraceFile else np.nan # Fields added since the trace was saved are NaN.
+            Metadata = json.loads(str(TraceFile["Metadata"]))
+        return Trace(Data, Metadata)
+    Data = np.fromfile(Filename).reshape(-1, TraceWidth)
+    try:
+        with open(Filename + ".json") as MetadataFile:
+            Metadata = json.load(MetadataFile)
+    except FileNotFoundError:
+        Metadata = {}
+    return Trace(Data, Metadata)
+
+def controller_from_trace(Trace_, DistanceField = None):
+    # Builds a PID_Controller with the settings saved in a trace. DistanceField is only needed for hole repulsion.
+    Metadata = Trace_.Metadata
+    if len(Metadata) == 0:
+        raise ValueError("The trace has no controller settings. Use TraceRecorder.set_controller when recording.")
+    Checkpoints = []
+    RouteGains = Metadata.get("RouteGains", [[np.nan] * len(GainNames)] * len(Metadata["RoutePositions"])) # Traces from before gain scheduling have none.
+    for Position, Special, HardControlSignal, Gains in zip(Metadata["RoutePositions"], Metadata["RouteSpecial"], Metadata["RouteHardControlSignals"], RouteGains):
+        Gains = {Name : Value for Name, Value in zip(GainNames, Gains) if np.isnan(Value) == False}
+        Gains = Gains if len(Gains) > 0 else None
+        if Special == True:
+            HardControlSignal = [None if np.isnan(Value) else Value for Value in HardControlSignal]
+            Checkpoints.append(Checkpoint(np.array(Position), True, HardControlSignal = HardControlSignal, Gains = Gains))
+        else:
+            Checkpoints.append(Checkpoint(np.array(Position), Gains = Gains))
+    Route = CheckpointRoute(Checkpoints, 0, 0) # Radii and hold times aren't used by the controller.
+    return PID_Controller(Metadata["Kp"], Metadata["Ki"], Metadata["Kd"], Metadata["PMax"], Metadata["Ks"], Metadata["Kst"], Route, Metadata["BufferSize"],
+                          np.array(Metadata["SaturationLimit"]), np.array(Metadata["MinTheta"]), DistanceField, Metadata["Kr"], Metadata["HoleDangerDistance"])
+
+def replay_trace(Trace_, Controller = None, DistanceField = None):
+    # Feeds a trace back through a controller, tick by tick, and returns the replayed Trace.
+    if Controller == None:
+        Controller = controller_from_trace(Trace_, DistanceField)
+    Recorder = TraceRecorder(max(Trace_.Length, 1))
+    Recorder.Metadata = Trace_.Metadata
+    UpdateTimes = np.zeros(Trace_.Length)
+    for Index, Row in enumerate(Trace_.Data):
+        Events = int(Row[TraceColumns["Events"]])
+        if Events & EventCalibrated:
+            Controller.calibrate(Row[TraceColumns["Calibrated"]].copy())
+        if Events & EventNewSetPoint:
+            Controller.new_setpoint(int(Row[TraceColumns["SetPointIndex"]]))
+        if Events & EventReset:
+            Controller.reset()
+        Recorder.mark(Events)
+        Position, TimeStep, Velocity = Row[TraceColumns["Position"]].copy(), Row[TraceColumns["TimeStep"]], Row[TraceColumns["Velocity"]].copy()
+        if np.isnan(Velocity[0]):
+            Velocity = None # The controller used its own derivative.
+        StartTime = perf_counter()
+        Outputs = Controller.update(Position, TimeStep, Velocity)
+        UpdateTimes[Index] = perf_counter() - StartTime
+        Recorder.record(Row[TraceColumns["Time"]], TimeStep, Position, Controller, *Outputs, Velocity = Velocity)
+    Replayed = Recorder.trace()
+    Replayed.UpdateTimes = UpdateTimes
+    return Replayed
+
+def compare_traces(Trace_, Replayed):
+    # Largest absolute difference in each output field between two traces of the same run.
+    if Trace_.Length != Replayed.Length:
+        raise ValueError("Traces have different lengths: %s and %s." % (Trace_.Length, Replayed.Length))
+    if Trace_.Length == 0:
+        return {Name : 0.0 for Name in TraceOutputs}
+    return {Name : float(np.max(np.abs(Trace_.column(Name) - Replayed.column(Name)))) for Name in TraceOutputs}
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -15,7 +15,6 @@ import pygame
 import numpy as np
 from time import sleep, perf_counter
 from math import degrees
-from copy import deepcopy
 
 # Import classes, functions and values.
 from mazes import Maze1, Maze2, Maze3
@@ -23,12 +22,18 @@ from objects import Maze
 from graphics.graphics import initialise_background, initialise_dirty_group, initialise_buttons, initialise_header, initialise_values, initialise_ball, change_maze
 from image_detection.image_detection import ImageProcessor
 from control.pid_controller import PID_Controller
+from control.mpc_controller import MPC_Controller
 from control.calibrator import Calibrator
 from control.setpoint_handler import SetPointHandler
+from control.checkpoint_route import CheckpointRoute
 from control.timing_controller import TimingController
 from control.performance_log import PerformanceLog
+from control.trace_recorder import TraceRecorder, EventCalibrated, EventNewSetPoint, EventReset
+from control.kalman_filter import KalmanFilter
+from control.position_predictor import PositionPredictor
+from control.bias_estimator import BiasEstimator
 from motor_control.motor_control import motor_reset, motor_angle
-from settings import MaxFrequency, DisplayScale, White, Kp, Ki, Kd, PMax, Ks, Kst, BufferSize, SaturationLimit, MinTheta, MazeSize, CheckpointRadius, SetPointTime, HSVLimitsBlue, HSVLimitsGreen
+from settings import MaxFrequency, DisplayScale, White, Kp, Ki, Kd, PMax, Ks, Kst, Kr, HoleDangerDistance, BufferSize, SaturationLimit, MinTheta, MazeSize, CheckpointRadius, SetPointTime, SetPointLookAhead, TraceFile, ControlToTheta, HSVLimitsBlue, HSVLimitsGreen, KalmanFilterOn, LatencyCompensationOn, ActuationDelay, MPCControllerOn, BiasEstimationOn
 
 def full_system():
 
@@ -61,6 +66,11 @@ def full_system():
     ActiveSprites.add(SpriteHeader, layer = 6)
     ''' PYGAME GRAPHICS END '''
 
+    # Learned level control signal, saved between runs. See control/bias_estimator.py.
+    BiasEstimator_ = BiasEstimator() if BiasEstimationOn == True else None
+    if BiasEstimator_ != None:
+        BiasEstimator_.load()
+
     # Start program.
     ProgramOn, SystemRunning, CalibrationDone, Paused, BallLost, Completed = 1, 0, 0, 0, 0, 0
     while ProgramOn == 1:
@@ -117,7 +127,7 @@ def full_system():
         if SystemRunning == 1:
 
             # Set ActiveMaze as a copy of CurrentMaze.
-            ActiveMaze = deepcopy(CurrentMaze)
+            ActiveMaze = CurrentMaze.new_run()
 
             # Check ActiveMaze is correct type.
             if type(ActiveMaze) != Maze:
@@ -138,15 +148,35 @@ def full_system():
             Saturation = np.array([False, False])
             ''' PYGAME GRAPHICS END '''
 
+            ''' INITIALISE CHECKPOINT ROUTE '''
+            # Compile the checkpoints into arrays, see control/checkpoint_route.py for more information.
+            Route = CheckpointRoute(ActiveMaze.Checkpoints, CheckpointRadius, SetPointTime)
+            SetPointIndex = 0 # Index of the current set point in Route, shared by the controller and graphics.
+            ''' INITIALISE CHECKPOINT ROUTE '''
+
             ''' INITIALISE PID CONTROL '''
             # Initialise PID controller object, see control/pid_controller.py for more information.
-            PID_Controller_ = PID_Controller(Kp, Ki, Kd, PMax, Ks, Kst, ActiveMaze.Checkpoints[0], BufferSize, SaturationLimit, MinTheta)
+            if MPCControllerOn == True: # The model-predictive controller has the same interface, see control/mpc_controller.py.
+                PID_Controller_ = MPC_Controller(Route, SaturationLimit, ActiveMaze.Geometry.distance_field())
+            else:
+                DistanceField = ActiveMaze.Geometry.distance_field() if Kr != 0 else None # Only hole repulsion uses it, so it isn't built when that is off.
+                PID_Controller_ = PID_Controller(Kp, Ki, Kd, PMax, Ks, Kst, Route, BufferSize, SaturationLimit, MinTheta, DistanceField, Kr, HoleDangerDistance)
+            TraceRecorder_ = TraceRecorder() # Per-tick record of the run, see control/trace_recorder.py.
+            if MPCControllerOn == False:
+                TraceRecorder_.set_controller(PID_Controller_) # Only PID traces can be replayed.
             ''' INITIALISE PID CONTROL '''
 
             ''' INITIALISE CALIBRATOR '''
             Calibrator_ = Calibrator() # Initialise SimulationTime
             ControlSignal = np.array([0, 0]) # Start at 0.
             ControlSignalCalibrated = np.array([0, 0]) # Record control signal angle for 'true' level after calibration.
+            if BiasEstimator_ != None:
+                BiasEstimator_.DistanceField = ActiveMaze.Geometry.distance_field()
+                if BiasEstimator_.Bias is not None: # Start calibrated with the learned level, skipping the calibration phase.
+                    ControlSignalCalibrated = BiasEstimator_.Bias.copy()
+                    PID_Controller_.calibrate(ControlSignalCalibrated)
+                    TraceRecorder_.mark(EventCalibrated)
+                    CalibrationDone = True
             ''' INITIALISE CALIBRATOR '''
 
             ''' INITIALISE MOTOR CONTROL '''
@@ -173,6 +203,9 @@ def full_system():
 
             """ IMAGE PROCESSOR INITIALISATION START """
             ImageProcessor_ = ImageProcessor(perf_counter(), MazeSize, HSVLimitsBlue, HSVLimitsGreen) # Initialise image processor.
+            StateEstimator_ = KalmanFilter(Timeout = ImageProcessor_.WaitTime) if KalmanFilterOn == True or LatencyCompensationOn == True or BiasEstimator_ != None else None # See control/kalman_filter.py.
+            Predictor_ = PositionPredictor(ActiveMaze.Geometry.distance_field()) if LatencyCompensationOn == True else None # See control/position_predictor.py.
+            Velocity = None # Velocity estimate for the PID controller, None to use its own derivative.
 
             Frame = next(Frames) # If there is a new frame, grab it.
             Image = Frame.array # Store the array from the frame object.
@@ -186,7 +219,7 @@ def full_system():
             """ IMAGE PROCESSOR INITIALISATION END """
 
             ''' INITIALISE SET POINT HANDLER '''
-            SetPointHandler_ = SetPointHandler(ActiveMaze.Ball.S, perf_counter(), ActiveMaze.Checkpoints, CheckpointRadius, SetPointTime)
+            SetPointHandler_ = SetPointHandler(ActiveMaze.Ball.S, perf_counter(), Route, SetPointLookAhead)
             ''' INITIALISE SET POINT HANDLER '''
 
             while SystemRunning == 1:
@@ -218,7 +251,7 @@ def full_system():
                                 elif Button.CurrentState == "Reset":
                                     Button.click(perf_counter()) # Animate button click.
                                     Buttons.get_sprite(0).click(perf_counter()) # Change stop button to start.
-                                    ActiveMaze = deepcopy(CurrentMaze) # Reset maze.
+                                    ActiveMaze = CurrentMaze.new_run() # Reset maze.
                                     change_maze(ActiveSprites, CurrentMaze) # Reset certain Sprites.
                                     ActiveSprites.remove_sprites_of_layer(4) # Erase display values.
                                     SpriteBall_.kill() # Erase ball.
@@ -237,11 +270,27 @@ def full_system():
                     """ IMAGE CAPTURE START """
                     Capture.truncate(0) # Clear Capture so the next frame can be inserted.
                     Frame = next(Frames) # If there is a new frame, grab it.
+                    CaptureTime = perf_counter() # Time the frame arrived, the closest available to its capture time.
                     Image = Frame.array # Store the array from the frame object.
                     """ IMAGE CAPTURE END """
 
                     ''' IMAGE DETECTION START '''
-                    ActiveMaze.Ball.Active, ActiveMaze.Ball.S = ImageProcessor_.update(perf_counter(), Image) # Find ball position.
+                    ActiveMaze.Ball.Active, ActiveMaze.Ball.S = ImageProcessor_.update(CaptureTime, Image) # Find ball position.
+                    if StateEstimator_ != None:
+                        # Filter the measurement, or bridge a missed detection with the filter's estimate.
+                        Measurement = ActiveMaze.Ball.S if ImageProcessor_.BallFound == True else None
+                        EstimateActive, Position, EstimatedVelocity = StateEstimator_.update(CaptureTime, Measurement)
+                        if BiasEstimator_ != None and CalibrationDone == True and Measurement is not None and EstimateActive == True:
+                            BiasEstimator_.update(CaptureTime, Position, EstimatedVelocity, PID_Controller_.ControlSignalCalibrated) # Learn the level from the ball's motion.
+                        if ActiveMaze.Ball.Active == True and EstimateActive == True and (KalmanFilterOn == True or Predictor_ != None):
+                            if Predictor_ != None:
+                                # Project the ball forward to when the new motor angles take effect, with the tilt applied now.
+                                AppliedTheta = (ControlSignal - PID_Controller_.ControlSignalCalibrated) * ControlToTheta
+                                Position, EstimatedVelocity = Predictor_.predict(Position, EstimatedVelocity, CaptureTime, perf_counter() + ActuationDelay, AppliedTheta)
+                            ActiveMaze.Ball.S = Position
+                            Velocity = EstimatedVelocity if KalmanFilterOn == True else None
+                        else:
+                            Velocity = None
                     if ActiveMaze.Ball.Active == False:
                         ActiveMaze.Ball.S = np.array([-20, -20]) # Set the ball position to a random value to avoid exceptions.
                         BallLost = 1 # If ball is lost.
@@ -253,28 +302,35 @@ def full_system():
                         CalibrationDone, ControlSignalCalibrated = Calibrator_.update(ActiveMaze.Ball.S, ControlSignal, perf_counter())
                         if CalibrationDone == True:
                             PID_Controller_.calibrate(ControlSignalCalibrated) # Enter calibrated angle when done.
+                            TraceRecorder_.mark(EventCalibrated)
+                            if BiasEstimator_ != None:
+                                BiasEstimator_.start(ControlSignalCalibrated) # Learn on from the calibration if nothing was saved.
                         ''' CALIBRATION END '''
                     else:
                         ''' SET POINT HANDLING '''
                         # Use the set point handler to determine if a set point has been completed.
-                        Completed, NewSetPoint, ActiveMaze.Checkpoints = SetPointHandler_.update(ActiveMaze.Ball.S, perf_counter())
+                        Completed, NewSetPoint, SetPointIndex = SetPointHandler_.update(ActiveMaze.Ball.S, perf_counter())
                         if NewSetPoint == True:
-                            PID_Controller_.new_setpoint(ActiveMaze.Checkpoints[0]) # Assign first checkpoint as the set point.
+                            PID_Controller_.new_setpoint(SetPointIndex) # Move the controller to the new set point.
+                            TraceRecorder_.mark(EventNewSetPoint)
                         ''' SET POINT HANDLING '''
 
                     ''' PID CONTROL START '''
                     # Calculate control signal using the PID controller.
-                    ControlSignal, ProportionalTerm, IntegralTerm, DerivativeTerm, StaticBoost = PID_Controller_.update(ActiveMaze.Ball.S, ControlTimeStep)
+                    ControlSignal, ProportionalTerm, IntegralTerm, DerivativeTerm, StaticBoost = PID_Controller_.update(ActiveMaze.Ball.S, ControlTimeStep, Velocity)
                     Saturation = PID_Controller_.Saturation # For display.
+                    TraceRecorder_.record(perf_counter() - StartTime, ControlTimeStep, ActiveMaze.Ball.S, PID_Controller_, ControlSignal, ProportionalTerm, IntegralTerm, DerivativeTerm, StaticBoost, Velocity)
                     ''' PID CONTROL END'''
                     # Make sure you deal with the cases where no control signal is generated when Active == False.
                     ''' MOTOR CONTROL START'''
                     # Change the servo motors' angles.
                     motor_angle(ControlSignal)
+                    if BiasEstimator_ != None:
+                        BiasEstimator_.applied(perf_counter(), ControlSignal)
                     ''' MOTOR CONTROL END '''
 
                     # Convert control signal into actual Theta (based on measurements).
-                    Theta = ControlSignal * np.array([0.088888888, 0.6]) # For display.
+                    Theta = ControlSignal * ControlToTheta # For display.
 
                 if Completed == 0: # Stop clock when completed.
                     TimeElapsed = perf_counter() - StartTime
@@ -299,7 +355,7 @@ def full_system():
                         SpriteBall_.update(ActiveMaze.Ball.S)
 
                     # Check/update SpriteSetPoint.
-                    while len(ActiveMaze.Checkpoints) < len(ActiveSprites.get_sprites_from_layer(2)):
+                    while Route.Length - SetPointIndex < len(ActiveSprites.get_sprites_from_layer(2)): # One sprite per remaining checkpoint.
                         if len(ActiveSprites.get_sprites_from_layer(2)) != 1:
                             ActiveSprites.get_sprites_from_layer(2)[1].update("SetPoint") # Change next checkpoint to set point.
                         ActiveSprites.get_sprites_from_layer(2)[0].kill() # Remove previous set point.
@@ -352,10 +408,11 @@ def full_system():
                                     if Button.CurrentState == "Start":
                                         Button.click(perf_counter()) # Animate button click.
                                         PID_Controller_.reset() # Reset PID controller.
+                                        TraceRecorder_.mark(EventReset)
                                         Paused = 0
                                     elif Button.CurrentState == "Reset":
                                         Button.click(perf_counter()) # Animate button click.
-                                        ActiveMaze = deepcopy(CurrentMaze) # Reset maze.
+                                        ActiveMaze = CurrentMaze.new_run() # Reset maze.
                                         change_maze(ActiveSprites, CurrentMaze) # Reset certain Sprites.
                                         ActiveSprites.remove_sprites_of_layer(4) # Erase display values.
                                         SpriteBall_.kill() # Erase ball.
@@ -396,7 +453,7 @@ def full_system():
                             SpriteBall_.kill()
 
                         # Check/update SpriteSetPoint.
-                        while len(ActiveMaze.Checkpoints) < len(ActiveSprites.get_sprites_from_layer(2)):
+                        while Route.Length - SetPointIndex < len(ActiveSprites.get_sprites_from_layer(2)): # One sprite per remaining checkpoint.
                             if len(ActiveSprites.get_sprites_from_layer(2)) != 1:
                                 ActiveSprites.get_sprites_from_layer(2)[1].update("SetPoint") # Change next checkpoint to set point.
                             ActiveSprites.get_sprites_from_layer(2)[0].kill() # Remove previous set point.
@@ -442,7 +499,7 @@ def full_system():
                                     if Button.CurrentState == "Reset":
                                         Button.click(perf_counter()) # Animate button click.
                                         Buttons.get_sprite(0).click(perf_counter()) # Change stop button to start.
-                                        ActiveMaze = deepcopy(CurrentMaze) # Reset maze.
+                                        ActiveMaze = CurrentMaze.new_run() # Reset maze.
                                         change_maze(ActiveSprites, CurrentMaze) # Reset certain Sprites.
                                         ActiveSprites.remove_sprites_of_layer(4) # Erase display values.
                                         SpriteBall_.kill() # Erase ball.
@@ -468,6 +525,9 @@ def full_system():
             Camera.close() # Shut down camera, clear GPU processes.
             ''' SHUT DOWN PICAMERA '''
 
+            if BiasEstimator_ != None:
+                BiasEstimator_.save() # Later runs start calibrated.
+
             ''' MOTOR CONTROL START'''
             # Change the servo motors' angles.
             motor_angle(ControlSignalCalibrated)
@@ -482,5 +542,12 @@ def full_system():
     except:
         pass
 
+    try:
+        TraceRecorder_.save(TraceFile) # Export trace of the last run.
+    except NameError:
+        pass # No run was started, so there is no trace.
+    except Exception as Error:
+        print("Could not save the trace to %s: %s" % (TraceFile, Error))
+
 if __name__ == "__main__":
     full_system()
@@ -3,16 +3,34 @@
 This file contains a class for the image detection system, including all memory elements
 and functions needed to fetch the position of the checkpoints and the ball. Remember to
 disable the display functions to save processing power!
+
+The frame corners and the perspective matrix found in a run are kept in a cache file, per
+camera resolution, and loaded when the first frame arrives, so the first frames are corrected
+with the last run's geometry instead of the hard-coded initial points. The corners detected in
+the first CameraCacheFrames frames are compared with the cached ones, and the cache is written
+again if they have moved by more than CameraCacheTolerance pixels or there was no cache. If it
+can't be written, a warning is printed and the run carries on without it.
+
+With LensCorrectionOn, lens distortion is corrected in the same step as the perspective. The
+undistortion maps are made once from the camera calibration, when the first frame arrives, and
+whenever a frame corner moves more than PerspectiveTolerance pixels, the corners (undistorted
+with the same calibration) give a new perspective matrix and the maps are warped by it into
+one map from the raw frame straight to maze coordinates. Each frame then only needs a single
+cv2.remap, at about the cost of the perspective warp alone.
 '''
 
 # Import modules.
 import cv2
+import os
 import numpy as np
 from time import perf_counter
 
+# Import settings.
+from settings import CameraCacheFile, CameraCacheFrames, CameraCacheTolerance, LensCorrectionOn, PerspectiveTolerance
+
 class ImageProcessor():
 
-	def __init__(self, StartTime, MazeSize, HSVLimitsBlue, HSVLimitsGreen):
+	def __init__(self, StartTime, MazeSize, HSVLimitsBlue, HSVLimitsGreen, CacheFile = CameraCacheFile, LensCorrection = LensCorrectionOn):
 		# Initialise values.
 		self.LastInitialPoints = np.float32([[82, 34], [574, 35], [562, 440], [88, 436]]) # Initial points for perspective correction.
 		self.LastPosition = np.array([False, False])
@@ -23,16 +41,112 @@ class ImageProcessor():
 		self.MazeSize = MazeSize # Load the maze's size.
 		self.HSVLimitsBlue = HSVLimitsBlue # Upper and lower HSV limits for the blue ball.
 		self.HSVLimitsGreen = HSVLimitsGreen # Upper and lower HSV limits for the green frame.
-		self.CameraMatrix = np.int32([[500.58972602, 0, 322.3603059], [0, 500.2860463, 255.41210124], [0, 0, 1]]) # Calculated using calibration script.
-		self.DistortionCoefficients = np.int32([[0.16793948, -0.03380622, -0.00421432,  0.00209455, -1.29781314]]) # Calculated using calibration script.
+		self.CameraMatrix = np.float64([[500.58972602, 0, 322.3603059], [0, 500.2860463, 255.41210124], [0, 0, 1]]) # Calculated using calibration script.
+		self.DistortionCoefficients = np.float64([[0.16793948, -0.03380622, -0.00421432,  0.00209455, -1.29781314]]) # Calculated using calibration script.
+		self.CalibrationResolution = (640, 480) # (Width, height) of the calibration images. The camera matrix is scaled to the frame size.
+		self.LensCorrection = LensCorrection # Correct lens distortion together with the perspective.
+		self.UndistortMaps = None # Raw frame pixel for each undistorted pixel, (MapX, MapY).
+		self.RemapMaps = None # Raw frame pixel for each maze pixel, for the current perspective matrix.
 		self.EpsilonMultiple = 0.1 # Affects how accurately contour corners are detected.
 		self.KernelBlur = (7, 7) # How much to blur the image by.
 		self.WaitTime = 1 # [s] Maximum time allowed while ball cannot be found.
+		self.BallFound = False # True if the ball was detected in the last update.
+
+		# Initialise the geometry cache.
+		self.TransformedPoints = np.float32([[0, 0], [self.MazeSize[0], 0], [self.MazeSize[0], self.MazeSize[1]], [0, self.MazeSize[1]]]) # Points to warp to.
+		self.TransformationMatrix = None # Perspective matrix for MatrixPoints.
+		self.MatrixPoints = None # Initial points TransformationMatrix was made for.
+		self.CacheFile = CacheFile # .npz file with the geometry for each camera resolution, None to disable the cache.
+		self.Resolution = None # (Width, height) of the frames, known once the first frame arrives.
+		self.CacheLoaded = False # True if the geometry was loaded from the cache.
+		self.CachedCorners = None # Corners loaded from the cache.
+		self.Frames = 0 # Number of frames processed.
+		self.DetectedCorners = [] # Corners detected in the first CameraCacheFrames frames, to validate the cache.
 
 	def __repr__(self):
 	    # Makes the class printable.
 	    return "Image Detector(Last Ball Position: %s, Time Detected: %s)" % (self.LastPosition, round(self.StartTime, 2))
 
+	def cache_key(self):
+		# Prefix of the cache entries for the current resolution.
+		return "%sx%s" % self.Resolution
+
+	def load_cache(self):
+		# Loads the corners and perspective matrix saved for the current resolution. Returns True if they were found.
+		if self.CacheFile == None or os.path.exists(self.CacheFile) == False:
+			return False
+		Key = self.cache_key()
+		try:
+			with np.load(self.CacheFile) as Cache:
+				if Key + "_Corners" not in Cache or np.array_equal(Cache[Key + "_MazeSize"], self.MazeSize) == False:
+					return False
+				self.CachedCorners = np.float32(Cache[Key + "_Corners"])
+				self.LastInitialPoints = self.CachedCorners.copy()
+				if bool(Cache[Key + "_LensCorrection"]) == self.LensCorrection: # The matrix depends on whether the corners are undistorted.
+					self.MatrixPoints, self.TransformationMatrix = self.LastInitialPoints.copy(), Cache[Key + "_Matrix"]
+		except (OSError, ValueError, KeyError):
+			return False # Unreadable cache, it is written again after validation.
+		return True
+
+	def save_cache(self, Corners):
+		# Saves the corners and their perspective matrix for the current resolution, keeping the entries for other resolutions.
+		Entries = {}
+		if os.path.exists(self.CacheFile):
+			try:
+				with np.load(self.CacheFile) as Cache:
+					Entries = {Name : Cache[Name] for Name in Cache.files}
+			except (OSError, ValueError):
+				pass
+		Key = self.cache_key()
+		Entries[Key + "_Corners"] = Corners
+		Entries[Key + "_Matrix"] = cv2.getPerspectiveTransform(self.undistort_points(Corners), self.TransformedPoints)
+		Entries[Key + "_MazeSize"] = np.asarray(self.MazeSize)
+		Entries[Key + "_LensCorrection"] = np.array(self.LensCorrection)
+		try:
+			with open(self.CacheFile + ".tmp", "wb") as CacheFile_: # Written to a temporary file first, so an interruption never leaves a broken cache.
+				np.savez(CacheFile_, **Entries)
+			os.replace(self.CacheFile + ".tmp", self.CacheFile)
+		except OSError as Error: # E.g. a read-only folder or a full card. The run carries on without the cache.
+			print("Could not save the camera cache to %s: %s" % (self.CacheFile, Error))
+			try:
+				os.remove(self.CacheFile + ".tmp")
+			except OSError:
+				pass # It was never made.
+
+	def validate_cache(self, Corners):
+		# Collects the corners detected in the first frames, then rewrites the cache if they don't match it.
+		if Corners is not None:
+			self.DetectedCorners.append(Corners)
+		if self.Frames == CameraCacheFrames and self.CacheFile != None and len(self.DetectedCorners) > 0:
+			Detected = np.float32(np.median(self.DetectedCorners, axis = 0))
+			if self.CacheLoaded == False or np.max(np.linalg.norm(Detected - self.CachedCorners, axis = 1)) > CameraCacheTolerance:
+				self.save_cache(Detected)
+
+	def undistortion_maps(self):
+		# Makes the undistortion maps for the current resolution, once. The float camera matrix keeps the calibration's precision.
+		Scale = np.array([self.Resolution[0] / self.CalibrationResolution[0], self.Resolution[1] / self.CalibrationResolution[1], 1])
+		self.CameraMatrix = self.CameraMatrix * Scale[:, None] # Focal lengths and centre in pixels of this resolution.
+		self.UndistortMaps = cv2.initUndistortRectifyMap(self.CameraMatrix, self.DistortionCoefficients, None, self.CameraMatrix, self.Resolution, cv2.CV_32FC1)
+
+	def undistort_points(self, Points):
+		# Positions of raw frame points in the undistorted frame, or the points unchanged without lens correction.
+		if self.LensCorrection == False:
+			return Points
+		return np.float32(cv2.undistortPoints(Points.reshape(-1, 1, 2), self.CameraMatrix, self.DistortionCoefficients, P = self.CameraMatrix).reshape(-1, 2))
+
+	def perspective_matrix(self, InitialPoints):
+		# Perspective transformation for InitialPoints, and the fused remap maps, only calculated again when a point moves more than PerspectiveTolerance.
+		# Smaller moves keep the last matrix, as rebuilding the maps costs about as much as correcting a frame.
+		if self.TransformationMatrix is None or np.max(np.linalg.norm(InitialPoints - self.MatrixPoints, axis = 1)) > PerspectiveTolerance:
+			self.TransformationMatrix = cv2.getPerspectiveTransform(self.undistort_points(InitialPoints), self.TransformedPoints) # Generate matrix for transformation.
+			self.MatrixPoints = InitialPoints
+			self.RemapMaps = None
+		if self.LensCorrection == True and self.RemapMaps is None:
+			# Warping the undistortion maps gives, for each maze pixel, the raw frame pixel to sample.
+			MazeSize = (int(self.MazeSize[0]), int(self.MazeSize[1]))
+			self.RemapMaps = tuple(cv2.warpPerspective(Map, self.TransformationMatrix, MazeSize, borderMode = cv2.BORDER_REPLICATE) for Map in self.UndistortMaps)
+		return self.TransformationMatrix
+
 	def order_points(self, Points):
 		# Orders four points clockwise from the top left corner.
 		XSorted = Points[np.lexsort((Points[:,1], Points[:,0]))] # Sort the points by their x-coordinates.
@@ -49,13 +163,13 @@ class ImageProcessor():
 		MaskDilated = cv2.dilate(Mask, np.ones((3, 3)), iterations = 2) # Dilate and then erode to remove any black blobs in the frame mask.
 		MaskEroded = cv2.erode(MaskDilated, np.ones((3, 3)), iterations = 2)
 		Contours, Hierarchy = cv2.findContours(MaskDilated, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE) # Find all contours in the mask. Include simple hierarchy.
+		DetectedCorners = None # Corners found in this frame, if any.
 
 		if len(Contours) != 0:
 			if len(Contours) == 1:
 				ContourRect = Contours[0] # If there is only one contour found.
 			else:
-				MaxContour = max(Contours, key = lambda Contour: cv2.arcLength(Contour, True)) # Select the contour with the largest perimeter. (Assume the rect is the largest contour.)
-				MaxContourIndex = Contours.index(MaxContour) # Find index of MaxContour.
+				MaxContourIndex = max(range(len(Contours)), key = lambda Index: cv2.arcLength(Contours[Index], True)) # Index of the contour with the largest perimeter. (Assume the rect is the largest contour.)
 				ContourRect = Contours[Hierarchy[0][MaxContourIndex][2]] # Use index and hierarchy to find the internal contour. (Refer to documentation.)
 
 			Perimeter = cv2.arcLength(ContourRect, True) # Find the perimeter of ContourRect.
@@ -66,6 +180,7 @@ class ImageProcessor():
 					Points = Corners[:, 0] # Set points as the four corners.
 					InitialPoints = self.order_points(Points) # Order the points clockwise from the top left corner.
 					self.LastInitialPoints = InitialPoints # Save the new points.
+					DetectedCorners = InitialPoints
 				else:
 					InitialPoints = self.LastInitialPoints # If new points were not found, use the last set of points.
 			else:
@@ -73,9 +188,13 @@ class ImageProcessor():
 		else:
 			InitialPoints = self.LastInitialPoints # If new points were not found, use the last set of points.
 
-		TransformedPoints = np.float32([[0, 0], [self.MazeSize[0], 0], [self.MazeSize[0], self.MazeSize[1]], [0, self.MazeSize[1]]]) # Points to warp to.
-		TransformationMatrix = cv2.getPerspectiveTransform(InitialPoints, TransformedPoints) # Generate matrix for transformation.
-		ImageCorrected = cv2.warpPerspective(ImageHSV, TransformationMatrix, (self.MazeSize[0], self.MazeSize[1])) # Correct the perspective warp.
+		if self.Frames <= CameraCacheFrames:
+			self.validate_cache(DetectedCorners)
+		TransformationMatrix = self.perspective_matrix(InitialPoints) # Generate matrix for transformation.
+		if self.LensCorrection == True:
+			ImageCorrected = cv2.remap(ImageHSV, self.RemapMaps[0], self.RemapMaps[1], cv2.INTER_LINEAR) # Correct the lens distortion and perspective warp together.
+		else:
+			ImageCorrected = cv2.warpPerspective(ImageHSV, TransformationMatrix, (self.MazeSize[0], self.MazeSize[1])) # Correct the perspective warp.
 
 		# Uncomment below to display the results.
 		#ImageResult = cv2.cvtColor(ImageHSV, cv2.COLOR_HSV2BGR) # Make a copy of the corrected image in RBG to draw the results on.
@@ -152,13 +271,19 @@ class ImageProcessor():
 		the maze, opposite to a traditional coordinate system.
 		'''
 
-		#ImageUndistorted = cv2.undistort(Image, self.CameraMatrix, self.DistortionCoefficients, None) # Correct for lens distortion. Not used to save processing power.
+		if self.Resolution == None: # First frame: load the geometry cached for its resolution.
+			self.Resolution = (Image.shape[1], Image.shape[0])
+			if self.LensCorrection == True:
+				self.undistortion_maps()
+			self.CacheLoaded = self.load_cache()
+		self.Frames += 1
 
 		ImageBlurred = cv2.GaussianBlur(Image, self.KernelBlur, 0) # Blur image to remove high frequency noise.
 		ImageHSV = cv2.cvtColor(ImageBlurred, cv2.COLOR_BGR2HSV) # Convert image to HSV format.
 
 		ImageCorrected = self.correct_perspective(ImageHSV) # Correct the maze's tilt perspective.
 		BallFound, Centre = self.ball_detection(ImageCorrected) # Try to detect the position of the ball.
+		self.BallFound = BallFound # Tells a state estimator whether Position is a new measurement.
 		Active, Position = self.position_buffer(CurrentTime, BallFound, Centre) # Outputs the last position of the ball for a short time if the ball cannot be found.
 		if BallFound == True:
 			Position += np.array([28.5, 28]) # Add frame width and height.
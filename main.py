@@ -1,40 +1,132 @@
 #!/usr/bin/env python3
 '''
 'main.py' runs each of the testing, simulation or main control functions depending on
-the input command line argument. See the header in each function's file for a more
-detailed description of what they do. If no argument is provided the default main
-control function is run.
+the subcommand given on the command line. See the header in each function's file for a
+more detailed description of what they do. If no subcommand is provided the default main
+control function is run. Each mode is only imported once it has been chosen, so a mode
+never pays for the imports of the others. Use --profile-startup to print the time taken to
+import each module before the chosen mode starts, e.g. 'python3 main.py --profile-startup pid-sim'.
+The old numbered arguments (e.g. 'python3 main.py 2') are still accepted. Modes with their own
+options are given the rest of the command line, e.g.
+'python3 main.py controller-regression --record' or 'python3 main.py auto-tune --help'.
 '''
 
 # Import modules.
-from sys import argv
+import argparse
+import builtins
+import importlib
+import sys
+from time import perf_counter
 
-# Import functions.
-from full_system import full_system
-from testing.image_detection_test import image_detection_test
-from simulation.manual_sim import manual_sim
-from simulation.pid_sim import pid_sim
-from testing.motor_test import test1, test2, test3
-from testing.model_tuning import model_tuning
+# Subcommand: (Legacy number, module, function, description).
+Modes = {
+"full" : (None, "full_system", "full_system", "Fully integrated system (default)."),
+"image-test" : (0, "testing.image_detection_test", "image_detection_test", "Image detection test."),
+"manual-sim" : (1, "simulation.manual_sim", "manual_sim", "Simulation of manual tilt."),
+"pid-sim" : (2, "simulation.pid_sim", "pid_sim", "PID control simulation."),
+"motor-test-1" : (3, "testing.motor_test", "test1", "Motor test."),
+"motor-test-2" : (4, "testing.motor_test", "test2", "Motor test."),
+"motor-test-3" : (5, "testing.motor_test", "test3", "Motor test."),
+"model-tuning" : (6, "testing.model_tuning", "model_tuning", "Simulated model tuning."),
+"controller-regression" : (None, "testing.controller_regression", "controller_regression", "Replay recorded traces through the PID controller and time it."),
+"simulation-benchmark" : (None, "testing.simulation_benchmark", "simulation_benchmark", "Benchmark headless simulation throughput."),
+"integrator-check" : (None, "testing.integrator_check", "integrator_check", "Compare the event-driven and fixed time-step integrators."),
+"bias-check" : (None, "testing.bias_check", "bias_check", "Check the tilt bias estimator in simulation."),
+"controller-benchmark" : (None, "testing.controller_benchmark", "controller_benchmark", "Compare the PID and model-predictive controllers in simulation."),
+"auto-tune" : (None, "simulation.auto_tuner", "auto_tuner", "Tune the PID gains with CMA-ES on headless simulated episodes.")
+}
+
+# Modes whose function parses its own options from the rest of the command line.
+ArgumentModes = ["controller-regression", "simulation-benchmark", "integrator-check", "bias-check", "controller-benchmark", "auto-tune"]
+
+class ImportProfiler():
+    # Records the time taken by every module imported for the first time while active.
+    def __init__(self):
+        self.Records = [] # (Depth, module name, total time, self time) in the order imports finished.
+        self.ChildTimes = [] # Stack of time spent in nested imports.
+        self.OriginalImport = builtins.__import__
+
+    def __repr__(self):
+        # Makes the class printable.
+        return "ImportProfiler(Modules: %s)" % (len(self.Records))
+
+    def __enter__(self):
+        builtins.__import__ = self.timed_import
+        return self
+
+    def __exit__(self, *ExceptionInfo):
+        builtins.__import__ = self.OriginalImport
+        return False
+
+    def timed_import(self, Name, Globals = None, Locals = None, FromList = (), Level = 0):
+        # Only time absolute imports of modules that have not been loaded yet.
+        if Level != 0 or Name in sys.modules:
+            return self.OriginalImport(Name, Globals, Locals, FromList, Level)
+        self.ChildTimes.append(0.0)
+        StartTime = perf_counter()
+        try:
+            return self.OriginalImport(Name, Globals, Locals, FromList, Level)
+        finally:
+            TotalTime = perf_counter() - StartTime
+            ChildTime = self.ChildTimes.pop()
+            if len(self.ChildTimes) > 0:
+                self.ChildTimes[-1] += TotalTime # Add to the parent's nested import time.
+            self.Records.append((len(self.ChildTimes), Name, TotalTime, TotalTime - ChildTime))
+
+    def import_module(self, Name):
+        # importlib.import_module() bypasses builtins.__import__, so time the top level module here.
+        with self:
+            self.ChildTimes.append(0.0)
+            StartTime = perf_counter()
+            Module = importlib.import_module(Name)
+            TotalTime = perf_counter() - StartTime
+            self.Records.append((0, Name, TotalTime, TotalTime - self.ChildTimes.pop()))
+        return Module
+
+    def report(self, Stream = sys.stderr):
+        # Print import times in import order (parents after their children), indented by depth.
+        Stream.write("{:>10} {:>10}  {}\n".format("Total [ms]", "Self [ms]", "Module"))
+        for Depth, Name, TotalTime, SelfTime in self.Records:
+            Stream.write("{:10.1f} {:10.1f}  {}{}\n".format(TotalTime * 1000, SelfTime * 1000, "  " * Depth, Name))
+        Total = sum(Record[2] for Record in self.Records if Record[0] == 0)
+        Stream.write("{:10.1f} {:>10}  {}\n".format(Total * 1000, "", "(total)"))
+
+def parse_arguments(Arguments):
+    # Returns the parsed arguments and the rest of the command line, which is given to the mode.
+    # Translate an old numbered argument to its subcommand. Only the first positional argument can be one, the rest may be a mode's options.
+    LegacyNames = {str(Mode[0]) : Name for Name, Mode in Modes.items() if Mode[0] != None}
+    Arguments = list(Arguments)
+    for Index, Argument in enumerate(Arguments):
+        if Argument.startswith("-") == False:
+            Arguments[Index] = LegacyNames.get(Argument, Argument)
+            break
+
+    Parser = argparse.ArgumentParser(description = "Maze solver control, simulation and testing modes.")
+    Parser.add_argument("--profile-startup", action = "store_true", help = "print the import time of each module before running the mode.")
+    Subparsers = Parser.add_subparsers(dest = "Mode", metavar = "mode")
+    for Name, Mode in Modes.items():
+        Subparsers.add_parser(Name, help = Mode[3], add_help = Name not in ArgumentModes) # Modes with options print their own help.
+    Arguments, ModeArguments = Parser.parse_known_args(Arguments)
+    if len(ModeArguments) > 0 and Arguments.Mode not in ArgumentModes:
+        Parser.error("unrecognized arguments: %s" % (" ".join(ModeArguments)))
+    return Arguments, ModeArguments
 
 def main():
-    if len(argv) == 2 and argv[1].isdigit():
-        if int(argv[1]) == 0:
-            image_detection_test()
-        elif int(argv[1]) == 1:
-            manual_sim() # Simulation of manual tilt.
-        elif int(argv[1]) == 2:
-            pid_sim() # PID control simulation. 
-        elif int(argv[1]) == 3:
-            test1() # Motor test.
-        elif int(argv[1]) == 4:
-            test2() # Motor test.
-        elif int(argv[1]) == 5:
-            test3() # Motor test.
-        elif int(argv[1]) == 6:
-            model_tuning() # Simulated model tuning.
+    Arguments, ModeArguments = parse_arguments(sys.argv[1:])
+    Mode = Modes[Arguments.Mode or "full"]
+
+    if Arguments.profile_startup == True:
+        Profiler = ImportProfiler()
+        Module = Profiler.import_module(Mode[1])
+        Profiler.report()
+    else:
+        Module = importlib.import_module(Mode[1])
+
+    # Run the chosen mode.
+    if Arguments.Mode in ArgumentModes:
+        getattr(Module, Mode[2])(ModeArguments)
     else:
-        full_system()
+        getattr(Module, Mode[2])()
 
 if __name__ == "__main__":
     main()
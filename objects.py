@@ -6,10 +6,18 @@ This file contains object classes required for maze control and simulation.
 # Import modules.
 import numpy as np
 from math import sin
-import random
+from copy import copy
 
 # Import functions and values.
-from settings import FrameSize, FrameHorizontal, FrameVertical, FrameBounce, WallBounce, BallRadius, BallMass, HoleRadius, Drag, ImageNoise
+from settings import FrameSize, FrameHorizontal, FrameVertical, FrameBounce, WallBounce, BallRadius, BallMass, HoleRadius, Drag, DistanceFieldResolution, SweptCollision, MaxBounces
+
+def ball_acceleration(Theta, Velocity, Drag = Drag):
+    # [mm/s^2] Acceleration of the ball from the maze tilt and drag. Works on arrays of any shape ending in (x, y), for batches of balls.
+    # NewA[mm/s^2] = gsin(theta)*1000
+    NewA = 9.81 * np.sin(Theta) * 1000
+    # Artificial drag on ball: approximates air resistance and friction.
+    NewA -= Drag * np.sign(Velocity) * (4 / (abs(0.005 * Velocity) + 0.5)) + 0.02 * Velocity
+    return NewA
 
 class Ball():
     # Class for the metal ball.
@@ -31,6 +39,7 @@ class Ball():
         self.R = BallRadius # [mm]
         self.Mass = BallMass # [kg] (Currently unused.)
         self.Drag = Drag # See settings.
+        self.Collisions = 0 # Number of wall collisions resolved, for benchmarking.
 
         # Saves balls's last position, needed for collision detection
         self.LastS = self.S
@@ -43,6 +52,15 @@ class Ball():
         # Makes the class printable.
         return "Ball(Active: %s, Position: %s, Velocity: %s, Acceleration: %s)" % (self.Active, np.round(self.S, 1), np.round(self.v, 1), np.round(self.a, 1))
 
+    def copy(self):
+        # Copy of the ball with its own state arrays.
+        NewBall = copy(self)
+        NewBall.S = self.S.copy()
+        NewBall.v = self.v.copy()
+        NewBall.a = self.a.copy()
+        NewBall.LastS = self.LastS.copy()
+        return NewBall
+
     def last_position(self):
         # Saves balls's last position, needed for collision detection.
         self.LastS = self.S
@@ -52,11 +70,8 @@ class Ball():
         self.LastPositionBottom = self.S[1] + self.R
 
     def next_a(self, Theta):
-        # NewA[mm/s^2] = gsin(theta)*1000
-        NewA = 9.81 * np.sin(Theta) * 1000
-        # Artificial drag on ball: approximates air resistance and friction.
-        NewA -= self.Drag * np.sign(self.v) * (4 / (abs(0.005 * self.v) + 0.5)) + 0.02 * self.v
-        return NewA
+        # Acceleration from the tilt and drag, see ball_acceleration.
+        return ball_acceleration(Theta, self.v, self.Drag)
 
     def next_v(self, TimeStep, NewA):
         # Calculate next v.
@@ -100,6 +115,7 @@ class Ball():
         np.transpose(self.v) # Required as we use size (2, 1) arrays instead of (1, 2) arrays for simplicity.
         self.v[1] = -self.v[1] # Required as we use size (2, 1) arrays instead of (1, 2) arrays for simplicity.
         self.v = Bounce * self.v
+        self.Collisions += 1
 
     def wall_collision(self, Walls):
         # Handles wall collision in 8 cases.
@@ -109,18 +125,22 @@ class Ball():
                     and self.LastS[1] >= wall.Top and self.LastS[1] <= wall.Bottom: # For right side "flat" reflection.
                 self.S[0] = wall.S[0] + wall.Size[0] + wall.S[0] + wall.Size[0] - self.S[0] + self.R + self.R
                 self.v[0] = - wall.Bounce * self.v[0]
+                self.Collisions += 1
             elif self.Right >= wall.Left and self.LastPositionRight < wall.Left \
                     and self.LastS[1] >= wall.Top and self.LastS[1] <= wall.Bottom: # For left side "flat" reflection.
                 self.S[0] = wall.S[0] + wall.S[0] - self.S[0] - self.R - self.R
                 self.v[0] = - wall.Bounce * self.v[0]
+                self.Collisions += 1
             elif self.Top <= wall.Bottom and self.LastPositionTop > wall.Bottom \
                     and self.LastS[0] >= wall.Left and self.LastS[0] <= wall.Right: # For bottom side "flat" reflection.
                 self.S[1] = wall.S[1] + wall.Size[1] + wall.S[1] + wall.Size[1] - self.S[1] + self.R + self.R
                 self.v[1] = - wall.Bounce * self.v[1]
+                self.Collisions += 1
             elif self.Bottom >= wall.Top and self.LastPositionBottom < wall.Top \
                     and self.LastS[0] >= wall.Left and self.LastS[0] <= wall.Right: # For top side "flat" reflection.
                 self.S[1] = wall.S[1] + wall.S[1] - self.S[1] - self.R - self.R
                 self.v[1] = - wall.Bounce * self.v[1]
+                self.Collisions += 1
             elif self.R > ((self.S[0] - wall.Left) ** 2 + (self.S[1] - wall.Top) ** 2 ) ** 0.5 \
                     and self.R <= ((self.LastS[0] - wall.Left) ** 2 + (self.LastS[1] - wall.Top) ** 2 ) ** 0.5: # Top left corner collision.
                 y = wall.Top - self.S[1] # Inversed as our y axis runs from up to down.
@@ -152,19 +172,152 @@ class Ball():
             if hole.R + 1 > ((hole.S[0] - self.S[0]) ** 2 + (hole.S[1] - self.S[1]) ** 2 ) ** 0.5:
                 self.Active = False
 
-    def next_step(self, TimeStep, Theta, Walls, Holes):
-        # Calculate next ball position based on model.
+    def wall_impact(self, Start, Displacement, WallBounds):
+        # Time of impact of the ball moving from Start by Displacement with every wall at once.
+        # Each wall grown by the ball radius is a rounded rectangle: a slab test against the grown box gives
+        # the entry point, and entry points in a corner region are replaced by a ray test against the corner circle.
+        # Returns (t, Normal, Index) of the first impact with 0 <= t <= 1, or None.
+        Low = WallBounds[:, :2] # (Left, Top)
+        High = WallBounds[:, 2:] # (Right, Bottom)
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            T1 = (Low - self.R - Start) / Displacement
+            T2 = (High + self.R - Start) / Displacement
+        Inside = (Start >= Low - self.R) & (Start <= High + self.R) # Per axis, for zero displacement.
+        Still = Displacement == 0
+        TNear = np.where(Still, np.where(Inside, -np.inf, np.inf), np.minimum(T1, T2))
+        TFar = np.where(Still, np.where(Inside, np.inf, -np.inf), np.maximum(T1, T2))
+        Entry = np.max(TNear, axis = 1)
+        Exit = np.min(TFar, axis = 1)
+        Candidates = np.nonzero((Entry <= Exit) & (Exit >= 0) & (Entry <= 1))[0]
+        if len(Candidates) == 0:
+            return None
+
+        Embedded = Entry[Candidates] < 0 # Starts inside the grown box, only possible without touching the wall in a corner region.
+        Entry = np.maximum(Entry[Candidates], 0)
+        Axis = np.argmax(TNear[Candidates], axis = 1)
+        Normals = np.zeros((len(Candidates), 2))
+        Normals[np.arange(len(Candidates)), Axis] = - np.sign(Displacement[Axis])
+
+        # Entry points beyond the wall in both axes hit a rounded corner instead.
+        Points = Start + Entry[:, None] * Displacement
+        Below, Above = Points < Low[Candidates], Points > High[Candidates]
+        Corner = np.all(Below | Above, axis = 1)
+        Entry[Embedded & (Corner == False)] = np.inf # Walls the ball starts inside are ignored, see wall_push_out.
+        if np.any(Corner):
+            Centres = np.where(Below[Corner], Low[Candidates][Corner], High[Candidates][Corner])
+            m = Start - Centres
+            a = Displacement.dot(Displacement)
+            b = m.dot(Displacement)
+            c = np.sum(m ** 2, axis = 1) - self.R ** 2
+            Discriminant = b ** 2 - a * c
+            with np.errstate(invalid = "ignore"):
+                CornerEntry = (- b - np.sqrt(Discriminant)) / a
+            CornerEntry[(Discriminant < 0) | (c < 0) | (CornerEntry < 0) | (CornerEntry > 1)] = np.inf # Miss, or starts inside.
+            Entry[Corner] = CornerEntry
+            Hit = np.isfinite(CornerEntry)
+            Normals[np.nonzero(Corner)[0][Hit]] = (Start + CornerEntry[Hit, None] * Displacement - Centres[Hit]) / self.R
+
+        First = np.argmin(Entry)
+        if Entry[First] == np.inf:
+            return None
+        return Entry[First], Normals[First], Candidates[First]
+
+    def wall_push_out(self, Position, WallBounds):
+        # Moves Position out of every wall the ball overlaps there, to just touching it, as the sweep can't find the impact with a wall it
+        # starts inside (e.g. a start position measured slightly into a wall). Returns the new position.
+        Low = WallBounds[:, :2] # (Left, Top)
+        High = WallBounds[:, 2:] # (Right, Bottom)
+        for Index in np.nonzero(np.all((Position > Low - self.R) & (Position < High + self.R), axis = 1))[0]:
+            Closest = np.clip(Position, Low[Index], High[Index]) # Nearest point of the wall.
+            Offset = Position - Closest
+            Distance = np.hypot(*Offset)
+            if Distance >= self.R:
+                continue # Beyond a rounded corner, so not touching.
+            if Distance > 0:
+                Position = Closest + (self.R + 1e-6) * Offset / Distance
+            else: # The centre is inside the wall, so leave through the nearest side.
+                Depths = np.concatenate([Position - Low[Index], High[Index] - Position]) # To the left, top, right and bottom sides.
+                Side = np.argmin(Depths)
+                Normal = np.zeros(2)
+                Normal[Side % 2] = -1 if Side < 2 else 1
+                Position = Position + (Depths[Side] + self.R + 1e-6) * Normal
+        return Position
+
+    def swept_wall_collision(self, Geometry):
+        # Continuous wall collision: moves the ball along its path from LastS to S, reflecting off walls at the time of impact,
+        # up to MaxBounces times per step. Returns the path as a list of points for hole collision.
+        Start = np.array(self.LastS, dtype = float)
+        End = np.array(self.S, dtype = float)
+        Pushed = self.wall_push_out(Start, Geometry.WallBounds) # Starting inside a wall, the step starts where the ball touches it.
+        Start, End = Pushed, End + (Pushed - Start)
+        Path = [Start]
+        for Bounces in range(MaxBounces + 1):
+            Displacement = End - Start
+            if Displacement[0] == 0 and Displacement[1] == 0:
+                break
+            Impact = self.wall_impact(Start, Displacement, Geometry.WallBounds)
+            if Impact == None:
+                break
+            t, Normal, Index = Impact
+            Contact = Start + t * Displacement + 1e-6 * Normal # Stay just outside the wall.
+            Path.append(Contact)
+            self.Collisions += 1
+            if Bounces == MaxBounces:
+                End = Contact # Out of bounces, stop at the wall.
+                break
+
+            # Reflect the rest of the step and the velocity off the wall.
+            Bounce = Geometry.WallBounce[Index]
+            Remaining = (1 - t) * Displacement
+            Remaining = Remaining - (1 + Bounce) * Remaining.dot(Normal) * Normal
+            if self.v.dot(Normal) < 0:
+                self.v = self.v - (1 + Bounce) * self.v.dot(Normal) * Normal
+            Start, End = Contact, Contact + Remaining
+        Path.append(End)
+        self.S = End
+        return Path
+
+    def swept_hole_collision(self, Geometry, Path):
+        # Continuous hole collision: the ball falls in if any part of its path passes within R + 1 of a hole centre.
+        if len(Geometry.HolePositions) == 0:
+            return
+        for Start, End in zip(Path[:-1], Path[1:]):
+            Segment = End - Start
+            Offsets = Geometry.HolePositions - Start
+            Projection = np.clip(Offsets.dot(Segment) / max(Segment.dot(Segment), 1e-12), 0, 1)
+            Distances = np.hypot(*(Offsets - Projection[:, None] * Segment).T)
+            if np.any(Distances < Geometry.HoleRadii + 1):
+                self.Active = False
+                return
+
+    def exact_motion(self, TimeStep):
+        # Moves the ball exactly as if self.a was constant over the step. Used for long steps, see simulation/event_driven.py.
+        NewV = self.v + self.a * TimeStep
+        NewV[np.abs(NewV) < 0.05] = 0.0 # Stop ball if v is too small, as in next_v.
+        self.S = self.S + self.v * TimeStep + self.a * TimeStep ** 2 / 2
+        self.v = NewV
+
+    def next_step(self, TimeStep, Theta, Walls, Holes, Geometry = None, Exact = False):
+        # Calculate next ball position based on model. If Geometry is given, collisions are found continuously along the step.
+        # If Exact is True, the step is integrated exactly with the acceleration (and drag) at its start, instead of semi-implicitly.
         if self.Active == True:
             self.last_position() # Save last position of ball.
 
             # Process motion.
             self.a = self.next_a(Theta)
-            self.v = self.next_v(TimeStep, self.a)
-            self.S = self.next_S(TimeStep, self.v)
+            if Exact == True:
+                self.exact_motion(TimeStep)
+            else:
+                self.v = self.next_v(TimeStep, self.a)
+                self.S = self.next_S(TimeStep, self.v)
 
             # Process collisions.
-            self.wall_collision(Walls)
-            self.hole_collision(Holes)
+            if Geometry != None:
+                Path = self.swept_wall_collision(Geometry)
+                self.swept_hole_collision(Geometry, Path)
+            else:
+                self.wall_collision(Walls)
+                self.hole_collision(Holes)
 
 class Wall():
     # Class for walls.
@@ -211,7 +364,7 @@ class Hole():
 
 class Checkpoint():
     # Class for checkpoints.
-    def __init__(self, Position, Special = False, Radius = None, Time = None, HardControlSignal = None):
+    def __init__(self, Position, Special = False, Radius = None, Time = None, HardControlSignal = None, Gains = None):
         # Position and Size should be provided in numpy vectors, Size 2.
         if type(Position) != np.ndarray:
             raise TypeError("Position should be given in a size 2 numpy array.")
@@ -223,13 +376,104 @@ class Checkpoint():
         self.Radius = Radius # Custom radius.
         self.Time = Time # Custom time to "pass".
         self.HardControlSignal = HardControlSignal # Custom control signal output.
+        self.Gains = Gains # Dictionary of PID gains used on the way to this checkpoint, see GainNames in control/checkpoint_route.py.
 
     def __repr__(self):
         # Printable.
         return "Checkpoint(Position: %s, Special: %s)" % (np.round(self.S, 1), self.Special)
 
+class MazeGeometry():
+    # Class for the walls and holes of a maze. These never change during a run, so one MazeGeometry is shared by every run of a maze.
+    def __init__(self, walls, holes):
+        self.Walls = walls # List of Wall objects, including the frame.
+        self.Holes = holes # List of Hole objects.
+
+        # Arrays of the geometry for vectorised calculations.
+        self.WallBounds = np.array([[wall.Left, wall.Top, wall.Right, wall.Bottom] for wall in walls], dtype = float).reshape(-1, 4) # [mm]
+        self.WallBounce = np.array([wall.Bounce for wall in walls], dtype = float)
+        self.HolePositions = np.array([hole.S for hole in holes], dtype = float).reshape(-1, 2) # [mm]
+        self.HoleRadii = np.array([hole.R for hole in holes], dtype = float) # [mm]
+
+        self.DistanceField = None # Built when first needed, see distance_field().
+
+    def __repr__(self):
+        # Makes the class printable.
+        return "MazeGeometry(Walls: %s, Holes: %s)" % (len(self.Walls), len(self.Holes))
+
+    def distance_field(self):
+        # Returns the signed distance field of the geometry, building it the first time.
+        if self.DistanceField == None:
+            self.DistanceField = DistanceField(self)
+        return self.DistanceField
+
+class DistanceField():
+    '''
+    Class for a signed distance field over the maze, sampled on a grid of Resolution mm. For
+    every grid cell it stores the distance from the centre of the ball to the nearest wall
+    surface (negative inside a wall) and to the edge of the nearest hole at which the ball
+    falls in (negative once it has fallen in), plus the direction away from the nearest hole.
+    All lookups are a single array index.
+    '''
+    def __init__(self, Geometry, Resolution = DistanceFieldResolution):
+        self.Resolution = Resolution # [mm]
+        self.Shape = (int(np.ceil(FrameSize[1] / Resolution)), int(np.ceil(FrameSize[0] / Resolution))) # (Rows, columns).
+        X = (np.arange(self.Shape[1]) + 0.5) * Resolution # [mm] Cell centres.
+        Y = (np.arange(self.Shape[0]) + 0.5) * Resolution
+
+        # Signed distance to the nearest wall. The union of walls is the minimum of their distances.
+        self.WallDistance = np.full(self.Shape, np.inf)
+        for Left, Top, Right, Bottom in Geometry.WallBounds:
+            Dx = np.maximum(Left - X, X - Right) # Positive outside the wall in x.
+            Dy = np.maximum(Top - Y, Y - Bottom)
+            Outside = np.hypot(np.maximum(Dy, 0)[:, None], np.maximum(Dx, 0)[None, :])
+            Inside = np.minimum(np.maximum(Dy[:, None], Dx[None, :]), 0)
+            np.minimum(self.WallDistance, Outside + Inside, out = self.WallDistance)
+
+        # Signed distance to the nearest hole, measured to the radius at which the ball falls in (see Ball.hole_collision).
+        self.HoleDistance = np.full(self.Shape, np.inf)
+        for Position, Radius in zip(Geometry.HolePositions, Geometry.HoleRadii):
+            np.minimum(self.HoleDistance, np.hypot(Y[:, None] - Position[1], X[None, :] - Position[0]) - (Radius + 1), out = self.HoleDistance)
+
+        # Unit vector pointing away from the nearest hole.
+        if len(Geometry.HolePositions) > 0:
+            GradientY, GradientX = np.gradient(self.HoleDistance, Resolution)
+            Norm = np.maximum(np.hypot(GradientX, GradientY), 1e-9)
+            self.HoleGradient = np.stack((GradientX / Norm, GradientY / Norm), axis = -1)
+        else:
+            self.HoleGradient = np.zeros(self.Shape + (2,))
+
+    def __repr__(self):
+        # Makes the class printable.
+        return "DistanceField(Resolution: %s, Shape: %s)" % (self.Resolution, self.Shape)
+
+    def cell(self, Position):
+        # Grid cell (row, column) containing a position in mm.
+        Row = min(max(int(Position[1] / self.Resolution), 0), self.Shape[0] - 1)
+        Column = min(max(int(Position[0] / self.Resolution), 0), self.Shape[1] - 1)
+        return Row, Column
+
+    def wall_distance(self, Position):
+        # [mm] Distance from a ball centre at Position to the nearest wall surface.
+        return self.WallDistance[self.cell(Position)]
+
+    def hole_distance(self, Position):
+        # [mm] Distance from a ball centre at Position to falling into the nearest hole, and the unit vector away from that hole.
+        Cell = self.cell(Position)
+        return self.HoleDistance[Cell], self.HoleGradient[Cell]
+
+    def cells(self, Positions):
+        # Grid cells (rows, columns) containing an array of positions of shape (..., 2), for batched lookups.
+        Rows = np.clip((Positions[..., 1] / self.Resolution).astype(int), 0, self.Shape[0] - 1)
+        Columns = np.clip((Positions[..., 0] / self.Resolution).astype(int), 0, self.Shape[1] - 1)
+        return Rows, Columns
+
+    def distances(self, Positions):
+        # [mm] Wall and hole distances (see wall_distance and hole_distance) for an array of positions of shape (..., 2).
+        Cells = self.cells(Positions)
+        return self.WallDistance[Cells], self.HoleDistance[Cells]
+
 class Maze():
-    # Class for full model of maze.
+    # Class for full model of maze. The walls and holes are kept in a shared MazeGeometry, the ball and checkpoints are the run state.
     def __init__(self, ball, walls, holes, checkpoints):
         # Check if maze has been initialised correctly.
         if type(ball) != Ball:
@@ -282,20 +526,35 @@ class Maze():
         ]
         # Add frame to maze.
         self.Walls.extend(Frame)
+        self.Geometry = MazeGeometry(self.Walls, self.Holes) # Walls and holes should not be changed after this.
+        self.SweptCollision = SweptCollision # Continuous collision detection, see settings.
+        self.Noise = None # Simulated image detection noise (a NoiseModel, see simulation/noise.py), given to new_run. None for none.
 
     def __repr__(self):
         # Makes the class printable.
         return "Maze(Size: %s, Ball: %s, Walls: %s, Holes: %s, Checkpoints: %s)" % (np.round(self.Size, 1), self.Ball, self.Walls, self.Holes, self.Checkpoints)
 
+    def new_run(self, Noise = None):
+        # Returns a copy of the maze for a new run. Only the run state (ball, checkpoint list and noise) is copied, the geometry is shared.
+        # Noise is the run's NoiseModel, see simulation/noise.py. Giving it the Seed of an earlier run's noise (Maze.Noise.Seed) repeats that noise exactly.
+        NewMaze = copy(self)
+        NewMaze.Ball = self.Ball.copy()
+        NewMaze.Checkpoints = list(self.Checkpoints) # Checkpoint objects are never changed, only the list is.
+        NewMaze.Noise = Noise
+        return NewMaze
+
     def image_noise(self):
-        # Simulate random noise from image detection.
-        BallPosition = self.Ball.S + np.array([random.randint(-ImageNoise, ImageNoise), random.randint(-ImageNoise, ImageNoise)])
+        # Simulate random noise from image detection. Returns None if the measurement was dropped, or the exact position without a NoiseModel.
+        if self.Noise == None:
+            return self.Ball.S.copy()
+        BallPosition, _ = self.Noise.sample(self.Ball.S)
         return BallPosition
 
-    def next_step(self, TimeStep, Theta = np.array([0.0, 0.0])):
-        # Calculate next ball position based on model, output info.
-        self.Ball.next_step(TimeStep, Theta, self.Walls, self.Holes)
-        BallPosition = self.image_noise()
+    def next_step(self, TimeStep, Theta = np.array([0.0, 0.0]), Exact = False, Measure = True):
+        # Calculate next ball position based on model, output info. See Ball.next_step for Exact. Measure False skips the noisy
+        # measurement (the output position is None), e.g. when a SensorModel draws the measurements from the same noise.
+        self.Ball.next_step(TimeStep, Theta, self.Walls, self.Holes, self.Geometry if self.SweptCollision == True else None, Exact)
+        BallPosition = self.image_noise() if Measure == True else None
         return self.Ball.Active, BallPosition
 
 if __name__ == "__main__":
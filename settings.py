@@ -30,6 +30,19 @@ HSVLimitsBlue = np.array([[70, 58, 0], [120, 201, 75]])
 # Upper and lower HSV limits for the green frame.
 HSVLimitsGreen = np.array([[22, 95, 23], [86, 248, 148]])
 
+# Correct the camera's lens distortion, in the same remap as the perspective correction.
+LensCorrectionOn = True
+
+# File caching the frame corners and perspective matrix between runs, for each camera resolution. None to disable.
+CameraCacheFile = "camera_cache.npz"
+
+# Frames used to check the cached frame corners, and how far detected corners can be from them before the cache is updated.
+CameraCacheFrames = 5
+CameraCacheTolerance = 5 # [px]
+
+# Distance any frame corner has to move before the perspective matrix (and the lens correction maps) are made again, so jitter and small tilts don't rebuild them every frame.
+PerspectiveTolerance = 1.5 # [px] Just over a one pixel step on both axes.
+
 ''' CONTROL SETTINGS '''
 # Maximum frequency of the control loop.
 ControlFrequency = 15 # [Hz]
@@ -48,6 +61,12 @@ Kd = 3e-4
 # Maximum proportional term allowed.
 PMax = 0.032
 
+# Hole repulsion coefficient: tilt away from a hole per mm closer than HoleDangerDistance. 0 to disable.
+Kr = 0
+
+# Distance from falling into a hole at which hole repulsion starts.
+HoleDangerDistance = 8 # [mm]
+
 # Static boost coefficient.
 Ks = 0.022
 
@@ -57,9 +76,43 @@ Kst = 1.8
 # Number of error values to buffer for PID derivative calculation.
 BufferSize = 3
 
+# Use the constant-acceleration Kalman filter's position and velocity in the PID controller instead of the raw position and regression derivative.
+KalmanFilterOn = False
+
+# Kalman filter noise: spectral density of the random jerk, and standard deviation of the measured position.
+KalmanProcessNoise = 1e5 # [mm^2/s^5]
+KalmanMeasurementNoise = 1 # [mm]
+
+# Project the measured ball position forward from the camera capture time to the expected motor actuation time. Uses the Kalman filter's estimate.
+LatencyCompensationOn = False
+
+# Time from sending a motor angle to the maze tilting, added to the prediction time.
+ActuationDelay = 0.02 # [s]
+
+# Integration step and longest time for the latency-compensating position predictor.
+PredictionTimeStep = 0.01 # [s]
+MaxPredictionTime = 0.25 # [s]
+
+# Use the model-predictive controller instead of the PID controller.
+MPCControllerOn = False
+
+# MPC: candidate tilt sequences evaluated per tick, steps in each sequence and the time each step is held.
+MPCCandidates = 256
+MPCHorizon = 8
+MPCStepTime = 0.0667 # [s]
+
+# MPC: largest tilt considered, and the cost weights of tilt, of the ball's speed at each step and of falling in a hole.
+MPCMaxTheta = 0.05 # [rad]
+MPCEffortWeight = 1e4
+MPCVelocityWeight = 0.03
+MPCHolePenalty = 1e7
+
 # Minimum tilt angle allowed.
 MinTheta = np.array([0, 0])
 
+# Conversion from motor control signal to maze tilt angle (based on measurements).
+ControlToTheta = np.array([0.088888888, 0.6])
+
 # Maximum motor angle.
 SaturationLimit = np.array([pi / 3.5, pi / 3.5])
 
@@ -69,13 +122,52 @@ CalibrationTolerance = 2 # [mm]
 # Time before calibrated.
 CalibrationTime = 2.5 # [s]
 
+# Learn the level control signal while running and save it to BiasFile, so later runs start calibrated. See control/bias_estimator.py.
+BiasEstimationOn = False
+BiasFile = "tilt_bias.json"
+
+# Weight of each new sample in the bias estimate, and saved estimates older than BiasMaxAge are ignored (e.g. after the maze has been moved).
+BiasLearningRate = 0.002
+BiasMaxAge = 24 * 3600 # [s]
+
+# Speed along an axis above which the ball rolls freely, for bias samples.
+BiasMinSpeed = 20 # [mm/s]
+
+# The ball is held still, for bias samples, if it stays below BiasHoldSpeed and within BiasHoldDistance of where it stopped for BiasHoldTime.
+BiasHoldSpeed = 5 # [mm/s]
+BiasHoldDistance = 2 # [mm]
+BiasHoldTime = 1 # [s]
+
 # How close the ball has to be to each checkpoint.
 CheckpointRadius = 8 # [mm]
 
 # Time the ball has to stay within the set point to "pass" it.
 SetPointTime = 0
 
+# Distance along the route to look ahead for checkpoints the ball has already passed, which are then skipped. 0 to disable.
+SetPointLookAhead = 0 # [mm]
+
+# Initial number of control ticks the trace recorder holds, and the file the trace of the last run is saved to.
+TraceCapacity = 4096
+TraceFile = "trace.npz"
+
+# Grid cell size of the wall and hole distance field.
+DistanceFieldResolution = 1 # [mm]
+
+# Grid cell size and extra clearance from walls and holes for automatic route planning.
+PlannerResolution = 1 # [mm]
+PlannerClearance = 0 # [mm]
+
 ''' SIMULATION SETTINGS '''
+# Fixed time-step of the physics simulation.
+SimulationTimeStep = 0.002 # [s]
+
+# Longest step of the event-driven integrator while the ball rolls freely.
+EventMaxStep = 0.05 # [s]
+
+# Maximum physics substeps per loop. Time beyond this is dropped, so the simulation slows down instead of falling behind.
+MaxSubsteps = 50
+
 # Tilt angle for manual maze tilt.
 ThetaStep = 0.01 * pi
 
@@ -86,9 +178,46 @@ Drag = 10
 FrameBounce = 0.06
 WallBounce = 0.01
 
+# Continuous (swept) collision detection, so the ball can't pass through walls or holes within a time-step. False for the original per-step checks.
+# Off by default as it is slower on small mazes; testing/simulation_benchmark.py runs both.
+SweptCollision = False
+
+# Maximum wall bounces handled within a single time-step.
+MaxBounces = 4
+
 # Simulated +- error value from image detection.
 ImageNoise = 1 # [mm]
 
+# Standard deviation of additional Gaussian image detection noise.
+ImageNoiseDeviation = 0 # [mm]
+
+# Grid simulated measurements are rounded to, e.g. the size of a camera pixel. 0 for none.
+ImageQuantisation = 0 # [mm]
+
+# Probability of a simulated measurement being lost.
+ImageDropout = 0
+
+# Minimum and maximum simulated image detection latency.
+CameraLatency = np.array([0.03, 0.07]) # [s]
+
+# Frame rate of the simulated camera.
+CameraFrameRate = 40 # [Hz]
+
+# Give the simulated controller delayed, noisy camera measurements instead of the exact ball position. Off by default, so pid_sim
+# behaves as it always has; see simulation/sensor_model.py.
+SimulatedCamera = False
+
+# Seed for simulation noise. None for a new seed every run (saved in Maze.Noise.Seed to replay a run).
+NoiseSeed = None
+
+# Number of noise values generated at a time.
+NoiseBlockSize = 1024
+
+# Grid cell size, wall thickness and fraction of cells off the route given a hole, for generated mazes.
+GeneratedCellSize = 25 # [mm]
+GeneratedWallThickness = 6 # [mm]
+GeneratedHoleDensity = 0.2
+
 ''' GRAPHICAL SETTINGS '''
 # GUI display scaling factor. Use 1 for pi touchscreen.
 DisplayScale = 1
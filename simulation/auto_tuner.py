@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+'''
+This file contains the PID auto-tuner. It searches the PID gains (TunedGains) with CMA-ES, a
+sample-efficient black-box optimiser, implemented here with NumPy only so it runs offline.
+Each generation samples a population of gain sets around the current mean, every set is run
+for the same seeded headless episodes (see run_pid_episode in simulation/headless_sim.py) in
+parallel worker processes, and the mean and search distribution move towards the cheapest
+sets. The gains are searched in log10 space, as they are all positive and differ by orders of
+magnitude. An episode costs its completion time, or MaxTime plus the unfinished fraction of the
+route times MaxTime if it wasn't completed, plus BallLossPenalty if the ball was lost.
+
+The optimiser's state is written to a checkpoint file after every generation. Running the
+tuner again with the same checkpoint continues where it stopped and gives the same result as
+an uninterrupted run, e.g.
+'python3 -m simulation.auto_tuner --generations 30 --output gains.json'.
+'''
+
+# Import modules.
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import numpy as np
+from math import log, sqrt
+
+# Import functions and settings.
+from mazes import get_maze
+from simulation.headless_sim import run_pid_episode, DefaultGains
+
+# Gains searched by the tuner. Kr and HoleDangerDistance keep their settings values.
+TunedGains = ("Kp", "Ki", "Kd", "PMax", "Ks", "Kst")
+
+# Mazes with routes to follow.
+TuningMazes = ["Maze1", "Maze2", "Maze3"]
+
+class CMAES():
+    # Covariance matrix adaptation evolution strategy, minimising a cost. See N. Hansen, "The CMA Evolution Strategy: A Tutorial".
+    def __init__(self, Mean, Sigma, Population = None, Seed = 0):
+        self.Mean = np.array(Mean, dtype = float) # Centre of the search distribution.
+        self.Sigma = float(Sigma) # Step size.
+        n = len(self.Mean)
+        self.Population = Population if Population != None else 4 + int(3 * log(n)) # Candidates per generation.
+        self.Parents = self.Population // 2 # Best candidates used to update the distribution.
+        Weights = log(self.Parents + 0.5) - np.log(np.arange(1, self.Parents + 1))
+        self.Weights = Weights / np.sum(Weights)
+        self.MuEff = 1 / np.sum(self.Weights ** 2) # Variance effective selection mass.
+
+        # Learning rates.
+        self.Cc = (4 + self.MuEff / n) / (n + 4 + 2 * self.MuEff / n) # Covariance path.
+        self.Cs = (self.MuEff + 2) / (n + self.MuEff + 5) # Step size path.
+        self.C1 = 2 / ((n + 1.3) ** 2 + self.MuEff) # Rank one update.
+        self.CMu = min(1 - self.C1, 2 * (self.MuEff - 2 + 1 / self.MuEff) / ((n + 2) ** 2 + self.MuEff)) # Rank mu update.
+        self.Damping = 1 + 2 * max(0, sqrt((self.MuEff - 1) / (n + 1)) - 1) + self.Cs
+        self.ChiN = sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n ** 2)) # Expected length of a standard normal vector.
+
+        self.Covariance = np.eye(n)
+        self.CovariancePath = np.zeros(n)
+        self.SigmaPath = np.zeros(n)
+        self.Generation = 0
+        self.BestCost = np.inf # Cheapest candidate found so far.
+        self.BestCandidate = self.Mean.copy()
+        self.Generator = np.random.default_rng(Seed)
+
+    def __repr__(self):
+        # Makes the class printable.
+        return "CMAES(Generation: %s, Sigma: %s, Best Cost: %s)" % (self.Generation, round(self.Sigma, 4), self.BestCost)
+
+    def ask(self):
+        # Samples a generation of candidates, shape (Population, n).
+        EigenValues, EigenVectors = np.linalg.eigh(self.Covariance)
+        Scales = np.sqrt(np.maximum(EigenValues, 1e-20))
+        Steps = (self.Generator.standard_normal((self.Population, len(self.Mean))) * Scales) @ EigenVectors.T
+        return self.Mean + self.Sigma * Steps
+
+    def tell(self, Candidates, Costs):
+        # Moves the distribution towards the cheapest of the candidates from ask().
+        Order = np.argsort(Costs)
+        if Costs[Order[0]] < self.BestCost:
+            self.BestCost, self.BestCandidate = float(Costs[Order[0]]), Candidates[Order[0]].copy()
+        Steps = (Candidates[Order[:self.Parents]] - self.Mean) / self.Sigma
+        Step = self.Weights @ Steps
+        self.Mean = self.Mean + self.Sigma * Step
+
+        # Step size path, measured in the whitened coordinates.
+        EigenValues, EigenVectors = np.linalg.eigh(self.Covariance)
+        InverseRoot = EigenVectors @ np.diag(1 / np.sqrt(np.maximum(EigenValues, 1e-20))) @ EigenVectors.T
+        self.SigmaPath = (1 - self.Cs) * self.SigmaPath + sqrt(self.Cs * (2 - self.Cs) * self.MuEff) * InverseRoot @ Step
+        self.Generation += 1
+        PathLength = np.linalg.norm(self.SigmaPath) / sqrt(1 - (1 - self.Cs) ** (2 * self.Generation))
+        Stalled = PathLength / self.ChiN >= 1.4 + 2 / (len(self.Mean) + 1) # Stops the covariance path growing while the step size catches up.
+
+        # Covariance path and matrix.
+        self.CovariancePath = (1 - self.Cc) * self.CovariancePath + (Stalled == False) * sqrt(self.Cc * (2 - self.Cc) * self.MuEff) * Step
+        RankOne = np.outer(self.CovariancePath, self.CovariancePath) + Stalled * self.Cc * (2 - self.Cc) * self.Covariance
+        RankMu = (Steps * self.Weights[:, None]).T @ Steps
+        self.Covariance = (1 - self.C1 - self.CMu) * self.Covariance + self.C1 * RankOne + self.CMu * RankMu
+        self.Covariance = (self.Covariance + self.Covariance.T) / 2 # Keep it exactly symmetric.
+        self.Sigma *= np.exp(self.Cs / self.Damping * (np.linalg.norm(self.SigmaPath) / self.ChiN - 1))
+
+    def state(self):
+        # Everything needed to continue the search, as a JSON serialisable dictionary.
+        return {"Mean" : self.Mean.tolist(), "Sigma" : self.Sigma, "Population" : self.Population, "Covariance" : self.Covariance.tolist(),
+                "CovariancePath" : self.CovariancePath.tolist(), "SigmaPath" : self.SigmaPath.tolist(), "Generation" : self.Generation,
+                "BestCost" : self.BestCost, "BestCandidate" : self.BestCandidate.tolist(), "Generator" : self.Generator.bit_generator.state}
+
+    def load_state(self, State):
+        # Continues the search saved by state().
+        self.Mean, self.Sigma = np.array(State["Mean"]), State["Sigma"]
+        self.Covariance, self.CovariancePath, self.SigmaPath = np.array(State["Covariance"]), np.array(State["CovariancePath"]), np.array(State["SigmaPath"])
+        self.Generation, self.BestCost, self.BestCandidate = State["Generation"], State["BestCost"], np.array(State["BestCandidate"])
+        self.Generator.bit_generator.state = State["Generator"]
+
+def gains(Candidate):
+    # Converts a candidate in log10 space to a run_pid_episode Gains dictionary.
+    return {Name : float(10 ** Value) for Name, Value in zip(TunedGains, Candidate)}
+
+def episode_cost(Gains, MazeName, Seed, MaxTime, BallLossPenalty):
+    # Runs one episode. Called in the worker processes, so the maze is given by name.
+    Result = run_pid_episode(get_maze(MazeName), Seed, MaxTime, Gains = Gains, Camera = True) # Tuned against the simulated camera's noise and latency.
+    if Result["Completed"] == True:
+        Cost = Result["Time"]
+    else:
+        Cost = MaxTime * (2 - Result["Progress"])
+    return Cost + BallLossPenalty * Result["BallLost"]
+
+def evaluate(Candidates, MazeNames, Seeds, MaxTime, BallLossPenalty, Pool = None):
+    # Mean episode cost of each candidate. Every episode is a separate task, so the workers stay busy.
+    Tasks = [(gains(Candidate), MazeName, Seed, MaxTime, BallLossPenalty) for Candidate in Candidates for MazeName in MazeNames for Seed in Seeds]
+    Costs = Pool.starmap(episode_cost, Tasks) if Pool != None else [episode_cost(*Task) for Task in Tasks]
+    return np.mean(np.reshape(Costs, (len(Candidates), -1)), axis = 1)
+
+def save_checkpoint(Filename, Optimiser, Problem, History):
+    # Writes the checkpoint to a temporary file first, so an interruption never leaves a broken checkpoint.
+    with open(Filename + ".tmp", "w") as CheckpointFile:
+        json.dump({"Problem" : Problem, "Optimiser" : Optimiser.state(), "History" : History}, CheckpointFile)
+    os.replace(Filename + ".tmp", Filename)
+
+def auto_tuner(Arguments = None):
+    Parser = argparse.ArgumentParser(description = "Tune the PID gains with CMA-ES on headless simulated episodes.")
+    Parser.add_argument("--mazes", nargs = "+", default = TuningMazes, choices = TuningMazes, help = "mazes to run (default all).")
+    Parser.add_argument("--seeds", type = int, default = 3, help = "seeded episodes per maze and candidate (default 3).")
+    Parser.add_argument("--max-time", type = float, default = 30, help = "simulated seconds before an episode is stopped (default 30).")
+    Parser.add_argument("--ball-loss-penalty", type = float, default = 60, help = "extra cost of losing the ball, in seconds (default 60).")
+    Parser.add_argument("--generations", type = int, default = 20, help = "generations to run in total, including resumed ones (default 20).")
+    Parser.add_argument("--population", type = int, help = "candidates per generation (default 4 + 3 ln 6 = 9).")
+    Parser.add_argument("--sigma", type = float, default = 0.3, help = "initial step size in decades (default 0.3).")
+    Parser.add_argument("--seed", type = int, default = 0, help = "optimiser seed (default 0).")
+    Parser.add_argument("--workers", type = int, default = os.cpu_count(), help = "worker processes (default one per CPU).")
+    Parser.add_argument("--checkpoint", default = "auto_tune_checkpoint.json", help = "checkpoint file, resumed from if it exists.")
+    Parser.add_argument("--restart", action = "store_true", help = "ignore an existing checkpoint and start again.")
+    Parser.add_argument("--output", help = "write the best gains to this JSON file.")
+    Arguments = Parser.parse_args(Arguments if Arguments != None else [])
+
+    # Everything that changes the costs. A checkpoint can only be resumed with the same problem.
+    Problem = {"Mazes" : Arguments.mazes, "Seeds" : Arguments.seeds, "MaxTime" : Arguments.max_time, "BallLossPenalty" : Arguments.ball_loss_penalty,
+               "Population" : Arguments.population, "Sigma" : Arguments.sigma, "Seed" : Arguments.seed}
+    Start = np.log10([DefaultGains[Name] for Name in TunedGains]) # Start from the gains in settings.py.
+    Optimiser = CMAES(Start, Arguments.sigma, Arguments.population, Arguments.seed)
+    History = [] # Best and mean cost of each generation.
+    if os.path.exists(Arguments.checkpoint) and Arguments.restart == False:
+        with open(Arguments.checkpoint) as CheckpointFile:
+            Checkpoint = json.load(CheckpointFile)
+        if Checkpoint["Problem"] != Problem:
+            raise ValueError("The checkpoint '%s' was made with different settings, use --restart to start again." % (Arguments.checkpoint))
+        Optimiser.load_state(Checkpoint["Optimiser"])
+        History = Checkpoint["History"]
+        print("Resuming from generation %s." % (Optimiser.Generation))
+
+    Seeds = range(Arguments.seeds)
+    Pool = multiprocessing.Pool(Arguments.workers) if Arguments.workers > 1 else None
+    try:
+        if Optimiser.Generation == 0 and np.isinf(Optimiser.BestCost):
+            Optimiser.BestCost = float(evaluate(Start[None], Arguments.mazes, Seeds, Arguments.max_time, Arguments.ball_loss_penalty, Pool)[0])
+            print("Settings gains cost: {:.2f}".format(Optimiser.BestCost))
+        print("{:>10} {:>10} {:>10} {:>10}".format("Generation", "Best", "Mean", "Sigma"))
+        while Optimiser.Generation < Arguments.generations:
+            Candidates = Optimiser.ask()
+            Costs = evaluate(Candidates, Arguments.mazes, Seeds, Arguments.max_time, Arguments.ball_loss_penalty, Pool)
+            Optimiser.tell(Candidates, Costs)
+            History.append([float(np.min(Costs)), float(np.mean(Costs))])
+            save_checkpoint(Arguments.checkpoint, Optimiser, Problem, History)
+            print("{:>10} {:>10.2f} {:>10.2f} {:>10.4f}".format(Optimiser.Generation, History[-1][0], History[-1][1], Optimiser.Sigma))
+    finally:
+        if Pool != None:
+            Pool.close()
+
+    BestGains = gains(Optimiser.BestCandidate)
+    print("Best cost: {:.2f}".format(Optimiser.BestCost))
+    for Name, Value in BestGains.items():
+        print("{} = {:.4g}".format(Name, Value))
+    if Arguments.output != None:
+        with open(Arguments.output, "w") as OutputFile:
+            json.dump({"Cost" : Optimiser.BestCost, "Gains" : BestGains, "Problem" : Problem, "History" : History}, OutputFile, indent = 2)
+    return BestGains
+
+if __name__ == "__main__":
+    auto_tuner(sys.argv[1:])
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+'''
+This file contains the event-driven integrator for headless maze simulation. While the ball
+rolls freely under a constant Theta, nothing interesting can happen until it reaches a wall,
+a hole, the edge of the set point radius or the next control tick, so instead of fixed
+substeps it jumps to the next of these events. The wall impact time comes from the swept
+collision test (Ball.wall_impact) along the ball's path under constant acceleration. Hole and
+set point events use conservative advancement: the distance to the nearest hole comes from the
+maze's distance field (see objects.py), and the time to cover it from a bound on the ball's
+speed and acceleration. Steps are also ended where drag would reverse the ball's velocity, so
+the ball stops where it should. As steps are long, each is integrated exactly with the
+acceleration at its start (Ball.exact_motion in objects.py) rather than semi-implicitly like the
+fixed substeps; testing/integrator_check.py checks it against FixedStepIntegrator. Impacts closer than TimeStep, such as a ball resting against a
+wall, are left to the swept collision within the step. If a SensorModel is given (see
+simulation/sensor_model.py), its frame captures and deliveries are events too, and as in
+FixedStepIntegrator the maze doesn't draw its own noisy measurement. The interface
+matches FixedStepIntegrator in simulation/fixed_step.py, so either can drive a headless run.
+'''
+
+# Import modules.
+import numpy as np
+
+# Import settings.
+from settings import SimulationTimeStep, EventMaxStep
+
+class EventDrivenIntegrator():
+
+    def __init__(self, Maze, TimeStep = SimulationTimeStep, MaxStep = EventMaxStep, Sensor = None):
+        # Maze should be of Maze class, see objects.py.
+        if TimeStep <= 0 or MaxStep < TimeStep:
+            raise ValueError("TimeStep should be above 0 and no larger than MaxStep.")
+
+        self.Maze = Maze
+        self.TimeStep = TimeStep # [s] Shortest step, used near events.
+        self.MaxStep = MaxStep # [s] Longest step, limits integration error during free rolling.
+        self.DistanceField = Maze.Geometry.distance_field()
+        self.Target = None # (Position, Radius) of the current set point, if its radius crossing should be an event.
+        self.Sensor = Sensor # Simulated camera, or None.
+
+        self.SimulationTime = 0.0 # [s] Total time simulated.
+        self.Steps = 0 # Total steps run.
+        self.Output = (self.Maze.Ball.Active, self.Maze.Ball.S.copy()) # Output of the last step.
+
+    def __repr__(self):
+        # Makes the class printable.
+        return "EventDrivenIntegrator(MaxStep: %s, SimulationTime: %s, Steps: %s)" % (self.MaxStep, round(self.SimulationTime, 3), self.Steps)
+
+    def set_target(self, Position, Radius):
+        # Sets the set point whose radius crossing ends a step.
+        self.Target = (np.array(Position, dtype = float), float(Radius))
+
+    def event_distance(self):
+        # [mm] Distance the ball can move before it could fall in a hole or cross the set point radius.
+        Ball = self.Maze.Ball
+        Distance = self.DistanceField.hole_distance(Ball.S)[0] - self.DistanceField.Resolution # Margin covers the field's sampling error.
+        if self.Maze.SweptCollision == False:
+            Distance = min(Distance, self.DistanceField.wall_distance(Ball.S) - Ball.R - self.DistanceField.Resolution)
+        if self.Target != None:
+            Distance = min(Distance, abs(np.hypot(*(Ball.S - self.Target[0])) - self.Target[1]))
+        return max(Distance, 0.0)
+
+    def wall_time(self, Acceleration):
+        # [s] Time until the ball's path over MaxStep hits a wall, or MaxStep if it doesn't.
+        Ball = self.Maze.Ball
+        Displacement = Ball.v * self.MaxStep + Acceleration * self.MaxStep ** 2 / 2
+        if Displacement[0] == 0 and Displacement[1] == 0:
+            return self.MaxStep
+        Impact = Ball.wall_impact(Ball.S, Displacement, self.Maze.Geometry.WallBounds)
+        if Impact == None or Impact[0] * self.MaxStep < self.TimeStep:
+            return self.MaxStep # No impact, or close enough to leave to the swept collision.
+        return Impact[0] * self.MaxStep # Approximate, as the path is curved.
+
+    def safe_time(self, Theta):
+        # [s] Longest step that can't pass an event.
+        Ball = self.Maze.Ball
+        Speed = np.hypot(*Ball.v)
+        Acceleration = Ball.next_a(Theta)
+        AccelerationBound = np.hypot(*Acceleration) + 1e-9 # Drag only slows the ball, so this bounds the speed gained.
+
+        # Time to cover the event distance: Speed * t + AccelerationBound * t^2 / 2 = Distance.
+        Distance = self.event_distance()
+        StepTime = (np.sqrt(Speed ** 2 + 2 * AccelerationBound * Distance) - Speed) / AccelerationBound
+        if self.Maze.SweptCollision == True:
+            StepTime = min(StepTime, self.wall_time(Acceleration))
+
+        # End the step where drag brings either velocity component to rest, unless that is within TimeStep anyway.
+        for Axis in range(2):
+            if Ball.v[Axis] * Acceleration[Axis] < 0 and - Ball.v[Axis] / Acceleration[Axis] >= self.TimeStep:
+                StepTime = min(StepTime, - Ball.v[Axis] / Acceleration[Axis])
+
+        if self.Sensor != None:
+            StepTime = min(StepTime, self.Sensor.time_to_frame(self.SimulationTime))
+        return StepTime
+
+    def update(self, ElapsedTime, Theta):
+        # Simulates exactly ElapsedTime seconds (normally one control period) with a constant Theta. Returns the output of Maze.next_step.
+        Remaining = ElapsedTime
+        while Remaining > 1e-12 and self.Maze.Ball.Active == True:
+            StepTime = min(max(self.safe_time(Theta), self.TimeStep), self.MaxStep, Remaining)
+            self.Output = self.Maze.next_step(StepTime, Theta, Exact = True, Measure = self.Sensor == None) # The sensor takes its own measurements.
+            Remaining -= StepTime
+            self.SimulationTime += StepTime
+            self.Steps += 1
+            if self.Sensor != None and self.Maze.Ball.Active == True:
+                self.Sensor.update(self.SimulationTime, self.Maze.Ball.S)
+        if self.Maze.Ball.Active == False:
+            self.SimulationTime += max(Remaining, 0.0) # Nothing left to simulate.
+        return self.Output
+
+    def render_position(self):
+        # [mm] Ball position. Steps always end on the requested time, so there is nothing to interpolate.
+        return self.Maze.Ball.S
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+'''
+This file contains the fixed time-step integrator for the maze simulation. Elapsed wall-clock
+time is added to an accumulator, which is spent in substeps of exactly TimeStep seconds, so a
+slow frame becomes several small steps instead of one large one and the ball can't tunnel
+through walls. At most MaxSubsteps are run per update; any time beyond that is dropped so the
+simulation slows down rather than spiralling. As the simulation only ever sees TimeStep, a run
+gives the same result on any machine. render_position() interpolates between the last two
+substeps for smooth graphics. If a SensorModel is given (see simulation/sensor_model.py), it
+is updated after every substep, and the maze doesn't draw its own noisy measurement, so the
+sensor's noise doesn't depend on the number of substeps.
+'''
+
+# Import modules.
+import numpy as np
+
+# Import settings.
+from settings import SimulationTimeStep, MaxSubsteps
+
+class FixedStepIntegrator():
+
+    def __init__(self, Maze, TimeStep = SimulationTimeStep, MaxSubsteps = MaxSubsteps, Sensor = None):
+        # Maze should be of Maze class, see objects.py.
+        if TimeStep <= 0:
+            raise ValueError("TimeStep should be above 0.")
+        if MaxSubsteps < 1:
+            raise ValueError("MaxSubsteps should be at least 1.")
+
+        self.Maze = Maze
+        self.TimeStep = TimeStep # [s] Length of every substep.
+        self.MaxSubsteps = MaxSubsteps # Maximum substeps per update.
+        self.Sensor = Sensor # Simulated camera, or None.
+
+        self.Accumulator = 0.0 # [s] Elapsed time not yet simulated.
+        self.SimulationTime = 0.0 # [s] Total time simulated.
+        self.Steps = 0 # Total substeps run.
+        self.DroppedTime = 0.0 # [s] Time discarded because an update needed more than MaxSubsteps.
+        self.PreviousS = self.Maze.Ball.S.copy() # Ball position before the last substep, for interpolation.
+        self.Output = (self.Maze.Ball.Active, self.Maze.Ball.S.copy()) # Output of the last substep.
+
+    def __repr__(self):
+        # Makes the class printable.
+        return "FixedStepIntegrator(TimeStep: %s, SimulationTime: %s, Steps: %s)" % (self.TimeStep, round(self.SimulationTime, 3), self.Steps)
+
+    def update(self, ElapsedTime, Theta):
+        # Simulates ElapsedTime seconds in fixed substeps with a constant Theta. Returns the output of Maze.next_step.
+        self.Accumulator += ElapsedTime
+        Steps = int((self.Accumulator + 1e-9) // self.TimeStep) # Small tolerance so rounding error doesn't lose a step.
+        if Steps > self.MaxSubsteps:
+            self.DroppedTime += self.Accumulator - self.MaxSubsteps * self.TimeStep
+            self.Accumulator = self.MaxSubsteps * self.TimeStep
+            Steps = self.MaxSubsteps
+        self.Accumulator = max(self.Accumulator - Steps * self.TimeStep, 0.0)
+        return self.step(Steps, Theta)
+
+    def step(self, Steps, Theta):
+        # Simulates exactly Steps substeps, ignoring the accumulator. Used for headless runs.
+        for _ in range(Steps):
+            self.PreviousS = self.Maze.Ball.S.copy()
+            self.Output = self.Maze.next_step(self.TimeStep, Theta, Measure = self.Sensor == None) # The sensor takes its own measurements.
+            self.SimulationTime += self.TimeStep
+            self.Steps += 1
+            if self.Sensor != None and self.Maze.Ball.Active == True:
+                self.Sensor.update(self.SimulationTime, self.Maze.Ball.S)
+        return self.Output
+
+    def render_position(self):
+        # [mm] Ball position interpolated between the last two substeps by the time left in the accumulator.
+        Alpha = self.Accumulator / self.TimeStep
+        return self.PreviousS + (self.Maze.Ball.S - self.PreviousS) * Alpha
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+'''
+This file contains run_pid_episode(), which runs the PID control simulation of pid_sim.py
+without graphics or a wall clock. The controller runs at exactly ControlFrequency on
+simulated time, the simulated camera and noise are seeded, and the physics uses either the
+fixed-step or the event-driven integrator, so an episode with the same seed always gives the
+same result as fast as the machine allows. The simulated board is level, so calibration is
+skipped. Used by the benchmarks and tuning tools in testing/ and simulation/.
+'''
+
+# Import modules.
+import numpy as np
+from time import perf_counter
+
+# Import classes and settings.
+from control.pid_controller import PID_Controller
+from control.mpc_controller import MPC_Controller
+from control.setpoint_handler import SetPointHandler
+from control.checkpoint_route import CheckpointRoute
+from control.trace_recorder import EventCalibrated, EventNewSetPoint
+from control.kalman_filter import KalmanFilter
+from control.position_predictor import PositionPredictor
+from simulation.fixed_step import FixedStepIntegrator
+from simulation.event_driven import EventDrivenIntegrator
+from simulation.sensor_model import SensorModel
+from simulation.noise import NoiseModel
+from settings import Kp, Ki, Kd, PMax, Ks, Kst, Kr, HoleDangerDistance, BufferSize, SaturationLimit, MinTheta, CheckpointRadius, SetPointTime, \
+    SetPointLookAhead, ControlFrequency, ControlToTheta, SimulatedCamera, KalmanFilterOn, \
+    LatencyCompensationOn, MPCControllerOn
+
+# Default controller gains, any of which can be replaced with the Gains argument.
+DefaultGains = {"Kp" : Kp, "Ki" : Ki, "Kd" : Kd, "PMax" : PMax, "Ks" : Ks, "Kst" : Kst, "Kr" : Kr, "HoleDangerDistance" : HoleDangerDistance}
+
+def run_pid_episode(Maze, Seed = None, MaxTime = 60, EventDriven = False, Gains = None, Recorder = None, Camera = SimulatedCamera, Kalman = KalmanFilterOn,
+                    Compensation = LatencyCompensationOn, MPC = MPCControllerOn):
+    '''
+    Runs one PID controlled episode on a new run of Maze until the route is completed, the ball
+    is lost or MaxTime seconds have been simulated. Gains is a dictionary replacing some of
+    DefaultGains. MPC True uses the model-predictive controller (see control/mpc_controller.py)
+    instead of the PID controller, and Gains is ignored. Recorder is an optional TraceRecorder
+    (see control/trace_recorder.py). Camera False gives the controller the exact ball position.
+    Kalman True gives the controller the Kalman filtered position and velocity instead.
+    Compensation True projects the measured position forward over the camera latency (see
+    control/position_predictor.py); the motors are simulated as instant, so the prediction ends
+    at the control tick. Returns a dictionary of results, including the mean distance between
+    the position the controller used and the true ball position, and the mean and longest time
+    taken by a controller update.
+    '''
+    Settings = dict(DefaultGains)
+    if Gains != None:
+        Settings.update(Gains)
+
+    ActiveMaze = Maze.new_run(NoiseModel(Seed))
+    Route = CheckpointRoute(ActiveMaze.Checkpoints, CheckpointRadius, SetPointTime)
+    if MPC == True:
+        Controller = MPC_Controller(Route, SaturationLimit, ActiveMaze.Geometry.distance_field())
+    else:
+        DistanceField = ActiveMaze.Geometry.distance_field() if Settings["Kr"] != 0 else None # Only hole repulsion uses it.
+        Controller = PID_Controller(Settings["Kp"], Settings["Ki"], Settings["Kd"], Settings["PMax"], Settings["Ks"], Settings["Kst"], Route, BufferSize,
+                                    SaturationLimit, MinTheta, DistanceField, Settings["Kr"], Settings["HoleDangerDistance"])
+    Estimator = KalmanFilter() if Kalman == True or Compensation == True else None
+    Predictor = PositionPredictor(ActiveMaze.Geometry.distance_field()) if Compensation == True else None
+    Sensor = SensorModel(ActiveMaze.Noise, Estimator = Estimator) if Camera == True else None
+    if EventDriven == True:
+        Integrator = EventDrivenIntegrator(ActiveMaze, Sensor = Sensor)
+    else:
+        Integrator = FixedStepIntegrator(ActiveMaze, Sensor = Sensor)
+    SetPointHandler_ = SetPointHandler(ActiveMaze.Ball.S, 0.0, Route, SetPointLookAhead)
+
+    # The simulated board is level, so calibrate straight away.
+    Controller.calibrate(np.array([0.0, 0.0]))
+    if Recorder != None:
+        if MPC == False:
+            Recorder.set_controller(Controller) # Only PID traces can be replayed.
+        Recorder.mark(EventCalibrated)
+
+    ControlPeriod = 1 / ControlFrequency
+    Theta = np.array([0.0, 0.0])
+    Completed, SetPointIndex, Ticks, PositionError, UpdateTime, MaxUpdateTime = 0, 0, 0, 0.0, 0.0, 0.0
+    while Integrator.SimulationTime < MaxTime:
+        if EventDriven == True:
+            Integrator.set_target(Route.Positions[SetPointIndex], Route.Radii[SetPointIndex])
+        Integrator.update(ControlPeriod, Theta)
+        if ActiveMaze.Ball.Active == False:
+            break
+
+        # Measured ball position, None until the first camera frame arrives.
+        ProcessVariable, Velocity = Sensor.Position if Sensor != None else ActiveMaze.Ball.S, None
+        if Estimator != None:
+            if Sensor == None:
+                Estimator.update(Integrator.SimulationTime, ActiveMaze.Ball.S)
+            ProcessVariable, Velocity = Estimator.Position, Estimator.Velocity
+            if Predictor != None and ProcessVariable is not None:
+                ProcessVariable, Velocity = Predictor.predict(ProcessVariable, Velocity, Estimator.Time, Integrator.SimulationTime, Theta)
+            if Kalman == False:
+                Velocity = None # Only used for prediction.
+        if ProcessVariable is None:
+            continue
+
+        Completed, NewSetPoint, SetPointIndex = SetPointHandler_.update(ProcessVariable, Integrator.SimulationTime)
+        if Completed == 1:
+            break
+        if NewSetPoint == True:
+            Controller.new_setpoint(SetPointIndex)
+            if Recorder != None:
+                Recorder.mark(EventNewSetPoint)
+
+        StartTime = perf_counter()
+        Outputs = Controller.update(ProcessVariable, ControlPeriod, Velocity)
+        UpdateTime += perf_counter() - StartTime
+        MaxUpdateTime = max(MaxUpdateTime, perf_counter() - StartTime)
+        if Recorder != None:
+            Recorder.record(Integrator.SimulationTime, ControlPeriod, ProcessVariable, Controller, *Outputs, Velocity = Velocity)
+        Theta = Outputs[0] * ControlToTheta
+        PositionError += np.linalg.norm(ProcessVariable - ActiveMaze.Ball.S)
+        Ticks += 1
+
+    return {
+        "Completed" : Completed == 1,
+        "BallLost" : ActiveMaze.Ball.Active == False,
+        "Time" : float(Integrator.SimulationTime), # [s]
+        "SetPointIndex" : int(SetPointIndex),
+        "Progress" : float(Route.ArcLength[SetPointIndex] / max(Route.ArcLength[-1], 1e-9)), # Fraction of the route length reached.
+        "Ticks" : Ticks, # Control updates.
+        "PositionError" : PositionError / max(Ticks, 1), # [mm] Mean distance between the position used for control and the ball.
+        "UpdateTime" : UpdateTime / max(Ticks, 1), # [s] Mean time taken by a controller update.
+        "MaxUpdateTime" : MaxUpdateTime, # [s]
+        "Steps" : Integrator.Steps, # Physics steps.
+        "Seed" : ActiveMaze.Noise.Seed
+    }
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
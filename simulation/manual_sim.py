@@ -10,13 +10,13 @@ import pygame
 import numpy as np
 import time
 from math import degrees
-from copy import deepcopy
 
 # Import classes, functions and values.
 from mazes import Maze1, Maze2, Maze3
 from objects import Maze
 from graphics.graphics import initialise_background, initialise_dirty_group, initialise_buttons, initialise_header, initialise_values, initialise_ball, change_maze
 from simulation.tilt_maze import tilt_maze
+from simulation.fixed_step import FixedStepIntegrator
 from control.timing_controller import TimingController
 from settings import MaxFrequency, DisplayScale, White, Black
 
@@ -110,7 +110,7 @@ def manual_sim():
         if SystemRunning == 1:
 
             # Set ActiveMaze as a copy of CurrentMaze.
-            ActiveMaze = deepcopy(CurrentMaze)
+            ActiveMaze = CurrentMaze.new_run()
 
             # Check ActiveMaze is correct type.
             if type(ActiveMaze) != Maze:
@@ -132,6 +132,7 @@ def manual_sim():
             # Start clock.
             StartTime = time.perf_counter() # Record start time.
             LastTime = StartTime
+            Integrator = FixedStepIntegrator(ActiveMaze) # Fixed time-step physics, see simulation/fixed_step.py.
             TimingController_ = TimingController(StartTime) # Start timing controller.
             while SystemRunning == 1:
 
@@ -157,7 +158,7 @@ def manual_sim():
                                 elif Button.CurrentState == "Reset":
                                     Button.click(time.perf_counter()) # Animate button click.
                                     Buttons.get_sprite(0).click(time.perf_counter()) # Change stop button to start.
-                                    ActiveMaze = deepcopy(CurrentMaze) # Reset maze.
+                                    ActiveMaze = CurrentMaze.new_run() # Reset maze.
                                     change_maze(ActiveSprites, CurrentMaze) # Reset certain Sprites.
                                     ActiveSprites.remove_sprites_of_layer(4) # Erase display values.
                                     SpriteBall_.kill() # Erase ball.
@@ -176,8 +177,8 @@ def manual_sim():
                 TimeStep = CurrentTime - LastTime
                 LastTime = CurrentTime
 
-                # Simulate next step of maze using theta and a given timestep.
-                Output = ActiveMaze.next_step(TimeStep, Theta) # Time step given in s.
+                # Simulate the time-step in fixed substeps using theta.
+                Output = Integrator.update(TimeStep, Theta) # Time step given in s.
 
                 if Output[0] == False:
                     BallLost = 1 # If ball is lost.
@@ -202,7 +203,7 @@ def manual_sim():
                 if GraphicsOn == True:
                     # Update Sprite Ball position.
                     if ActiveMaze.Ball.Active == True:
-                        SpriteBall_.update(ActiveMaze.Ball.S)
+                        SpriteBall_.update(Integrator.render_position())
 
                     # Check/update SpriteSetPoint.
                     while len(ActiveMaze.Checkpoints) < len(ActiveSprites.get_sprites_from_layer(2)):
@@ -258,7 +259,7 @@ def manual_sim():
                                         Paused = 0
                                     elif Button.CurrentState == "Reset":
                                         Button.click(time.perf_counter()) # Animate button click.
-                                        ActiveMaze = deepcopy(CurrentMaze) # Reset maze.
+                                        ActiveMaze = CurrentMaze.new_run() # Reset maze.
                                         change_maze(ActiveSprites, CurrentMaze) # Reset certain Sprites.
                                         ActiveSprites.remove_sprites_of_layer(4) # Erase display values.
                                         SpriteBall_.kill() # Erase ball.
@@ -278,8 +279,8 @@ def manual_sim():
                     TimeStep = CurrentTime - LastTime
                     LastTime = CurrentTime
 
-                    # Simulate next step of maze using theta and a given timestep.
-                    Output = ActiveMaze.next_step(TimeStep, Theta) # Time step given in s.
+                    # Simulate the time-step in fixed substeps using theta.
+                    Output = Integrator.update(TimeStep, Theta) # Time step given in s.
 
                     if Output[0] == False:
                         BallLost = 1 # If ball is lost.
@@ -298,7 +299,7 @@ def manual_sim():
                     if GraphicsOn == True:
                         # Update Sprite Ball position.
                         if ActiveMaze.Ball.Active == True:
-                            SpriteBall_.update(ActiveMaze.Ball.S)
+                            SpriteBall_.update(Integrator.render_position())
                         else:
                             SpriteBall_.kill()
 
@@ -351,7 +352,7 @@ def manual_sim():
                                     if Button.CurrentState == "Reset":
                                         Button.click(time.perf_counter()) # Animate button click.
                                         Buttons.get_sprite(0).click(time.perf_counter()) # Change stop button to start.
-                                        ActiveMaze = deepcopy(CurrentMaze) # Reset maze.
+                                        ActiveMaze = CurrentMaze.new_run() # Reset maze.
                                         change_maze(ActiveSprites, CurrentMaze) # Reset certain Sprites.
                                         ActiveSprites.remove_sprites_of_layer(4) # Erase display values.
                                         SpriteBall_.kill() # Erase ball.
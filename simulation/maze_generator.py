@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+'''
+This file contains the procedural maze generator, for stress-testing the physics, the distance
+field and the route planner on mazes of any size. The maze area is divided into a grid of
+cells and a random spanning tree (depth-first, from a seeded generator) decides which cell
+sides are open, so every cell can be reached and the route from the top left cell to the
+bottom right cell is unique. The closed sides are merged into straight walls, which are then
+either removed at random (which only opens more passages) or split into shorter pieces until
+there are WallCount walls. Holes are put in the centres of cells off the route, so the route
+is always solvable, and the checkpoints are the cells where the route turns.
+
+generate_maze() returns a new Maze. generated_maze() also caches the maze definition in
+'maze_data/generated/' (see save_maze() in mazes.py), so the same settings always give the
+same maze without generating it again.
+'''
+
+# Import modules.
+import heapq
+import os
+import numpy as np
+from collections import deque
+
+# Import classes, functions and settings.
+from objects import Maze, Ball, Wall, Hole, Checkpoint
+from mazes import MazeDataFolder, load_maze, save_maze
+from settings import MazeSize, FrameVertical, FrameHorizontal, BallRadius, HoleRadius, GeneratedCellSize, GeneratedWallThickness, GeneratedHoleDensity
+
+# Folder containing cached generated maze definitions.
+GeneratedMazeFolder = os.path.join(MazeDataFolder, "generated")
+
+# Generated mazes that have already been built, by definition file.
+GeneratedMazes = {}
+
+def spanning_tree(Rows, Columns, Generator):
+    # Random depth-first spanning tree of the cell grid. Returns (OpenRight, OpenDown), which cell sides are open.
+    OpenRight = np.zeros((Rows, Columns - 1), dtype = bool) # Side between (r, c) and (r, c + 1).
+    OpenDown = np.zeros((Rows - 1, Columns), dtype = bool) # Side between (r, c) and (r + 1, c).
+    Visited = np.zeros((Rows, Columns), dtype = bool)
+    Visited[0, 0] = True
+    Stack = [(0, 0)]
+    while len(Stack) > 0:
+        Row, Column = Stack[-1]
+        Neighbours = [(Row + Dr, Column + Dc) for Dr, Dc in ((0, 1), (1, 0), (0, -1), (-1, 0))
+                      if 0 <= Row + Dr < Rows and 0 <= Column + Dc < Columns and Visited[Row + Dr, Column + Dc] == False]
+        if len(Neighbours) == 0:
+            Stack.pop()
+            continue
+        Next = Neighbours[Generator.integers(len(Neighbours))]
+        if Next[0] == Row:
+            OpenRight[Row, min(Column, Next[1])] = True
+        else:
+            OpenDown[min(Row, Next[0]), Column] = True
+        Visited[Next] = True
+        Stack.append(Next)
+    return OpenRight, OpenDown
+
+def solution_path(OpenRight, OpenDown, Start, Goal):
+    # Breadth-first search through the open sides. Returns the list of cells from Start to Goal.
+    Rows, Columns = OpenDown.shape[0] + 1, OpenRight.shape[1] + 1
+    Previous = {Start : None}
+    Queue = deque([Start])
+    while len(Queue) > 0:
+        Row, Column = Queue.popleft()
+        if (Row, Column) == Goal:
+            break
+        Neighbours = []
+        if Column < Columns - 1 and OpenRight[Row, Column]:
+            Neighbours.append((Row, Column + 1))
+        if Column > 0 and OpenRight[Row, Column - 1]:
+            Neighbours.append((Row, Column - 1))
+        if Row < Rows - 1 and OpenDown[Row, Column]:
+            Neighbours.append((Row + 1, Column))
+        if Row > 0 and OpenDown[Row - 1, Column]:
+            Neighbours.append((Row - 1, Column))
+        for Neighbour in Neighbours:
+            if Neighbour not in Previous:
+                Previous[Neighbour] = (Row, Column)
+                Queue.append(Neighbour)
+
+    Path = [Goal]
+    while Previous[Path[-1]] != None:
+        Path.append(Previous[Path[-1]])
+    return Path[::-1]
+
+def cell_centre(Cell, Origin, CellDimensions):
+    # [mm] Centre of a grid cell (row, column).
+    return Origin + (np.array([Cell[1], Cell[0]]) + 0.5) * CellDimensions
+
+def wall_runs(OpenRight, OpenDown, Origin, CellDimensions, Thickness):
+    # Merges the closed inside cell sides into straight walls. Returns a list of [x, y, Sx, Sy] in mm.
+    Runs = []
+    for Closed, Vertical in ((OpenRight == False, True), (OpenDown == False, False)):
+        Lines = Closed.T if Vertical == True else Closed # One row per grid line.
+        for Line, Sides in enumerate(Lines):
+            Edges = np.diff(np.concatenate(([0], Sides.astype(int), [0])))
+            for First, Last in zip(np.flatnonzero(Edges == 1), np.flatnonzero(Edges == -1)): # Closed sides First to Last - 1.
+                if Vertical == True:
+                    X, Y = Origin[0] + (Line + 1) * CellDimensions[0], Origin[1] + First * CellDimensions[1]
+                    Runs.append([X - Thickness / 2, Y - Thickness / 2, Thickness, (Last - First) * CellDimensions[1] + Thickness])
+                else:
+                    X, Y = Origin[0] + First * CellDimensions[0], Origin[1] + (Line + 1) * CellDimensions[1]
+                    Runs.append([X - Thickness / 2, Y - Thickness / 2, (Last - First) * CellDimensions[0] + Thickness, Thickness])
+    return Runs
+
+def split_walls(Runs, WallCount):
+    # Splits the longest walls in half along their length until there are WallCount walls.
+    Heap = [(- max(Run[2], Run[3]), Index, Run) for Index, Run in enumerate(Runs)]
+    heapq.heapify(Heap)
+    Counter = len(Heap) # Tie-breaker, so equal lengths split in a fixed order.
+    while len(Heap) < WallCount:
+        _, _, (X, Y, Sx, Sy) = heapq.heappop(Heap)
+        if Sx >= Sy:
+            Pieces = ([X, Y, Sx / 2, Sy], [X + Sx / 2, Y, Sx / 2, Sy])
+        else:
+            Pieces = ([X, Y, Sx, Sy / 2], [X, Y + Sy / 2, Sx, Sy / 2])
+        for Piece in Pieces:
+            heapq.heappush(Heap, (- max(Piece[2], Piece[3]), Counter, Piece))
+            Counter += 1
+    return [Run for _, _, Run in sorted(Heap, key = lambda Item : Item[1])]
+
+def generate_maze(Seed = None, WallCount = None, HoleDensity = GeneratedHoleDensity, CellSize = GeneratedCellSize, WallThickness = GeneratedWallThickness):
+    '''
+    Generates a new Maze. WallCount is the number of walls inside the frame (None to keep the
+    merged walls of the spanning tree as they are), HoleDensity the fraction of cells off the
+    route given a hole, and CellSize the approximate grid cell size in mm; cells are stretched
+    to fill the maze exactly. The same Seed and settings always give the same maze.
+    '''
+    MinCellSize = max(2 * BallRadius + 2 + WallThickness, 2 * (HoleRadius + 1))
+    Columns, Rows = max(int(MazeSize[0] // CellSize), 2), max(int(MazeSize[1] // CellSize), 2)
+    CellDimensions = MazeSize / np.array([Columns, Rows]) # [mm] Cell width and height.
+    if min(CellDimensions) < MinCellSize:
+        raise ValueError("Cells of %s mm are too small for the ball and holes, use at least %s mm." % (np.round(CellDimensions, 1), round(MinCellSize, 1)))
+    if not 0 <= HoleDensity <= 1:
+        raise ValueError("HoleDensity should be between 0 and 1.")
+
+    Generator = np.random.default_rng(Seed)
+    Origin = np.array([FrameVertical, FrameHorizontal]) # [mm] Inside corner of the frame.
+    OpenRight, OpenDown = spanning_tree(Rows, Columns, Generator)
+    Path = solution_path(OpenRight, OpenDown, (0, 0), (Rows - 1, Columns - 1))
+
+    # Remove walls at random or split them to get WallCount walls.
+    Runs = wall_runs(OpenRight, OpenDown, Origin, CellDimensions, WallThickness)
+    if WallCount != None and WallCount < len(Runs):
+        Runs = [Runs[Index] for Index in np.sort(Generator.choice(len(Runs), WallCount, replace = False))]
+    elif WallCount != None:
+        Runs = split_walls(Runs, WallCount)
+
+    # Holes in the centres of a random selection of cells off the route.
+    OnPath = set(Path)
+    OffPath = [(Row, Column) for Row in range(Rows) for Column in range(Columns) if (Row, Column) not in OnPath]
+    HoleCells = Generator.choice(len(OffPath), int(round(HoleDensity * len(OffPath))), replace = False) if len(OffPath) > 0 else []
+    Holes = [Hole(cell_centre(OffPath[Index], Origin, CellDimensions)) for Index in np.sort(HoleCells)]
+
+    # Checkpoints where the route turns, and at the goal.
+    Checkpoints = []
+    for Index in range(1, len(Path)):
+        if Index == len(Path) - 1 or np.any(np.subtract(Path[Index + 1], Path[Index]) != np.subtract(Path[Index], Path[Index - 1])):
+            Checkpoints.append(Checkpoint(cell_centre(Path[Index], Origin, CellDimensions)))
+
+    Walls = [Wall(np.array(Run[0:2], dtype = float), np.array(Run[2:4], dtype = float)) for Run in Runs]
+    return Maze(Ball(cell_centre(Path[0], Origin, CellDimensions)), Walls, Holes, Checkpoints)
+
+def generated_maze(Seed = 0, WallCount = None, HoleDensity = GeneratedHoleDensity, CellSize = GeneratedCellSize, WallThickness = GeneratedWallThickness):
+    # Returns a generated maze, loaded from its cached definition file if it has been generated before.
+    Name = "generated_%s_%s_%s_%s_%s" % (Seed, WallCount, HoleDensity, CellSize, WallThickness)
+    Filename = os.path.join(GeneratedMazeFolder, Name + ".json")
+    if Filename not in GeneratedMazes:
+        if not os.path.exists(Filename):
+            os.makedirs(GeneratedMazeFolder, exist_ok = True)
+            save_maze(generate_maze(Seed, WallCount, HoleDensity, CellSize, WallThickness), Filename, Name)
+        GeneratedMazes[Filename] = load_maze(Filename) # Always loaded from the file, so cached and new mazes are identical.
+    return GeneratedMazes[Filename]
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+'''
+This file contains the noise model for simulated image detection. All noise is drawn from a
+seeded numpy Generator owned by the model, so a run can be replayed exactly from its Seed.
+Measurements can have uniform and Gaussian position noise, be quantised to a grid (the camera's
+pixel size) and be dropped with a given probability. Latencies for the sensor model are drawn
+uniformly between two limits. Single draws are served from pre-generated blocks of BlockSize
+values so the Generator is called rarely, and sample_batch draws noise for many balls at once.
+'''
+
+# Import modules.
+import numpy as np
+
+# Import settings.
+from settings import ImageNoise, ImageNoiseDeviation, ImageQuantisation, ImageDropout, CameraLatency, NoiseSeed, NoiseBlockSize
+
+class NoiseModel():
+
+    def __init__(self, Seed = NoiseSeed, Uniform = ImageNoise, Deviation = ImageNoiseDeviation, Quantisation = ImageQuantisation,
+                 Dropout = ImageDropout, Latency = CameraLatency, BlockSize = NoiseBlockSize):
+        # Seed None picks a fresh seed, which is saved in self.Seed so the run can be repeated.
+        if Dropout < 0 or Dropout > 1:
+            raise ValueError("Dropout should be a probability between 0 and 1.")
+        if BlockSize < 1:
+            raise ValueError("BlockSize should be at least 1.")
+
+        self.Seed = np.random.SeedSequence(Seed).entropy # Seed actually used.
+        self.Generator = np.random.default_rng(self.Seed)
+        self.Uniform = Uniform # [mm] Noise is uniform within +-Uniform.
+        self.Deviation = Deviation # [mm] Standard deviation of Gaussian noise.
+        self.Quantisation = Quantisation # [mm] Grid measured positions are rounded to. 0 for none.
+        self.Dropout = Dropout # Probability of a measurement being lost.
+        self.Latency = np.array(Latency, dtype = float) # [s] (Minimum, maximum) detection latency.
+        self.BlockSize = BlockSize # Number of draws generated at a time.
+        self.Index = BlockSize # Position in the current block, starts exhausted.
+
+    def __repr__(self):
+        # Makes the class printable.
+        return "NoiseModel(Seed: %s, Uniform: %s, Deviation: %s, Quantisation: %s, Dropout: %s, Latency: %s)" % (self.Seed, self.Uniform, self.Deviation, self.Quantisation, self.Dropout, self.Latency)
+
+    def draw(self, Count):
+        # Draws position noise, dropout decisions and latencies for Count measurements.
+        Noise = self.Generator.uniform(- self.Uniform, self.Uniform, (Count, 2)) if self.Uniform > 0 else np.zeros((Count, 2))
+        if self.Deviation > 0:
+            Noise += self.Generator.normal(0, self.Deviation, (Count, 2))
+        Dropped = self.Generator.random(Count) < self.Dropout if self.Dropout > 0 else np.zeros(Count, dtype = bool)
+        Latencies = self.Generator.uniform(self.Latency[0], self.Latency[1], Count)
+        return Noise, Dropped, Latencies
+
+    def next_block(self):
+        # Pre-generates the next BlockSize draws.
+        self.NoiseBlock, self.DroppedBlock, self.LatencyBlock = self.draw(self.BlockSize)
+        self.Index = 0
+
+    def quantise(self, Positions):
+        # Rounds positions to the quantisation grid.
+        if self.Quantisation > 0:
+            return np.round(Positions / self.Quantisation) * self.Quantisation
+        return Positions
+
+    def sample(self, Position):
+        # Returns a noisy measurement of Position, or None if it was dropped, and the latency of the measurement in s.
+        if self.Index >= self.BlockSize:
+            self.next_block()
+        Noise, Dropped, Latency = self.NoiseBlock[self.Index], self.DroppedBlock[self.Index], self.LatencyBlock[self.Index]
+        self.Index += 1
+        if Dropped == True:
+            return None, Latency
+        return self.quantise(Position + Noise), Latency
+
+    def sample_batch(self, Positions):
+        # Noisy measurements of an (n, 2) array of positions at once. Dropped measurements are NaN.
+        Noise, Dropped, Latencies = self.draw(len(Positions))
+        Measured = self.quantise(Positions + Noise)
+        Measured[Dropped] = np.nan
+        return Measured, Latencies
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -9,19 +9,26 @@ import pygame
 import numpy as np
 import time
 from math import degrees
-from copy import deepcopy
 
 # Import classes, functions and values.
 from mazes import Maze1, Maze2, Maze3
 from objects import Maze
 from graphics.graphics import initialise_background, initialise_dirty_group, initialise_buttons, initialise_header, initialise_values, initialise_ball, change_maze
 from control.pid_controller import PID_Controller
+from control.mpc_controller import MPC_Controller
 from control.calibrator import Calibrator
 from control.setpoint_handler import SetPointHandler
+from control.checkpoint_route import CheckpointRoute
+from simulation.fixed_step import FixedStepIntegrator
+from simulation.sensor_model import SensorModel
+from simulation.noise import NoiseModel
+from control.kalman_filter import KalmanFilter
+from control.position_predictor import PositionPredictor
 from control.timing_controller import TimingController
 from control.performance_log import PerformanceLog
+from control.trace_recorder import TraceRecorder, EventCalibrated, EventNewSetPoint, EventReset
 from motor_control.motor_control import motor_reset, motor_angle
-from settings import MaxFrequency, DisplayScale, White, Black, Kp, Ki, Kd, PMax, Ks, Kst, BufferSize, SaturationLimit, MinTheta, CheckpointRadius, SetPointTime
+from settings import MaxFrequency, DisplayScale, White, Black, Kp, Ki, Kd, PMax, Ks, Kst, Kr, HoleDangerDistance, BufferSize, SaturationLimit, MinTheta, CheckpointRadius, SetPointTime, SetPointLookAhead, TraceFile, SimulatedCamera, ControlToTheta, KalmanFilterOn, LatencyCompensationOn, MPCControllerOn
 
 def pid_sim():
 
@@ -108,7 +115,7 @@ def pid_sim():
         if SystemRunning == 1:
 
             # Set ActiveMaze as a copy of CurrentMaze.
-            ActiveMaze = deepcopy(CurrentMaze)
+            ActiveMaze = CurrentMaze.new_run(NoiseModel()) # With simulated image detection noise, see simulation/noise.py.
 
             # Check ActiveMaze is correct type.
             if type(ActiveMaze) != Maze:
@@ -124,9 +131,22 @@ def pid_sim():
             ActiveSprites.add(SpriteBall_, layer = 7)
             ''' PYGAME GRAPHICS END '''
 
+            ''' INITIALISE CHECKPOINT ROUTE '''
+            # Compile the checkpoints into arrays, see control/checkpoint_route.py for more information.
+            Route = CheckpointRoute(ActiveMaze.Checkpoints, CheckpointRadius, SetPointTime)
+            SetPointIndex = 0 # Index of the current set point in Route, shared by the controller and graphics.
+            ''' INITIALISE CHECKPOINT ROUTE '''
+
             ''' INITIALISE PID CONTROL '''
             # Initialise PID controller object, see control/pid_controller.py for more information.
-            PID_Controller_ = PID_Controller(Kp, Ki, Kd, PMax, Ks, Kst, ActiveMaze.Checkpoints[0], BufferSize, SaturationLimit, MinTheta)
+            if MPCControllerOn == True: # The model-predictive controller has the same interface, see control/mpc_controller.py.
+                PID_Controller_ = MPC_Controller(Route, SaturationLimit, ActiveMaze.Geometry.distance_field())
+            else:
+                DistanceField = ActiveMaze.Geometry.distance_field() if Kr != 0 else None # Only hole repulsion uses it, so it isn't built when that is off.
+                PID_Controller_ = PID_Controller(Kp, Ki, Kd, PMax, Ks, Kst, Route, BufferSize, SaturationLimit, MinTheta, DistanceField, Kr, HoleDangerDistance)
+            TraceRecorder_ = TraceRecorder() # Per-tick record of the run, see control/trace_recorder.py.
+            if MPCControllerOn == False:
+                TraceRecorder_.set_controller(PID_Controller_) # Only PID traces can be replayed.
             ''' INITIALISE PID CONTROL '''
 
             ''' INITIALISE CALIBRATOR '''
@@ -136,7 +156,7 @@ def pid_sim():
             ''' INITIALISE CALIBRATOR '''
 
             ''' INITIALISE SET POINT HANDLER '''
-            SetPointHandler_ = SetPointHandler(ActiveMaze.Ball.S, time.perf_counter(), ActiveMaze.Checkpoints, CheckpointRadius, SetPointTime)
+            SetPointHandler_ = SetPointHandler(ActiveMaze.Ball.S, 0.0, Route, SetPointLookAhead)
             ''' INITIALISE SET POINT HANDLER '''
 
             ''' INITIALISE MOTOR CONTROL '''
@@ -150,11 +170,15 @@ def pid_sim():
             ControlSignal, ProportionalTerm, IntegralTerm, DerivativeTerm, StaticBoost = \
             np.array([0.0, 0.0]), np.array([0.0, 0.0]), np.array([0.0, 0.0]), np.array([0.0, 0.0]), np.array([0.0, 0.0]) # Set starting values.
 
-            # Start clock.
+            # Start clock. Control runs on simulated time so that a run doesn't depend on machine speed.
             TimeElapsed = 0
             StartTime = time.perf_counter() # Record start time.
-            SimulationTime = StartTime # Initialise SimulationTime
-            TimingController_ = TimingController(StartTime) # Start timing controller.
+            LoopTime = StartTime # Initialise LoopTime
+            StateEstimator_ = KalmanFilter() if KalmanFilterOn == True or LatencyCompensationOn == True else None # See control/kalman_filter.py.
+            Predictor_ = PositionPredictor(ActiveMaze.Geometry.distance_field()) if LatencyCompensationOn == True else None # See control/position_predictor.py.
+            Sensor = SensorModel(ActiveMaze.Noise, Estimator = StateEstimator_) # Simulated camera latency, frame rate and dropped frames, see simulation/sensor_model.py.
+            Integrator = FixedStepIntegrator(ActiveMaze, Sensor = Sensor) # Fixed time-step physics, see simulation/fixed_step.py.
+            TimingController_ = TimingController(Integrator.SimulationTime) # Start timing controller.
             PerformanceLog_ = PerformanceLog(StartTime) # Performance log. See control/performance_log.py for more information.
             while SystemRunning == 1:
 
@@ -185,7 +209,7 @@ def pid_sim():
                                 elif Button.CurrentState == "Reset":
                                     Button.click(time.perf_counter()) # Animate button click.
                                     Buttons.get_sprite(0).click(time.perf_counter()) # Change stop button to start.
-                                    ActiveMaze = deepcopy(CurrentMaze) # Reset maze.
+                                    ActiveMaze = CurrentMaze.new_run() # Reset maze.
                                     change_maze(ActiveSprites, CurrentMaze) # Reset certain Sprites.
                                     ActiveSprites.remove_sprites_of_layer(4) # Erase display values.
                                     SpriteBall_.kill() # Erase ball.
@@ -196,13 +220,12 @@ def pid_sim():
                 ''' PYGAME EVENT HANDLER END '''
 
                 ''' MAZE SIMULATION START '''
-                # Calculate simulation loop time-step.
-                LastSimulationTime = SimulationTime
-                SimulationTime = time.perf_counter()
-                TimeStep = SimulationTime - LastSimulationTime
+                # Calculate loop time-step.
+                LastLoopTime = LoopTime
+                LoopTime = time.perf_counter()
 
-                # Simulate next step of maze using theta and a given timestep.
-                Output = ActiveMaze.next_step(TimeStep, Theta) # Time step given in s.
+                # Simulate the loop time-step in fixed substeps using theta.
+                Output = Integrator.update(LoopTime - LastLoopTime, Theta) # Time step given in s.
 
                 if Output[0] == False:
                     BallLost = 1 # If ball is lost.
@@ -210,36 +233,47 @@ def pid_sim():
 
                 ''' TIMING CONTROL START '''
                 # Limit minimum time period between each control/graphics loop.
-                ControlOn, ControlTimeStep, GraphicsOn = TimingController_.update(time.perf_counter())
+                ControlOn, ControlTimeStep, GraphicsOn = TimingController_.update(Integrator.SimulationTime)
                 ''' TIMING CONTROL END '''
 
                 if ControlOn == True:
                     ''' PID CONTROL START '''
-                    if Output[0] == True: # Check active.
-                        # Set ProcessVariable as the ball's position.
-                        ProcessVariable = Output[1]
+                    # Set ProcessVariable as the measured ball position. None until the first camera frame arrives.
+                    ProcessVariable, Velocity = Sensor.Position if SimulatedCamera == True else ActiveMaze.Ball.S, None
+                    if StateEstimator_ != None: # Use the filtered position and velocity instead.
+                        if SimulatedCamera == False:
+                            StateEstimator_.update(Integrator.SimulationTime, ActiveMaze.Ball.S)
+                        ProcessVariable, Velocity = StateEstimator_.Position, StateEstimator_.Velocity
+                        if Predictor_ != None and ProcessVariable is not None: # Project over the camera latency. The simulated motors are instant.
+                            ProcessVariable, Velocity = Predictor_.predict(ProcessVariable, Velocity, StateEstimator_.Time, Integrator.SimulationTime, Theta)
+                        if KalmanFilterOn == False:
+                            Velocity = None # Only used for prediction.
+                    if Output[0] == True and ProcessVariable is not None: # Check active.
 
                         if CalibrationDone == 0:
                             ''' CALIBRATION START '''
                             # Calibrate to record level theta.
-                            CalibrationDone, ControlSignalCalibrated = Calibrator_.update(ActiveMaze.Ball.S, ControlSignal, time.perf_counter())
+                            CalibrationDone, ControlSignalCalibrated = Calibrator_.update(ProcessVariable, ControlSignal, Integrator.SimulationTime)
                             if CalibrationDone == True:
                                 PID_Controller_.calibrate(ControlSignalCalibrated) # Enter calibrated angle when done.
+                                TraceRecorder_.mark(EventCalibrated)
                             ''' CALIBRATION END '''
                         else:
                             ''' SET POINT HANDLING '''
                             # Use the set point handler to determine if a set point has been completed.
-                            Completed, NewSetPoint, ActiveMaze.Checkpoints = SetPointHandler_.update(ActiveMaze.Ball.S, time.perf_counter())
+                            Completed, NewSetPoint, SetPointIndex = SetPointHandler_.update(ProcessVariable, Integrator.SimulationTime)
                             if NewSetPoint == True:
-                                PID_Controller_.new_setpoint(ActiveMaze.Checkpoints[0]) # Assign first checkpoint as the set point.
+                                PID_Controller_.new_setpoint(SetPointIndex) # Move the controller to the new set point.
+                                TraceRecorder_.mark(EventNewSetPoint)
                             ''' SET POINT HANDLING '''
 
                         # Calculate control signal using the PID controller.
-                        ControlSignal, ProportionalTerm, IntegralTerm, DerivativeTerm, StaticBoost = PID_Controller_.update(ActiveMaze.Ball.S, ControlTimeStep)
+                        ControlSignal, ProportionalTerm, IntegralTerm, DerivativeTerm, StaticBoost = PID_Controller_.update(ProcessVariable, ControlTimeStep, Velocity)
                         Saturation = PID_Controller_.Saturation # For display.
+                        TraceRecorder_.record(Integrator.SimulationTime, ControlTimeStep, ProcessVariable, PID_Controller_, ControlSignal, ProportionalTerm, IntegralTerm, DerivativeTerm, StaticBoost, Velocity)
 
                         # Convert control signal into actual Theta (based on measurements).
-                        Theta = ControlSignal * np.array([0.088888888, 0.6])
+                        Theta = ControlSignal * ControlToTheta
                     ''' PID CONTROL END'''
 
                     ''' MOTOR CONTROL START'''
@@ -248,7 +282,7 @@ def pid_sim():
                     ''' MOTOR CONTROL END '''
 
                 if Completed == 0:
-                    TimeElapsed = time.perf_counter() - StartTime
+                    TimeElapsed = Integrator.SimulationTime
 
                 # Generate strings for output values to be displayed.
                 DisplayValues = {
@@ -267,10 +301,10 @@ def pid_sim():
                 if GraphicsOn == True:
                     # Update Sprite Ball position.
                     if ActiveMaze.Ball.Active == True:
-                        SpriteBall_.update(ActiveMaze.Ball.S)
+                        SpriteBall_.update(Integrator.render_position())
 
                     # Check/update SpriteSetPoint.
-                    while len(ActiveMaze.Checkpoints) < len(ActiveSprites.get_sprites_from_layer(2)):
+                    while Route.Length - SetPointIndex < len(ActiveSprites.get_sprites_from_layer(2)): # One sprite per remaining checkpoint.
                         if len(ActiveSprites.get_sprites_from_layer(2)) != 1:
                             ActiveSprites.get_sprites_from_layer(2)[1].update("SetPoint") # Change next checkpoint to set point.
                         ActiveSprites.get_sprites_from_layer(2)[0].kill() # Remove previous set point.
@@ -323,10 +357,11 @@ def pid_sim():
                                     if Button.CurrentState == "Start":
                                         Button.click(time.perf_counter()) # Animate button click.
                                         PID_Controller_.reset() # Reset PID controller.
+                                        TraceRecorder_.mark(EventReset)
                                         Paused = 0
                                     elif Button.CurrentState == "Reset":
                                         Button.click(time.perf_counter()) # Animate button click.
-                                        ActiveMaze = deepcopy(CurrentMaze) # Reset maze.
+                                        ActiveMaze = CurrentMaze.new_run() # Reset maze.
                                         change_maze(ActiveSprites, CurrentMaze) # Reset certain Sprites.
                                         ActiveSprites.remove_sprites_of_layer(4) # Erase display values.
                                         SpriteBall_.kill() # Erase ball.
@@ -337,22 +372,21 @@ def pid_sim():
                     ''' PYGAME EVENT HANDLER END '''
 
                     ''' MAZE SIMULATION START '''
-                    # Calculate simulation loop time-step.
-                    LastSimulationTime = SimulationTime
-                    SimulationTime = time.perf_counter()
-                    TimeStep = SimulationTime - LastSimulationTime
+                    # Calculate loop time-step.
+                    LastLoopTime = LoopTime
+                    LoopTime = time.perf_counter()
 
-                    # Simulate next step of maze using theta and a given timestep.
-                    Output = ActiveMaze.next_step(TimeStep, Theta) # Time step given in s.
+                    # Simulate the loop time-step in fixed substeps using theta.
+                    Output = Integrator.update(LoopTime - LastLoopTime, Theta) # Time step given in s.
                     ''' MAZE SIMULATION END '''
 
                     ''' TIMING CONTROL START '''
                     # Limit minimum time period between each control/graphics loop.
-                    ControlOn, ControlTimeStep, GraphicsOn = TimingController_.update(time.perf_counter())
+                    ControlOn, ControlTimeStep, GraphicsOn = TimingController_.update(Integrator.SimulationTime)
                     ''' TIMING CONTROL END '''
 
                     DisplayValues = {
-                    0 : "{0:.1f}".format(time.perf_counter() - StartTime), # Time elapsed.
+                    0 : "{0:.1f}".format(Integrator.SimulationTime), # Time elapsed.
                     1 : "( {0:.1f} , {1:.1f} )".format(ActiveMaze.Ball.S[0], ActiveMaze.Ball.S[1]), # Ball position.
                     }
 
@@ -360,12 +394,12 @@ def pid_sim():
                     if GraphicsOn == True:
                         # Update Sprite Ball position.
                         if ActiveMaze.Ball.Active == True:
-                            SpriteBall_.update(ActiveMaze.Ball.S)
+                            SpriteBall_.update(Integrator.render_position())
                         else:
                             SpriteBall_.kill()
 
                         # Check/update SpriteSetPoint.
-                        while len(ActiveMaze.Checkpoints) < len(ActiveSprites.get_sprites_from_layer(2)):
+                        while Route.Length - SetPointIndex < len(ActiveSprites.get_sprites_from_layer(2)): # One sprite per remaining checkpoint.
                             if len(ActiveSprites.get_sprites_from_layer(2)) != 1:
                                 ActiveSprites.get_sprites_from_layer(2)[1].update("SetPoint") # Change next checkpoint to set point.
                             ActiveSprites.get_sprites_from_layer(2)[0].kill() # Remove previous set point.
@@ -411,7 +445,7 @@ def pid_sim():
                                     if Button.CurrentState == "Reset":
                                         Button.click(time.perf_counter()) # Animate button click.
                                         Buttons.get_sprite(0).click(time.perf_counter()) # Change stop button to start.
-                                        ActiveMaze = deepcopy(CurrentMaze) # Reset maze.
+                                        ActiveMaze = CurrentMaze.new_run() # Reset maze.
                                         change_maze(ActiveSprites, CurrentMaze) # Reset certain Sprites.
                                         ActiveSprites.remove_sprites_of_layer(4) # Erase display values.
                                         SpriteBall_.kill() # Erase ball.
@@ -440,5 +474,12 @@ def pid_sim():
     except:
         pass
 
+    try:
+        TraceRecorder_.save(TraceFile) # Export trace of the last run.
+    except NameError:
+        pass # No run was started, so there is no trace.
+    except Exception as Error:
+        print("Could not save the trace to %s: %s" % (TraceFile, Error))
+
 if __name__ == "__main__":
     pid_sim()
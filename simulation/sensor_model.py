@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+'''
+This file contains the simulated camera, which sits between the maze simulation and the
+controller. The ball is captured at the camera frame rate, each frame gets noise and a
+detection latency from the maze's NoiseModel (see simulation/noise.py) and may be dropped.
+Frames wait in a ring buffer until their latency has passed, then the newest one becomes the
+measurement the controller sees. Frames are processed in order, so a frame is never delivered
+before the one captured ahead of it. Call update() after every physics step, as the
+integrators in simulation/ do when given a sensor. Given an Estimator (e.g. a KalmanFilter,
+see control/kalman_filter.py), every delivered frame is also passed to it with its capture
+time.
+'''
+
+# Import modules.
+import numpy as np
+
+# Import settings.
+from settings import CameraFrameRate
+
+class SensorModel():
+
+    def __init__(self, Noise, FrameRate = CameraFrameRate, BufferSize = 64, StartTime = 0.0, Estimator = None):
+        # Noise should be a NoiseModel, normally the maze's (Maze.Noise).
+        if FrameRate <= 0:
+            raise ValueError("FrameRate should be above 0.")
+
+        self.Noise = Noise
+        self.FramePeriod = 1 / FrameRate # [s]
+        self.Estimator = Estimator # Updated with every delivered frame.
+        self.NextFrameTime = StartTime # [s] Time of the next capture.
+
+        # Ring buffer of frames being processed.
+        self.BufferSize = BufferSize
+        self.ReadyTimes = np.zeros(BufferSize) # [s] Time each frame is delivered.
+        self.CaptureTimes = np.zeros(BufferSize) # [s] Time each frame was captured.
+        self.Positions = np.zeros((BufferSize, 2)) # [mm] Measured ball positions.
+        self.Head = 0 # Index of the oldest frame.
+        self.Count = 0 # Number of frames in the buffer.
+
+        # Latest delivered measurement.
+        self.Position = None # [mm] None until the first frame is delivered.
+        self.CaptureTime = None # [s]
+        self.NewMeasurement = False # True if a frame was delivered in the last update.
+        self.Frames, self.DroppedFrames = 0, 0 # Counters.
+
+    def __repr__(self):
+        # Makes the class printable.
+        return "SensorModel(FramePeriod: %s, Buffered: %s, Position: %s, Frames: %s, Dropped: %s)" % (round(self.FramePeriod, 4), self.Count, self.Position, self.Frames, self.DroppedFrames)
+
+    def capture(self, CaptureTime, BallPosition):
+        # Takes a frame and adds it to the buffer, unless it is dropped.
+        self.Frames += 1
+        Position, Latency = self.Noise.sample(BallPosition)
+        if Position is None:
+            self.DroppedFrames += 1
+            return
+        if self.Count == self.BufferSize: # Buffer full: the oldest frame is lost.
+            self.Head = (self.Head + 1) % self.BufferSize
+            self.Count -= 1
+            self.DroppedFrames += 1
+
+        ReadyTime = CaptureTime + Latency
+        if self.Count > 0:
+            ReadyTime = max(ReadyTime, self.ReadyTimes[(self.Head + self.Count - 1) % self.BufferSize]) # Frames are processed in order.
+        Tail = (self.Head + self.Count) % self.BufferSize
+        self.ReadyTimes[Tail], self.CaptureTimes[Tail], self.Positions[Tail] = ReadyTime, CaptureTime, Position
+        self.Count += 1
+
+    def update(self, CurrentTime, BallPosition):
+        # Captures any frames due and delivers any frames whose latency has passed. Returns (NewMeasurement, Position, CaptureTime).
+        while CurrentTime >= self.NextFrameTime:
+            self.capture(self.NextFrameTime, BallPosition)
+            self.NextFrameTime += self.FramePeriod
+
+        self.NewMeasurement = False
+        while self.Count > 0 and self.ReadyTimes[self.Head] <= CurrentTime:
+            self.Position = self.Positions[self.Head].copy()
+            self.CaptureTime = self.CaptureTimes[self.Head]
+            self.Head = (self.Head + 1) % self.BufferSize
+            self.Count -= 1
+            self.NewMeasurement = True
+            if self.Estimator != None:
+                self.Estimator.update(self.CaptureTime, self.Position)
+        return self.NewMeasurement, self.Position, self.CaptureTime
+
+    def time_to_frame(self, CurrentTime):
+        # [s] Time until the next capture or delivery, for event-driven stepping.
+        NextEvent = self.NextFrameTime
+        if self.Count > 0:
+            NextEvent = min(NextEvent, self.ReadyTimes[self.Head])
+        return max(NextEvent - CurrentTime, 0.0)
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
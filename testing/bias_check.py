@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+'''
+This file contains the tilt bias estimator check (see control/bias_estimator.py). The maze is
+simulated with the simulated camera and Kalman filter as in simulation/headless_sim.py, on a
+board that isn't level: its level control signal is Level rather than the zero the
+controller is calibrated with. The estimator learns from the run as it would in full_system,
+for a number of fixed-seed episodes of Duration seconds each, and the ball is restarted
+whenever it falls in a hole. Two scenarios are run with each level:
+ - "tilts": the board is held at a new random tilt (up to MaxTilt) every TiltPeriod seconds,
+   so the ball rolls freely between walls. The estimate has to end within Tolerance of Level
+   on both axes, measured as a tilt (default 0.003 rad, about a sixth of a degree).
+ - "route": the PID controller follows the maze's route. With the default gains it mostly
+   drives the board to its limits, where the estimator takes no samples, so the estimate has
+   to end no further than Tolerance from where it was, or from Level if it started closer.
+   This checks the estimate doesn't drift.
+Run after changing the estimator, e.g. 'python3 -m testing.bias_check'. Exits with status 1 on
+failure.
+'''
+
+# Import modules.
+import argparse
+import os
+import sys
+import tempfile
+import numpy as np
+
+# Import classes and settings.
+from mazes import get_maze
+from control.checkpoint_route import CheckpointRoute
+from control.pid_controller import PID_Controller
+from control.setpoint_handler import SetPointHandler
+from control.kalman_filter import KalmanFilter
+from control.bias_estimator import BiasEstimator
+from simulation.fixed_step import FixedStepIntegrator
+from simulation.sensor_model import SensorModel
+from simulation.noise import NoiseModel
+from settings import Kp, Ki, Kd, PMax, Ks, Kst, Kr, HoleDangerDistance, BufferSize, SaturationLimit, MinTheta, CheckpointRadius, SetPointTime, \
+    SetPointLookAhead, ControlFrequency, ControlToTheta
+
+# Level control signals the board is run with.
+Levels = [np.array([0.0, 0.0]), np.array([0.05, 0.02])]
+Scenarios = ["tilts", "route"]
+
+TiltPeriod = 0.5 # [s] Time between random tilts.
+MaxTilt = 0.03 # [rad] Largest random tilt on each axis.
+
+def run_episode(Maze, Scenario, Seed, Level, Duration):
+    # Runs one episode with the board level at control signal Level. Returns the estimator at the end.
+    Generator = np.random.default_rng(Seed)
+    ControlPeriod = 1 / ControlFrequency
+    TicksPerTilt = max(int(round(TiltPeriod / ControlPeriod)), 1)
+    BiasEstimator_ = BiasEstimator(Filename = os.path.join(tempfile.gettempdir(), "bias_check.json"), Delay = 0, # The simulated motors are instant.
+                                   DistanceField = Maze.Geometry.distance_field())
+    BiasEstimator_.start(np.array([0.0, 0.0]))
+
+    StartTime, Tick = 0.0, 0 # [s] Time the current ball started, as the estimator needs one clock over every ball.
+    while StartTime < Duration:
+        ActiveMaze = Maze.new_run(NoiseModel(int(Generator.integers(2 ** 32))))
+        Route = CheckpointRoute(ActiveMaze.Checkpoints, CheckpointRadius, SetPointTime)
+        Controller = PID_Controller(Kp, Ki, Kd, PMax, Ks, Kst, Route, BufferSize, SaturationLimit, MinTheta,
+                                    ActiveMaze.Geometry.distance_field() if Kr != 0 else None, Kr, HoleDangerDistance) # Only hole repulsion uses the field.
+        Controller.calibrate(np.array([0.0, 0.0]))
+        Estimator = KalmanFilter()
+        Integrator = FixedStepIntegrator(ActiveMaze, Sensor = SensorModel(ActiveMaze.Noise, Estimator = Estimator))
+        SetPointHandler_ = SetPointHandler(ActiveMaze.Ball.S, 0.0, Route, SetPointLookAhead)
+        ControlSignal, LastTime = np.array([0.0, 0.0]), None
+        BiasEstimator_.applied(StartTime, ControlSignal)
+
+        while StartTime + Integrator.SimulationTime < Duration:
+            if Scenario == "tilts" and Tick % TicksPerTilt == 0:
+                ControlSignal = Generator.uniform(- MaxTilt, MaxTilt, 2) / ControlToTheta
+                BiasEstimator_.applied(StartTime + Integrator.SimulationTime, ControlSignal)
+            Integrator.update(ControlPeriod, (ControlSignal - Level) * ControlToTheta)
+            Tick += 1
+            if ActiveMaze.Ball.Active == False:
+                break
+            if Estimator.Active == False:
+                continue # No camera frame yet.
+            if Estimator.Time != LastTime:
+                LastTime = Estimator.Time
+                BiasEstimator_.update(StartTime + Estimator.Time, Estimator.Position, Estimator.Velocity, Controller.ControlSignalCalibrated)
+
+            if Scenario == "route":
+                Completed, NewSetPoint, SetPointIndex = SetPointHandler_.update(Estimator.Position, Integrator.SimulationTime)
+                if Completed == 1:
+                    break
+                if NewSetPoint == True:
+                    Controller.new_setpoint(SetPointIndex)
+                ControlSignal = Controller.update(Estimator.Position, ControlPeriod)[0]
+                BiasEstimator_.applied(StartTime + Integrator.SimulationTime, ControlSignal)
+        StartTime += Integrator.SimulationTime + 1 # Leave a gap so no measurements are compared across balls.
+    return BiasEstimator_
+
+def bias_check(Arguments = None):
+    Parser = argparse.ArgumentParser(description = "Check the tilt bias estimator in simulation.")
+    Parser.add_argument("--mazes", nargs = "+", default = ["Maze3"], help = "mazes to run (default Maze3).")
+    Parser.add_argument("--scenarios", nargs = "+", default = Scenarios, choices = Scenarios, help = "scenarios to run (default all).")
+    Parser.add_argument("--episodes", type = int, default = 3, help = "fixed-seed episodes per maze, scenario and level (default 3).")
+    Parser.add_argument("--duration", type = float, default = 120, help = "simulated seconds per episode (default 120).")
+    Parser.add_argument("--tolerance", type = float, default = 0.003, help = "largest allowed tilt error of the estimate [rad] (default 0.003).")
+    Arguments = Parser.parse_args(Arguments if Arguments != None else [])
+
+    AllPassed = True
+    print("{:<8} {:<9} {:>5} {:>14} {:>18} {:>12} {:>18}  {}".format("Maze", "Scenario", "Seed", "Level", "Estimate", "Samples", "Tilt error [rad]", "Result"))
+    for MazeName in Arguments.mazes:
+        Maze = get_maze(MazeName)
+        for Scenario in Arguments.scenarios:
+            for Level in Levels:
+                for Seed in range(Arguments.episodes):
+                    BiasEstimator_ = run_episode(Maze, Scenario, Seed, Level, Arguments.duration)
+                    TiltError = np.abs(BiasEstimator_.Bias - Level) * ControlToTheta
+                    Allowed = Arguments.tolerance
+                    if Scenario == "route":
+                        Allowed = np.maximum(np.abs(Level) * ControlToTheta, Arguments.tolerance) # No further than it started.
+                    Passed = np.all(TiltError <= Allowed + 1e-12)
+                    AllPassed = AllPassed and Passed
+                    print("{:<8} {:<9} {:>5} {:>14} {:>18} {:>12} {:>18}  {}".format(MazeName, Scenario, Seed, str(np.round(Level, 3)),
+                          str(np.round(BiasEstimator_.Bias, 4)), str(BiasEstimator_.Samples), str(np.round(TiltError, 4)), "PASS" if Passed == True else "FAIL"))
+    if AllPassed == False:
+        sys.exit(1)
+    return AllPassed
+
+if __name__ == "__main__":
+    bias_check(sys.argv[1:])
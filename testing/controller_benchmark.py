@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+'''
+This file contains the controller benchmark, which compares the PID controller with the
+model-predictive controller (control/mpc_controller.py) in the headless simulator. Each maze
+is run for a number of seeded episodes with each controller, with the simulated camera's
+noise and latency, and the benchmark reports how many episodes completed the route, the mean
+completion time and route progress, and the mean and longest time a controller update took.
+The longest update is also given as a percentage of the control period (1 / ControlFrequency),
+which must stay well under 100 % with room for the slower Pi, e.g.
+'python3 -m testing.controller_benchmark --output controllers.json'.
+'''
+
+# Import modules.
+import argparse
+import json
+import platform
+import sys
+import numpy as np
+
+# Import functions and settings.
+from mazes import get_maze
+from simulation.headless_sim import run_pid_episode
+from settings import ControlFrequency
+
+# Mazes with routes to follow.
+BenchmarkMazes = ["Maze1", "Maze2", "Maze3"]
+
+# Controller name: run_pid_episode arguments.
+Controllers = {
+"pid" : {"MPC" : False, "Camera" : True},
+"mpc" : {"MPC" : True, "Camera" : True}
+}
+
+def benchmark(MazeNames, ControllerNames, Episodes, MaxTime):
+    # Runs every maze with every controller. Returns a list of result dictionaries.
+    Results = []
+    for MazeName in MazeNames:
+        Maze = get_maze(MazeName)
+        for ControllerName in ControllerNames:
+            Episodes_ = [run_pid_episode(Maze, Seed, MaxTime, **Controllers[ControllerName]) for Seed in range(Episodes)]
+            CompletionTimes = [Episode["Time"] for Episode in Episodes_ if Episode["Completed"] == True]
+            MaxUpdateTime = max(Episode["MaxUpdateTime"] for Episode in Episodes_)
+            Results.append({
+                "Maze" : MazeName, "Controller" : ControllerName, "Episodes" : Episodes,
+                "Completed" : len(CompletionTimes), "BallsLost" : sum(Episode["BallLost"] for Episode in Episodes_),
+                "CompletionTime" : float(np.mean(CompletionTimes)) if len(CompletionTimes) > 0 else None, # [s]
+                "Progress" : float(np.mean([Episode["Progress"] for Episode in Episodes_])),
+                "UpdateTime" : float(np.mean([Episode["UpdateTime"] for Episode in Episodes_])), # [s]
+                "MaxUpdateTime" : MaxUpdateTime, # [s]
+                "Budget" : MaxUpdateTime * ControlFrequency # Fraction of the control period used by the longest update.
+            })
+    return Results
+
+def controller_benchmark(Arguments = None):
+    Parser = argparse.ArgumentParser(description = "Compare the PID and model-predictive controllers in the headless simulator.")
+    Parser.add_argument("--mazes", nargs = "+", default = BenchmarkMazes, choices = BenchmarkMazes, help = "mazes to run (default all).")
+    Parser.add_argument("--controllers", nargs = "+", default = list(Controllers), choices = list(Controllers), help = "controllers to run (default all).")
+    Parser.add_argument("--episodes", type = int, default = 5, help = "seeded episodes per maze and controller (default 5).")
+    Parser.add_argument("--max-time", type = float, default = 60, help = "simulated seconds before an episode is stopped (default 60).")
+    Parser.add_argument("--output", help = "write the results to this JSON file.")
+    Arguments = Parser.parse_args(Arguments if Arguments != None else [])
+
+    Results = benchmark(Arguments.mazes, Arguments.controllers, Arguments.episodes, Arguments.max_time)
+
+    print("{:<8} {:<10} {:>10} {:>10} {:>10} {:>12} {:>12} {:>8}".format("Maze", "Controller", "Completed", "Time [s]", "Progress", "Update [ms]", "Max [ms]", "Budget"))
+    for Result in Results:
+        CompletionTime = "-" if Result["CompletionTime"] == None else "{:.1f}".format(Result["CompletionTime"])
+        print("{:<8} {:<10} {:>10} {:>10} {:>10.2f} {:>12.2f} {:>12.2f} {:>7.0f}%".format(Result["Maze"], Result["Controller"],
+              "%s/%s" % (Result["Completed"], Result["Episodes"]), CompletionTime, Result["Progress"], Result["UpdateTime"] * 1e3,
+              Result["MaxUpdateTime"] * 1e3, Result["Budget"] * 100))
+
+    if Arguments.output != None:
+        Report = {"Python" : platform.python_version(), "NumPy" : np.__version__, "Machine" : platform.machine(), "Processor" : platform.processor(),
+                  "Episodes" : Arguments.episodes, "MaxTime" : Arguments.max_time, "Results" : Results}
+        with open(Arguments.output, "w") as ResultFile:
+            json.dump(Report, ResultFile, indent = 2)
+    return Results
+
+if __name__ == "__main__":
+    controller_benchmark(sys.argv[1:])
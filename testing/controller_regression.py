@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+'''
+This file contains the controller regression benchmark. Every trace in testing/traces/ is
+replayed through a PID_Controller built from the settings saved with it (see
+control/trace_recorder.py), and the outputs must match the recorded ones within the tolerance.
+The references are simulator traces made with record_references(); traces recorded on the rig
+by full_system (trace.npz) can be copied into the folder to be checked as well. Each trace is
+replayed until at least MinTicks updates have been timed, and the distribution of the time per
+update is printed. Run before deploying control changes to the Pi, e.g.
+'python3 -m testing.controller_regression', with --record to make new references after an
+intended change in behaviour. Exits with status 1 if any trace doesn't match.
+'''
+
+# Import modules.
+import argparse
+import glob
+import json
+import os
+import sys
+import numpy as np
+
+# Import classes and functions.
+from mazes import get_maze
+from control.trace_recorder import TraceRecorder, load_trace, replay_trace, compare_traces
+from simulation.headless_sim import run_pid_episode
+
+# Folder containing the reference traces.
+TraceFolder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "traces")
+
+# Reference simulator episodes: trace file name: (maze name, noise seed, other run_pid_episode options). Each one completes its route, so the
+# traces cover every set point. Maze1 and Maze2 aren't used as no PID gains found so far complete them in the simulator.
+ReferenceEpisodes = {
+"maze3_sim.npz" : ("Maze3", 3, {}), # Exact ball position.
+"maze3_camera_sim.npz" : ("Maze3", 3, {"Camera" : True}), # Simulated camera, so the derivative term works on noisy positions.
+"maze3_kalman_sim.npz" : ("Maze3", 3, {"Camera" : True, "Kalman" : True, "MaxTime" : 120}) # Kalman filtered position and velocity.
+}
+
+def record_references():
+    # Runs the reference episodes and saves their traces.
+    os.makedirs(TraceFolder, exist_ok = True)
+    for Filename, (MazeName, Seed, Options) in ReferenceEpisodes.items():
+        Recorder = TraceRecorder()
+        Result = run_pid_episode(get_maze(MazeName), Seed, Recorder = Recorder, **Options)
+        Recorder.save(os.path.join(TraceFolder, Filename))
+        print("Recorded {}: {} ticks, completed: {}".format(Filename, Recorder.Count, Result["Completed"]))
+
+def timing_summary(UpdateTimes):
+    # Percentiles of the time per update in microseconds.
+    Percentiles = np.percentile(UpdateTimes, [50, 90, 99]) * 1e6
+    return {"Updates" : len(UpdateTimes), "Mean" : float(np.mean(UpdateTimes) * 1e6), "P50" : float(Percentiles[0]), "P90" : float(Percentiles[1]),
+            "P99" : float(Percentiles[2]), "Max" : float(np.max(UpdateTimes) * 1e6)}
+
+def check_trace(Filename, Tolerance, MinTicks):
+    # Replays one trace. Returns (passed, largest difference per output, timing summary).
+    Trace_ = load_trace(Filename)
+    if Trace_.Length == 0:
+        raise ValueError("%s has no control ticks." % (Filename))
+    Differences = compare_traces(Trace_, replay_trace(Trace_))
+    Passed = max(Differences.values()) <= Tolerance
+
+    UpdateTimes = []
+    for _ in range(int(np.ceil(MinTicks / Trace_.Length))):
+        UpdateTimes.append(replay_trace(Trace_).UpdateTimes)
+    return Passed, Differences, timing_summary(np.concatenate(UpdateTimes))
+
+def controller_regression(Arguments = None):
+    Parser = argparse.ArgumentParser(description = "Replay recorded traces through the PID controller and time it.")
+    Parser.add_argument("--record", action = "store_true", help = "record new simulator reference traces first.")
+    Parser.add_argument("--tolerance", type = float, default = 1e-9, help = "largest allowed output difference (default 1e-9).")
+    Parser.add_argument("--min-ticks", type = int, default = 5000, help = "minimum updates timed per trace (default 5000).")
+    Parser.add_argument("--json", help = "also write the results to this file.")
+    Arguments = Parser.parse_args(Arguments if Arguments != None else [])
+
+    if Arguments.record == True:
+        record_references()
+
+    Filenames = sorted(glob.glob(os.path.join(TraceFolder, "*.npz")) + glob.glob(os.path.join(TraceFolder, "*.bin")))
+    if len(Filenames) == 0:
+        raise FileNotFoundError("No traces found in %s. Use --record to make the simulator references." % (TraceFolder))
+
+    Results, AllPassed = {}, True
+    print("{:<20} {:>6} {:>12} {:>10} {:>10} {:>10} {:>10}".format("Trace", "Result", "Difference", "P50 [us]", "P90 [us]", "P99 [us]", "Max [us]"))
+    for Filename in Filenames:
+        Passed, Differences, Timing = check_trace(Filename, Arguments.tolerance, Arguments.min_ticks)
+        AllPassed = AllPassed and Passed
+        Name = os.path.basename(Filename)
+        Results[Name] = {"Passed" : Passed, "Differences" : Differences, "Timing" : Timing}
+        print("{:<20} {:>6} {:>12.3g} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}".format(Name, "PASS" if Passed else "FAIL", max(Differences.values()),
+              Timing["P50"], Timing["P90"], Timing["P99"], Timing["Max"]))
+
+    if Arguments.json != None:
+        with open(Arguments.json, "w") as ResultFile:
+            json.dump(Results, ResultFile, indent = 2)
+    if AllPassed == False:
+        sys.exit(1)
+    return Results
+
+if __name__ == "__main__":
+    controller_regression(sys.argv[1:])
@@ -15,7 +15,6 @@ import cv2
 import pygame
 import numpy as np
 from time import sleep, perf_counter
-from copy import deepcopy
 
 # Import classes, functions and values.
 from mazes import Maze1, Maze2, Maze3
@@ -118,7 +117,7 @@ def image_detection_test():
         if SystemRunning == 1:
 
             # Set ActiveMaze as a copy of CurrentMaze.
-            ActiveMaze = deepcopy(CurrentMaze)
+            ActiveMaze = CurrentMaze.new_run()
 
             # Check ActiveMaze is correct type.
             if type(ActiveMaze) != Maze:
@@ -190,7 +189,7 @@ def image_detection_test():
                                 elif Button.CurrentState == "Reset":
                                     Button.click(perf_counter()) # Animate button click.
                                     Buttons.get_sprite(0).click(perf_counter()) # Change stop button to start.
-                                    ActiveMaze = deepcopy(CurrentMaze) # Reset maze.
+                                    ActiveMaze = CurrentMaze.new_run() # Reset maze.
                                     change_maze(ActiveSprites, CurrentMaze) # Reset certain Sprites.
                                     ActiveSprites.remove_sprites_of_layer(4) # Erase display values.
                                     SpriteBall_.kill() # Erase ball.
@@ -289,7 +288,7 @@ def image_detection_test():
                                         Paused = 0
                                     elif Button.CurrentState == "Reset":
                                         Button.click(perf_counter()) # Animate button click.
-                                        ActiveMaze = deepcopy(CurrentMaze) # Reset maze.
+                                        ActiveMaze = CurrentMaze.new_run() # Reset maze.
                                         change_maze(ActiveSprites, CurrentMaze) # Reset certain Sprites.
                                         ActiveSprites.remove_sprites_of_layer(4) # Erase display values.
                                         SpriteBall_.kill() # Erase ball.
@@ -383,7 +382,7 @@ def image_detection_test():
                                     if Button.CurrentState == "Reset":
                                         Button.click(perf_counter()) # Animate button click.
                                         Buttons.get_sprite(0).click(perf_counter()) # Change stop button to start.
-                                        ActiveMaze = deepcopy(CurrentMaze) # Reset maze.
+                                        ActiveMaze = CurrentMaze.new_run() # Reset maze.
                                         change_maze(ActiveSprites, CurrentMaze) # Reset certain Sprites.
                                         ActiveSprites.remove_sprites_of_layer(4) # Erase display values.
                                         SpriteBall_.kill() # Erase ball.
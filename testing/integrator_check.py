@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+'''
+This file contains the integrator accuracy check, which compares the event-driven integrator
+(simulation/event_driven.py) with the fixed time-step integrator (simulation/fixed_step.py).
+Each maze is run open loop with FixedStepIntegrator for a number of fixed-seed episodes, tilted
+to a new random angle every TiltPeriod seconds as in testing/simulation_benchmark.py. At every
+control tick, a copy of the ball is also advanced over the same control period with
+EventDrivenIntegrator, and the distance between the two end positions is recorded. The check
+passes if no tick ends more than Tolerance apart (default 0.6 mm), which is about how far
+the fixed integrator itself ends ticks from the same integrator with a 20 times shorter time
+step. Ticks are compared from the same start rather than whole runs, as wall bounces amplify
+any difference, so two runs with different integrators (or time steps) drift apart over a few
+seconds however accurate each one is. Run after changing the ball model or either integrator,
+e.g. 'python3 -m testing.integrator_check'. Exits with status 1 on failure.
+'''
+
+# Import modules.
+import argparse
+import sys
+import numpy as np
+
+# Import classes and settings.
+from mazes import get_maze
+from simulation.fixed_step import FixedStepIntegrator
+from simulation.event_driven import EventDrivenIntegrator
+from settings import ControlFrequency
+
+TiltPeriod = 0.5 # [s] Time between random tilts.
+MaxTilt = 0.03 # [rad] Largest random tilt on each axis.
+
+def tick_differences(Maze, Seed, Duration):
+    # Runs one open loop episode. Returns the end position differences [mm] of the ticks where the ball stayed on the maze with both integrators.
+    Generator = np.random.default_rng(Seed)
+    ControlPeriod = 1 / ControlFrequency
+    TicksPerTilt = max(int(round(TiltPeriod / ControlPeriod)), 1)
+    ActiveMaze = Maze.new_run()
+    Integrator = FixedStepIntegrator(ActiveMaze)
+    Differences = []
+    for Tick in range(int(round(Duration / ControlPeriod))):
+        if Tick % TicksPerTilt == 0:
+            Theta = Generator.uniform(- MaxTilt, MaxTilt, 2)
+        EventMaze = ActiveMaze.new_run() # Copy of the ball as it is now.
+        EventDrivenIntegrator(EventMaze).update(ControlPeriod, Theta)
+        Integrator.update(ControlPeriod, Theta)
+        if ActiveMaze.Ball.Active == False or EventMaze.Ball.Active == False:
+            break
+        Differences.append(np.hypot(*(ActiveMaze.Ball.S - EventMaze.Ball.S)))
+    return Differences
+
+def integrator_check(Arguments = None):
+    Parser = argparse.ArgumentParser(description = "Compare the event-driven and fixed time-step integrators.")
+    Parser.add_argument("--mazes", nargs = "+", default = ["Maze1", "Maze2", "Maze3"], help = "mazes to run (default Maze1 Maze2 Maze3).")
+    Parser.add_argument("--episodes", type = int, default = 10, help = "fixed-seed episodes per maze (default 10).")
+    Parser.add_argument("--duration", type = float, default = 4, help = "simulated seconds per episode (default 4).")
+    Parser.add_argument("--tolerance", type = float, default = 0.6, help = "largest allowed difference after a tick [mm] (default 0.6).")
+    Arguments = Parser.parse_args(Arguments if Arguments != None else [])
+
+    AllPassed = True
+    print("{:<10} {:>8} {:>12} {:>12} {:>12}  {}".format("Maze", "Ticks", "Median [mm]", "P90 [mm]", "Max [mm]", "Result"))
+    for MazeName in Arguments.mazes:
+        Maze = get_maze(MazeName)
+        Differences = np.concatenate([tick_differences(Maze, Seed, Arguments.duration) for Seed in range(Arguments.episodes)])
+        Passed = len(Differences) > 0 and np.max(Differences) <= Arguments.tolerance
+        AllPassed = AllPassed and Passed
+        if len(Differences) == 0:
+            Differences = np.array([np.nan])
+        print("{:<10} {:>8} {:>12.3f} {:>12.3f} {:>12.3f}  {}".format(MazeName, len(Differences), np.median(Differences), np.percentile(Differences, 90),
+              np.max(Differences), "PASS" if Passed == True else "FAIL"))
+    if AllPassed == False:
+        sys.exit(1)
+    return AllPassed
+
+if __name__ == "__main__":
+    integrator_check(sys.argv[1:])
@@ -10,7 +10,6 @@ from time import sleep, perf_counter
 
 # Import functions.
 from motor_control.motor_control import motor_angle, motor_reset
-from motor_control.motor_control_2 import MotorController
 
 def test1():
     motor_reset()
@@ -30,6 +29,7 @@ def test1():
     print(round(TimeStep * 1000, 2))
 
 def test2():
+    from motor_control.motor_control_2 import MotorController # Needs rpi_hardware_pwm, so only import it for this test.
     MotorController_ = MotorController()
     MotorController_.start()
     LastTime = perf_counter()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+'''
+This file contains the simulation throughput benchmark. Each maze is run for a number of
+fixed-seed headless episodes with each physics engine. In an episode the maze is tilted to a
+new random angle every TiltPeriod seconds, and the ball is restarted whenever it falls in a
+hole, until Duration seconds have been simulated. The benchmark reports physics steps per
+second, wall collisions resolved per second, simulated seconds per second and the memory
+used by each ball's run state (Maze.new_run). Results are printed as a table and can be
+written as JSON with --output, to compare between versions, e.g.
+'python3 -m testing.simulation_benchmark --output bench.json'.
+'''
+
+# Import modules.
+import argparse
+import importlib
+import json
+import platform
+import sys
+import tracemalloc
+import numpy as np
+from time import perf_counter
+
+# Import classes and settings.
+from simulation.fixed_step import FixedStepIntegrator
+from simulation.event_driven import EventDrivenIntegrator
+from simulation.noise import NoiseModel
+from simulation.maze_generator import generated_maze
+from settings import ControlFrequency
+
+# Maze name: module the maze is defined in. Mazes are only imported when benchmarked.
+BenchmarkMazes = {
+"SandboxMaze" : "simulation.objects",
+"CircleMaze" : "simulation.objects",
+"SimpleMaze" : "simulation.objects",
+"Maze1" : "mazes",
+"Maze2" : "mazes"
+}
+
+# Generated maze name: number of walls. Generated with seed 0 and cached, see simulation/maze_generator.py.
+GeneratedBenchmarkMazes = {
+"Generated100" : 100,
+"Generated1000" : 1000
+}
+
+# Engine name: (integrator class, swept collision).
+Engines = {
+"fixed" : (FixedStepIntegrator, True), # Fixed time-step with swept collision.
+"fixed-legacy" : (FixedStepIntegrator, False), # Fixed time-step with the original per-step collision checks.
+"event" : (EventDrivenIntegrator, True) # Event-driven.
+}
+
+TiltPeriod = 0.5 # [s] Time between random tilts.
+MaxTilt = 0.03 # [rad] Largest random tilt on each axis.
+
+def run_episode(Maze, Engine, Seed, Duration):
+    # Runs one episode. Returns (physics steps, collisions, balls lost, wall time).
+    Generator = np.random.default_rng(Seed)
+    Integrator_, Swept = Engines[Engine]
+    ControlPeriod = 1 / ControlFrequency
+    TicksPerTilt = max(int(round(TiltPeriod / ControlPeriod)), 1)
+    Steps, Collisions, BallsLost, SimulationTime, Tick = 0, 0, 0, 0.0, 0
+
+    StartTime = perf_counter()
+    while SimulationTime < Duration:
+        ActiveMaze = Maze.new_run(NoiseModel(int(Generator.integers(2 ** 32))))
+        ActiveMaze.SweptCollision = Swept
+        Integrator = Integrator_(ActiveMaze)
+        while SimulationTime + Integrator.SimulationTime < Duration and ActiveMaze.Ball.Active == True:
+            if Tick % TicksPerTilt == 0:
+                Theta = Generator.uniform(- MaxTilt, MaxTilt, 2)
+            Integrator.update(ControlPeriod, Theta)
+            Tick += 1
+        Steps += Integrator.Steps
+        Collisions += ActiveMaze.Ball.Collisions
+        SimulationTime += Integrator.SimulationTime
+        if ActiveMaze.Ball.Active == False:
+            BallsLost += 1
+    return Steps, Collisions, BallsLost, perf_counter() - StartTime
+
+def memory_per_ball(Maze, Count = 200):
+    # [B] Memory allocated for each ball's run state.
+    tracemalloc.start()
+    Before = tracemalloc.get_traced_memory()[0]
+    Runs = [Maze.new_run(NoiseModel(Seed)) for Seed in range(Count)]
+    After = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del Runs
+    return (After - Before) / Count
+
+def benchmark_maze(MazeName):
+    # Returns the named benchmark maze.
+    if MazeName in GeneratedBenchmarkMazes:
+        return generated_maze(0, GeneratedBenchmarkMazes[MazeName])
+    return getattr(importlib.import_module(BenchmarkMazes[MazeName]), MazeName)
+
+def benchmark(MazeNames, EngineNames, Episodes, Duration):
+    # Runs every maze with every engine. Returns a list of result dictionaries.
+    Results = []
+    for MazeName in MazeNames:
+        Maze = benchmark_maze(MazeName)
+        Maze.Geometry.distance_field() # Built once per maze, not part of the timing.
+        Memory = memory_per_ball(Maze)
+        for Engine in EngineNames:
+            Steps, Collisions, BallsLost, WallTime = 0, 0, 0, 0.0
+            for Seed in range(Episodes):
+                Totals = run_episode(Maze, Engine, Seed, Duration)
+                Steps, Collisions, BallsLost, WallTime = Steps + Totals[0], Collisions + Totals[1], BallsLost + Totals[2], WallTime + Totals[3]
+            Results.append({
+                "Maze" : MazeName, "Engine" : Engine, "Walls" : len(Maze.Walls), "Holes" : len(Maze.Holes),
+                "Steps" : Steps, "Collisions" : Collisions, "BallsLost" : BallsLost,
+                "SimulatedTime" : Episodes * Duration, "WallTime" : WallTime,
+                "StepsPerSecond" : Steps / WallTime, "CollisionsPerSecond" : Collisions / WallTime,
+                "RealTimeFactor" : Episodes * Duration / WallTime, "MemoryPerBall" : Memory
+            })
+    return Results
+
+def simulation_benchmark(Arguments = None):
+    Parser = argparse.ArgumentParser(description = "Benchmark headless simulation throughput.")
+    MazeNames = list(BenchmarkMazes) + list(GeneratedBenchmarkMazes)
+    Parser.add_argument("--mazes", nargs = "+", default = MazeNames, choices = MazeNames, help = "mazes to run (default all).")
+    Parser.add_argument("--engines", nargs = "+", default = list(Engines), choices = list(Engines), help = "engines to run (default all).")
+    Parser.add_argument("--episodes", type = int, default = 3, help = "fixed-seed episodes per maze and engine (default 3).")
+    Parser.add_argument("--duration", type = float, default = 20, help = "simulated seconds per episode (default 20).")
+    Parser.add_argument("--output", help = "write the results to this JSON file.")
+    Arguments = Parser.parse_args(Arguments if Arguments != None else [])
+
+    Results = benchmark(Arguments.mazes, Arguments.engines, Arguments.episodes, Arguments.duration)
+
+    print("{:<14} {:<13} {:>10} {:>14} {:>12} {:>12} {:>12}".format("Maze", "Engine", "Steps/s", "Collisions/s", "Real time x", "Balls lost", "B/ball"))
+    for Result in Results:
+        print("{:<14} {:<13} {:>10.0f} {:>14.0f} {:>12.1f} {:>12} {:>12.0f}".format(Result["Maze"], Result["Engine"], Result["StepsPerSecond"],
+              Result["CollisionsPerSecond"], Result["RealTimeFactor"], Result["BallsLost"], Result["MemoryPerBall"]))
+
+    if Arguments.output != None:
+        Report = {"Python" : platform.python_version(), "NumPy" : np.__version__, "Machine" : platform.machine(), "Processor" : platform.processor(),
+                  "Episodes" : Arguments.episodes, "Duration" : Arguments.duration, "Results" : Results}
+        with open(Arguments.output, "w") as ResultFile:
+            json.dump(Report, ResultFile, indent = 2)
+    return Results
+
+if __name__ == "__main__":
+    simulation_benchmark(sys.argv[1:])